@@ -1,2 +1,2 @@
 export DJANGO_SETTINGS_MODULE="purbeurre_project.settings.prod"
-. /home/etiennody/.local/share/virtualenvs/purbeurre-xPbW4kZb/bin/activate && /home/etiennody/purbeurre/manage.py import_off
+. /home/etiennody/.local/share/virtualenvs/purbeurre-xPbW4kZb/bin/activate && /home/etiennody/purbeurre/manage.py import_off --delta --shadow && /home/etiennody/purbeurre/manage.py mirror_images
@@ -9,4 +9,8 @@ class ProductConfig(AppConfig):
     Args:
         AppConfig (subclass): instance for product installed application
     """
-    name = 'product'
+
+    name = "product"
+
+    def ready(self):
+        import product.signals  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
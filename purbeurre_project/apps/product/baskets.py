@@ -0,0 +1,128 @@
+"""Substitutes of a basket: the best substitutes of several products found
+in one query, read from the ranked substitutes of the products computed
+after the last import and counted on the categories of the others
+"""
+import re
+
+from product.models import Product, ProductSubstitute
+
+# products of a basket looked up at once
+MAX_BASKET = 50
+# largest id of a product, the ids being Postgres integers
+MAX_PRODUCT_ID = 2**31 - 1
+# substitutes returned per product, a page of the substitute results
+BASKET_SUBSTITUTES = 6
+# barcode of a product in the url of Open Food Facts
+BARCODE = re.compile(r"/produit/([0-9]+)")
+# the same barcode in SQL, the expression indexed by product_product_barcode
+BARCODE_SQL = "substring(url from '/produit/([0-9]+)')"
+
+
+def barcode(url):
+    """Barcode of a product from its url
+
+    Args:
+        url (string): url of the product on Open Food Facts
+
+    Returns:
+        string: barcode of the product, None for another url
+    """
+    found = BARCODE.search(url or "")
+    return found.group(1) if found else None
+
+
+def basket_substitutes(ids=(), codes=(), limit=BASKET_SUBSTITUTES, common=4):
+    """Best substitutes of the products of a basket, in one query
+
+    Args:
+        ids (list, optional): ids of the products. Defaults to ().
+        codes (list, optional): barcodes of the products. Defaults to ().
+        limit (int, optional): substitutes per product.
+        Defaults to BASKET_SUBSTITUTES.
+        common (int, optional): categories shared with a product whose
+        substitutes are not ranked yet. Defaults to 4.
+
+    Returns:
+        dictionnary: product and list of substitutes, by id of the product
+    """
+    products = Product._meta.db_table
+    through = Product.categories.through._meta.db_table
+    ranked = ProductSubstitute._meta.db_table
+    rows = Product.objects.raw(
+        f"""
+        WITH requested AS (
+            SELECT id, nutrition_grade, substitutes_computed
+            FROM {products}
+            WHERE id = ANY(%(ids)s::integer[])
+            -- each lookup reads its own index
+            UNION SELECT id, nutrition_grade, substitutes_computed
+            FROM {products}
+            WHERE {BARCODE_SQL} = ANY(%(codes)s::text[])
+        ),
+        ranked AS (
+            SELECT link.product_id AS requested_id, link.substitute_id, link.rank
+            FROM requested
+            JOIN {ranked} link ON link.product_id = requested.id
+            WHERE requested.substitutes_computed AND link.rank <= %(limit)s
+        ),
+        shared AS (
+            SELECT mine.product_id, other.product_id AS substitute_id
+            FROM requested
+            JOIN {through} mine ON mine.product_id = requested.id
+            JOIN {through} other
+                ON other.category_id = mine.category_id
+                AND other.product_id <> mine.product_id
+            WHERE NOT requested.substitutes_computed
+            GROUP BY mine.product_id, other.product_id
+            HAVING count(*) >= %(common)s
+        ),
+        candidates AS (
+            SELECT DISTINCT ON (
+                shared.product_id, substitute.nutrition_grade, substitute.energy_100g
+            )
+                shared.product_id, substitute.id AS substitute_id,
+                substitute.nutrition_grade, substitute.energy_100g
+            FROM shared
+            JOIN requested ON requested.id = shared.product_id
+            JOIN {products} substitute ON substitute.id = shared.substitute_id
+            WHERE substitute.nutrition_grade <= requested.nutrition_grade
+            ORDER BY shared.product_id, substitute.nutrition_grade,
+                substitute.energy_100g, substitute.id
+        ),
+        live AS (
+            SELECT product_id AS requested_id, substitute_id,
+                row_number() OVER (
+                    PARTITION BY product_id
+                    ORDER BY nutrition_grade, energy_100g, substitute_id
+                ) AS rank
+            FROM candidates
+        ),
+        found AS (
+            -- the products of the basket come first, with the rank 0
+            SELECT id AS requested_id, id AS substitute_id, 0 AS rank
+            FROM requested
+            UNION ALL SELECT * FROM ranked
+            UNION ALL SELECT * FROM live WHERE rank <= %(limit)s
+        )
+        SELECT product.id, product.name, product.nutrition_grade,
+            product.energy_100g, product.url, product.image_url,
+            product.thumbnail, product.thumbnail_webp,
+            found.requested_id, found.rank
+        FROM found
+        JOIN {products} product ON product.id = found.substitute_id
+        ORDER BY found.requested_id, found.rank
+        """,
+        {
+            "ids": list(ids),
+            "codes": list(codes),
+            "limit": limit,
+            "common": common,
+        },
+    )
+    basket = {}
+    for row in rows:
+        if row.rank == 0:
+            basket[row.requested_id] = {"product": row, "substitutes": []}
+        else:
+            basket[row.requested_id]["substitutes"].append(row)
+    return basket
@@ -0,0 +1,259 @@
+"""In-process substitute engine: the categories of the products are loaded
+once per worker into bitsets, or into arrays of positions for the smaller
+ones, so that finding the substitutes of a product intersects a few sets
+in memory instead of joining the category table
+"""
+import threading
+import time
+from bisect import bisect_right
+
+from django.conf import settings
+from django.db import connection
+from product.models import Product
+
+# a category of more products than the catalogue divided by DENSE_SHARE is
+# kept as a bitset of the catalogue, smaller than the array of the positions
+# of its products, 4 bytes each
+DENSE_SHARE = 32
+
+
+def set_positions(bitset, size):
+    """Positions of the bits set in a bitset
+
+    Args:
+        bitset (int): bitset of positions
+        size (int): bytes of the bitset
+
+    Returns:
+        ndarray: positions, in order
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    data = np.frombuffer(bitset.to_bytes(size, "little"), np.uint8)
+    # the bytes holding no bits are skipped before they are unpacked
+    nonzero = np.flatnonzero(data)
+    bits = np.unpackbits(data[nonzero][:, None], axis=1, bitorder="little")
+    rows, columns = np.nonzero(bits)
+    return nonzero[rows] * 8 + columns
+
+
+class SubstituteIndex:
+    """SubstituteIndex keeps a bitset of the products of each large category,
+    and the sorted positions of the products of each smaller one.
+    The products are numbered by nutrition grade, energy then id, so that
+    the grades as good as a product form a prefix of the positions and the
+    positions come out in the order of the substitute results
+
+    Args:
+        products (iterable): id, nutrition grade and energy of the products
+        memberships (iterable): product id and category id of the categories
+    """
+
+    def __init__(self, products, memberships):
+        # NumPy is loaded by the workers serving the index only
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        ordered = sorted(
+            products, key=lambda product: (product[1], product[2], product[0])
+        )
+        self.ids = [product[0] for product in ordered]
+        self.keys = [(product[1], product[2]) for product in ordered]
+        self.positions = {
+            product_id: index for index, product_id in enumerate(self.ids)
+        }
+        grades = [key[0] for key in self.keys]
+        self.grade_ends = {grade: bisect_right(grades, grade) for grade in set(grades)}
+        self.categories = [[] for _ in self.ids]
+        members = {}
+        for product_id, category_id in memberships:
+            position = self.positions.get(product_id)
+            if position is not None:
+                self.categories[position].append(category_id)
+                members.setdefault(category_id, []).append(position)
+        self.size = len(self.ids) // 8 + 1
+        self.bitsets = {}
+        self.sparse = {}
+        for category_id, positions in members.items():
+            # a category of a single product is shared with no other
+            if len(positions) < 2:
+                continue
+            if len(positions) * DENSE_SHARE <= len(self.ids):
+                self.sparse[category_id] = np.sort(np.array(positions, dtype=np.int32))
+                continue
+            bits = bytearray(self.size)
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+            self.bitsets[category_id] = int.from_bytes(bits, "little")
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        """Load the index from the database
+
+        Returns:
+            SubstituteIndex: index of the products imported
+        """
+        return cls(
+            Product.objects.values_list(
+                "id", "nutrition_grade", "energy_100g"
+            ).iterator(),
+            Product.categories.through.objects.values_list(
+                "product_id", "category_id"
+            ).iterator(),
+        )
+
+    def __contains__(self, product_id):
+        return product_id in self.positions
+
+    def matches(self, product_id, nb_common_categories=4):
+        """Products sharing categories with a product, with a grade
+        as good or better: the positions of the smaller categories are
+        counted, and the products short of categories are looked up in
+        the bitsets of the large ones
+
+        Args:
+            product_id (int): id of the product
+            nb_common_categories (int, optional): number of categories
+            shared with the product. Defaults to 4.
+
+        Returns:
+            ndarray: positions of the products matching, in order
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        position = self.positions[product_id]
+        end = self.grade_ends[self.keys[position][0]]
+        categories = self.categories[position]
+        sparse = [self.sparse[key] for key in categories if key in self.sparse]
+        dense = [self.bitsets[key] for key in categories if key in self.bitsets]
+        if len(sparse) + len(dense) < nb_common_categories:
+            return np.array([], dtype=np.int64)
+        candidates, counts = np.unique(
+            np.concatenate(
+                [members[: np.searchsorted(members, end)] for members in sparse]
+                + [np.array([], dtype=np.int32)]
+            ),
+            return_counts=True,
+        )
+        found = [candidates[counts >= nb_common_categories]]
+        if dense:
+            # levels[count] holds the products found in at least count bitsets
+            levels = [(1 << end) - 1] + [0] * nb_common_categories
+            for index, members in enumerate(dense):
+                for count in range(min(index + 1, nb_common_categories), 0, -1):
+                    levels[count] |= levels[count - 1] & members
+            for needed in range(1, min(nb_common_categories, len(dense) + 1)):
+                short = candidates[counts == nb_common_categories - needed]
+                if len(short) and levels[needed]:
+                    data = np.frombuffer(
+                        levels[needed].to_bytes(self.size, "little"), np.uint8
+                    )
+                    found.append(short[(data[short >> 3] >> (short & 7)) & 1 == 1])
+            if levels[nb_common_categories]:
+                found.append(set_positions(levels[nb_common_categories], self.size))
+        matching = np.unique(np.concatenate(found))
+        return matching[matching != position]
+
+    def substitutes(self, product_id, nb_common_categories=4):
+        """Substitutes of a product, as Product.substitutes finds them
+
+        Args:
+            product_id (int): id of the product
+            nb_common_categories (int, optional): number of categories
+            shared with the product. Defaults to 4.
+
+        Returns:
+            list: ids of the substitutes, one by grade and energy,
+            ordered by grade and energy
+        """
+        substitutes = []
+        previous = None
+        for position in self.matches(product_id, nb_common_categories).tolist():
+            if self.keys[position] != previous:
+                previous = self.keys[position]
+                substitutes.append(self.ids[position])
+        return substitutes
+
+
+class SubstituteList:
+    """SubstituteList pages the substitutes found by the index,
+    reading from the database the products of the page only
+
+    Args:
+        ids (list): ids of the substitutes, in order
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return Product.objects.get(pk=self.ids[index])
+        ids = self.ids[index]
+        products = Product.objects.in_bulk(ids)
+        return [products[product_id] for product_id in ids if product_id in products]
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+_index = None
+_lock = threading.Lock()
+_refreshing = False
+
+
+def refresh_index():
+    """Load a new index and put it in place of the stale one, in the thread
+    refreshing it, while the requests keep reading the stale one"""
+    global _index, _refreshing  # pylint: disable=global-statement
+    try:
+        # the reference is replaced in one step, the requests read either index
+        _index = SubstituteIndex.load()
+    finally:
+        with _lock:
+            _refreshing = False
+        connection.close()
+
+
+def get_index():
+    """Index of the worker, loaded by the first request, then refreshed by
+    a thread of its own once older than SUBSTITUTE_INDEX_TTL seconds to pick
+    up the imports, the stale index being served meanwhile
+
+    Returns:
+        SubstituteIndex: index of the products
+    """
+    global _index, _refreshing  # pylint: disable=global-statement
+    index = _index
+    if index is None:
+        with _lock:
+            if _index is None:
+                _index = SubstituteIndex.load()
+            return _index
+    if time.monotonic() - index.loaded_at > settings.SUBSTITUTE_INDEX_TTL:
+        with _lock:
+            start, _refreshing = not _refreshing, True
+        if start:
+            threading.Thread(target=refresh_index, daemon=True).start()
+    return index
+
+
+def find_substitutes(product, nb_common_categories=4):
+    """Substitutes of a product from the index of the worker,
+    or from the database for a product imported since it was loaded
+
+    Args:
+        product (Product): product whose substitutes are searched
+        nb_common_categories (int, optional): number of categories
+        shared with the product. Defaults to 4.
+
+    Returns:
+        object: SubstituteList, or the QuerySet of Product.substitutes
+    """
+    index = get_index()
+    if product.pk not in index:
+        return product.substitutes(nb_common_categories)
+    return SubstituteList(index.substitutes(product.pk, nb_common_categories))
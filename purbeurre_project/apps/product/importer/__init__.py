@@ -0,0 +1,3 @@
+"""Building blocks used by the import_off management command
+to load Open Food Facts data into the product app
+"""
@@ -0,0 +1,141 @@
+"""Cassettes of Open Food Facts responses: the responses of an import are
+recorded on disk, gzipped, then replayed without network so that imports
+can be benchmarked on the same data from one run to the next
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+# headers replayed with the body of a response
+KEPT_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class CassetteMiss(requests.RequestException):
+    """No response was recorded for the url requested during a replay"""
+
+
+class CassetteStore:
+    """CassetteStore keeps one response per url in a directory: its status
+    and headers in a JSON file, its body in a gzipped file
+
+    Args:
+        path (string): directory of the cassettes, created when missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, url):
+        """Name of the files of a url
+
+        Args:
+            url (string): url requested, with its query string
+
+        Returns:
+            string: digest of the url
+        """
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    def save(self, url, status, headers, body):
+        """Record a response
+
+        Args:
+            url (string): url requested
+            status (int): status of the response
+            headers (dictionnary): headers of the response
+            body (bytes): decoded body of the response
+        """
+        key = os.path.join(self.path, self.key(url))
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": {
+                name: headers[name] for name in KEPT_HEADERS if name in headers
+            },
+        }
+        with self.lock:
+            with open(key + ".body.gz", "wb") as body_file:
+                body_file.write(gzip.compress(body))
+            with open(key + ".json", "w") as meta_file:
+                json.dump(meta, meta_file)
+
+    def load(self, url):
+        """Read a recorded response
+
+        Args:
+            url (string): url requested
+
+        Raises:
+            CassetteMiss: the url was not recorded
+
+        Returns:
+            tuple: status, headers and gzipped body of the response
+        """
+        key = os.path.join(self.path, self.key(url))
+        try:
+            with open(key + ".json") as meta_file:
+                meta = json.load(meta_file)
+            with open(key + ".body.gz", "rb") as body_file:
+                body = body_file.read()
+        except FileNotFoundError as exx:
+            raise CassetteMiss(f"No response recorded for {url}") from exx
+        return meta["status"], meta["headers"], body
+
+
+class CassetteAdapter(HTTPAdapter):
+    """CassetteAdapter records the responses received by a session,
+    or replays them without sending the requests
+
+    Args:
+        store (CassetteStore): cassettes of the responses
+        record (bool, optional): send the requests and record the responses,
+        otherwise replay them. Defaults to False.
+        kwargs: arguments of HTTPAdapter
+    """
+
+    def __init__(self, store, record=False, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.record = record
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        """Answer a request from the cassettes
+
+        Args:
+            request (PreparedRequest): request of the session
+            kwargs: arguments of HTTPAdapter.send
+
+        Returns:
+            Response: response recorded for the url
+        """
+        if self.record:
+            response = super().send(request, **kwargs)
+            # a 304 is not recorded, so that the cassette keeps the full body
+            if response.status_code == 304:
+                return response
+            self.store.save(
+                request.url, response.status_code, response.headers, response.content
+            )
+        status, headers, body = self.store.load(request.url)
+        # the body is served gzipped, to be decoded like a response of the API
+        headers = dict(headers, **{"Content-Encoding": "gzip"})
+        etag = headers.get("ETag")
+        if etag and request.headers.get("If-None-Match") == etag:
+            status, body, headers = 304, b"", {"ETag": etag}
+        raw = HTTPResponse(
+            body=io.BytesIO(body),
+            headers=headers,
+            status=status,
+            preload_content=False,
+            decode_content=False,
+        )
+        return self.build_response(request, raw)
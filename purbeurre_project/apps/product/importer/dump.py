@@ -0,0 +1,118 @@
+"""Readers of the Open Food Facts bulk dumps
+"""
+import csv
+import gzip
+import io
+import json
+import sys
+
+# nutriments of the CSV dump, named as in the products of the API
+CSV_NUTRIMENTS = [
+    "carbohydrates_100g",
+    "sugars_100g",
+    "fat_100g",
+    "saturated-fat_100g",
+    "salt_100g",
+    "sodium_100g",
+    "fiber_100g",
+    "proteins_100g",
+]
+
+
+def open_dump(path):
+    """Open a dump as text, whether it is gzipped or not
+
+    Args:
+        path (string): path of the dump file
+
+    Returns:
+        file: text file read line by line
+    """
+    with open(path, "rb") as dump:
+        gzipped = dump.read(2) == b"\x1f\x8b"
+    if gzipped:
+        return io.TextIOWrapper(gzip.open(path), encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def to_float(value):
+    """Convert a number of the CSV dump
+
+    Args:
+        value (string): cell of the CSV dump
+
+    Returns:
+        float: the number, None when the cell is empty or invalid
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def from_jsonl(data):
+    """Complete a product of the JSONL dump with the keys given by the API
+
+    Args:
+        data (dictionnary): product of the JSONL dump
+
+    Returns:
+        dictionnary: a product dictionnary shaped like the API ones
+    """
+    nutriments = data.setdefault("nutriments", {})
+    if "energy_value" not in nutriments and "energy_100g" in nutriments:
+        nutriments["energy_value"] = nutriments["energy_100g"]
+        nutriments["energy_unit"] = "kJ"
+    if not data.get("nutrition_grade_fr"):
+        data["nutrition_grade_fr"] = data.get("nutrition_grades") or ""
+    if not data.get("url") and data.get("code"):
+        data["url"] = f"https://fr.openfoodfacts.org/produit/{data['code']}"
+    if not data.get("image_front_url"):
+        data["image_front_url"] = data.get("image_url")
+    return data
+
+
+def from_csv(row):
+    """Shape a row of the CSV dump like a product of the API
+
+    Args:
+        row (dictionnary): row of the CSV dump
+
+    Returns:
+        dictionnary: a product dictionnary shaped like the API ones
+    """
+    nutriments = {name: to_float(row.get(name)) for name in CSV_NUTRIMENTS}
+    nutriments["energy_value"] = to_float(row.get("energy_100g"))
+    nutriments["energy_unit"] = "kJ"
+    return {
+        "product_name": row.get("product_name"),
+        "nutrition_grade_fr": row.get("nutrition_grade_fr") or "",
+        "url": row.get("url") or None,
+        "image_front_url": row.get("image_url") or None,
+        "categories": row.get("categories") or "",
+        "nutriments": nutriments,
+    }
+
+
+def iter_dump(path):
+    """Read the products of a JSONL or CSV dump one line at a time
+
+    Args:
+        path (string): path of the dump, optionally gzipped
+
+    Yields:
+        dictionnary: each product, shaped like the API ones
+    """
+    with open_dump(path) as dump:
+        if ".csv" in str(path):
+            csv.field_size_limit(sys.maxsize)
+            for row in csv.DictReader(dump, delimiter="\t", quoting=csv.QUOTE_NONE):
+                yield from_csv(row)
+            return
+        for line in dump:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                yield from_jsonl(data)
@@ -0,0 +1,272 @@
+"""HTTP layer used to request the Open Food Facts API
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import ijson
+import requests
+from product.importer.cassette import CassetteAdapter
+from requests.adapters import HTTPAdapter
+
+OFF_BASE_URL = "https://fr.openfoodfacts.org"
+
+
+class NotModified(Exception):
+    """The listing did not change since the validators were stored"""
+
+
+class OffClient:
+    """OffClient shares one keep-alive session between the fetching threads
+    and retries with an exponential backoff on timeouts and 5xx responses
+
+    Args:
+        base_url (string, optional): root of the Open Food Facts API.
+        Defaults to OFF_BASE_URL.
+        workers (int, optional): number of connections kept alive. Defaults to 4.
+        retries (int, optional): number of retries after a failed request.
+        Defaults to 3.
+        backoff (float, optional): seconds waited before the first retry,
+        doubled on each retry. Defaults to 0.5.
+        timeout (float, optional): seconds before a request times out.
+        Defaults to 30.
+    """
+
+    def __init__(
+        self, base_url=OFF_BASE_URL, workers=4, retries=3, backoff=0.5, timeout=30
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # url -> (etag, last modified) of the last responses received
+        self.validators = {}
+        # called with the path, params, latency and size of each response
+        self.observer = None
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Accept-Encoding": "gzip", "User-Agent": "Purbeurre - import_off"}
+        )
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def use_cassettes(self, store, record=False):
+        """Record the responses in cassettes, or replay them without network
+
+        Args:
+            store (CassetteStore): cassettes of the responses
+            record (bool, optional): record the responses received,
+            otherwise replay them. Defaults to False.
+        """
+        adapter = CassetteAdapter(
+            store,
+            record=record,
+            pool_connections=self.workers,
+            pool_maxsize=self.workers,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request_url(self, path, params=None):
+        """Full url of a request, used as key of the validators
+
+        Args:
+            path (string): endpoint appended to the base url
+            params (dictionnary, optional): query string. Defaults to None.
+
+        Returns:
+            string: the url with its encoded query string
+        """
+        return (
+            requests.Request("GET", self.base_url + path, params=params).prepare().url
+        )
+
+    def get(self, path, params=None, stream=False, conditional=False):
+        """Request an endpoint of the Open Food Facts API
+
+        Args:
+            path (string): endpoint appended to the base url
+            params (dictionnary, optional): query string. Defaults to None.
+            stream (bool, optional): leave the body unread. Defaults to False.
+            conditional (bool, optional): send the validators of the last
+            response, which may be answered by a 304. Defaults to False.
+
+        Raises:
+            requests.RequestException: the API cannot be reached after the retries
+
+        Returns:
+            Response: the last response received
+        """
+        headers = {}
+        if conditional:
+            url = self.request_url(path, params)
+            etag, last_modified = self.validators.get(url, ("", ""))
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.get(
+                    url=self.base_url + path,
+                    params=params,
+                    timeout=self.timeout,
+                    stream=stream,
+                    headers=headers,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if not stream:
+                    # bytes received, compressed as for a streamed response
+                    self.observe(path, params, started, response.raw.tell())
+                if response.status_code < 500 or attempt >= self.retries:
+                    if conditional and response.status_code == 200:
+                        self.remember(url, response)
+                    return response
+                response.close()
+            time.sleep(self.backoff * 2**attempt)
+            attempt += 1
+
+    def observe(self, path, params, started, size):
+        """Give a response received to the observer of the client
+
+        Args:
+            path (string): endpoint requested
+            params (dictionnary): query string
+            started (float): time the request was sent, from perf_counter
+            size (int): bytes received on the wire, before decompression
+        """
+        if self.observer is not None:
+            self.observer(path, params, time.perf_counter() - started, size)
+
+    def remember(self, url, response):
+        """Keep the validators of a response for the next conditional request
+
+        Args:
+            url (string): url of the request
+            response (Response): response received
+        """
+        etag = response.headers.get("ETag", "")
+        last_modified = response.headers.get("Last-Modified", "")
+        if etag or last_modified:
+            self.validators[url] = (etag, last_modified)
+
+    def map(self, function, items):
+        """Call a fetching function on each item with a bounded pool of threads,
+        keeping the next requests in flight while the results are consumed
+
+        Args:
+            function (callable): function fetching one item
+            items (iterable): items to fetch
+
+        Yields:
+            object: results of the function, in the order of the items
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for item in items:
+                pending.append(executor.submit(function, item))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def iter_items(self, path, params, prefix, conditional=False):
+        """Parse the items of a JSON array while the body is downloaded
+
+        Args:
+            path (string): endpoint appended to the base url
+            params (dictionnary): query string
+            prefix (string): ijson path of the items, like "products.item"
+            conditional (bool, optional): send the validators of the last
+            response. Defaults to False.
+
+        Raises:
+            NotModified: the listing did not change since the last response
+            requests.HTTPError: the API answered with an error status
+
+        Yields:
+            object: each item of the array, as soon as it is parsed
+        """
+        started = time.perf_counter()
+        response = self.get(path, params=params, stream=True, conditional=conditional)
+        with response:
+            if response.status_code == 304:
+                self.observe(path, params, started, 0)
+                raise NotModified(response.url)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, prefix, use_float=True)
+            # the latency of a streamed body lasts until it is read
+            self.observe(path, params, started, response.raw.tell())
+
+    def stream(self, function, items, maxsize=1000):
+        """Run a generator function on each item with a bounded pool of threads
+        and yield the elements produced as soon as they are available
+
+        Args:
+            function (callable): generator function fetching one item
+            items (iterable): items to fetch
+            maxsize (int, optional): elements buffered before the threads wait
+            for the consumer. Defaults to 1000.
+
+        Yields:
+            object: elements produced by the function, in no particular order
+        """
+        elements = queue.Queue(maxsize=maxsize)
+        stopped = threading.Event()
+        done = object()
+
+        def put(element):
+            while not stopped.is_set():
+                try:
+                    elements.put(element, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def produce(item):
+            if stopped.is_set():
+                return
+            try:
+                for element in function(item):
+                    put(element)
+                    if stopped.is_set():
+                        return
+            except Exception as exx:  # pylint: disable=broad-except
+                put(StreamError(exx))
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            remaining = len([executor.submit(produce, item) for item in items])
+            try:
+                while remaining:
+                    element = elements.get()
+                    if element is done:
+                        remaining -= 1
+                    elif isinstance(element, StreamError):
+                        raise element.error
+                    else:
+                        yield element
+            finally:
+                stopped.set()
+
+
+class StreamError:
+    """Wrap an exception raised by a producing thread
+
+    Args:
+        error (Exception): exception to raise in the consumer
+    """
+
+    def __init__(self, error):
+        self.error = error
@@ -0,0 +1,243 @@
+"""Substitutes ranked by the categories they share, each category weighted
+by its inverse document frequency: sharing a rare category counts more than
+sharing a category of half the catalogue.
+
+The product x category matrix is kept sparse in NumPy arrays and the
+overlaps of all the pairs of products are computed by blocks of products,
+sized so that the pairs of a block fit in a memory budget.
+"""
+import itertools
+
+import numpy as np
+from django.db import connection, transaction
+from product.importer.loaders import copy_buffer
+from product.importer.substitutes import SUBSTITUTES_PER_PRODUCT
+from product.models import Product, ProductSubstitute
+
+# bytes held per candidate pair while a block is scored
+PAIR_BYTES = 64
+# categories of fewer products always pair them, whatever the catalogue size
+MIN_COMMON = 1000
+
+
+class CategoryMatrix:
+    """CategoryMatrix holds the categories of the products as two sparse
+    matrices: the categories of each product and the products of each category
+
+    Args:
+        ids (ndarray): ids of the products
+        grades (ndarray): nutrition grades of the products, as codes
+        energies (ndarray): energies of the products
+        pairs (ndarray): product ids and category ids of the memberships
+    """
+
+    def __init__(self, ids, grades, energies, pairs):
+        order = np.argsort(ids)
+        self.ids = ids[order]
+        self.grades = grades[order]
+        self.energies = energies[order]
+        products = np.searchsorted(self.ids, pairs[:, 0])
+        known = (products < len(self.ids)) & (
+            self.ids[np.minimum(products, len(self.ids) - 1)] == pairs[:, 0]
+        )
+        products = products[known]
+        self.category_ids, categories = np.unique(pairs[known, 1], return_inverse=True)
+        by_product = np.lexsort((categories, products))
+        self.product_categories = categories[by_product]
+        self.product_ptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(products, minlength=len(self.ids))))
+        )
+        by_category = np.argsort(categories, kind="stable")
+        self.category_products = products[by_category]
+        self.frequencies = np.bincount(categories, minlength=len(self.category_ids))
+        self.category_ptr = np.concatenate(([0], np.cumsum(self.frequencies)))
+        self.weights = np.log(len(self.ids) / np.maximum(self.frequencies, 1))
+
+    @classmethod
+    def load(cls):
+        """Load the matrix from the database, streaming the memberships
+
+        Returns:
+            CategoryMatrix: categories of the products imported
+        """
+        products = list(
+            Product.objects.values_list(
+                "id", "nutrition_grade", "energy_100g"
+            ).iterator()
+        )
+        through = Product.categories.through.objects.values_list(
+            "product_id", "category_id"
+        )
+        pairs = np.fromiter(
+            itertools.chain.from_iterable(through.iterator(chunk_size=20000)),
+            dtype=np.int64,
+            count=2 * through.count(),
+        ).reshape(-1, 2)
+        return cls(
+            np.array([product[0] for product in products], dtype=np.int64),
+            np.array([ord(product[1] or "z") for product in products], dtype=np.int16),
+            np.array([product[2] for product in products], dtype=np.int64),
+            pairs,
+        )
+
+    def categories_of(self, product):
+        """Categories of a product
+
+        Args:
+            product (int): index of the product
+
+        Returns:
+            ndarray: indexes of its categories
+        """
+        first, last = self.product_ptr[product], self.product_ptr[product + 1]
+        return self.product_categories[first:last]
+
+    def members(self, category):
+        """Products of a category
+
+        Args:
+            category (int): index of the category
+
+        Returns:
+            ndarray: indexes of its products
+        """
+        first, last = self.category_ptr[category], self.category_ptr[category + 1]
+        return self.category_products[first:last]
+
+    def common_categories(self, max_df):
+        """Categories found in too many products to pair the products
+
+        Args:
+            max_df (float): share of the products above which a category
+            of MIN_COMMON products or more is common
+
+        Returns:
+            ndarray: indexes of the common categories
+        """
+        return np.flatnonzero(
+            self.frequencies > max(max_df * len(self.ids), MIN_COMMON)
+        )
+
+    def blocks(self, max_pairs, common):
+        """Split the products into blocks whose candidate pairs fit in max_pairs
+
+        Args:
+            max_pairs (int): candidate pairs scored at once
+            common (ndarray): indexes of the categories which pair no products
+
+        Returns:
+            list: start and end indexes of the blocks
+        """
+        if not len(self.ids):
+            return []
+        frequencies = self.frequencies.copy()
+        frequencies[common] = 0
+        pairs = np.add.reduceat(
+            np.append(frequencies[self.product_categories], 0), self.product_ptr[:-1]
+        )
+        pairs[np.diff(self.product_ptr) == 0] = 0
+        ends = np.cumsum(pairs)
+        bounds = [0]
+        while bounds[-1] < len(self.ids):
+            start = bounds[-1]
+            budget = (ends[start - 1] if start else 0) + max_pairs
+            bounds.append(
+                max(int(np.searchsorted(ends, budget, side="right")), start + 1)
+            )
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def score_block(self, start, end, common, limit):
+        """Rank the substitutes of a block of products
+
+        Args:
+            start (int): index of the first product of the block
+            end (int): index following the last product of the block
+            common (ndarray): indexes of the categories which pair no products,
+            but add their weight to the pairs found by the others
+            limit (int): substitutes kept per product
+
+        Returns:
+            tuple: product indexes, substitute indexes, ranks and scores
+        """
+        first, last = self.product_ptr[start], self.product_ptr[end]
+        categories = self.product_categories[first:last]
+        rows = np.repeat(np.arange(start, end), np.diff(self.product_ptr)[start:end])
+        is_common = np.isin(categories, common)
+        pairing, pairing_rows = categories[~is_common], rows[~is_common]
+        lengths = self.frequencies[pairing]
+        offsets = np.repeat(
+            self.category_ptr[pairing] - np.cumsum(lengths) + lengths, lengths
+        )
+        others = self.category_products[offsets + np.arange(lengths.sum())]
+        products = np.repeat(pairing_rows, lengths)
+        weights = np.repeat(self.weights[pairing], lengths)
+        keep = (others != products) & (self.grades[others] <= self.grades[products])
+        keys = products[keep] * len(self.ids) + others[keep]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights[keep])
+        products, others = keys // len(self.ids), keys % len(self.ids)
+        for category in np.intersect1d(common, categories):
+            shared = np.isin(products, rows[categories == category]) & np.isin(
+                others, self.members(category)
+            )
+            scores[shared] += self.weights[category]
+        order = np.lexsort(
+            (
+                self.ids[others],
+                self.energies[others],
+                self.grades[others],
+                -scores,
+                products,
+            )
+        )
+        products, others, scores = products[order], others[order], scores[order]
+        ranks = np.arange(len(products)) - np.searchsorted(products, products)
+        kept = ranks < limit
+        return products[kept], others[kept], ranks[kept] + 1, scores[kept]
+
+
+def rebuild(limit=SUBSTITUTES_PER_PRODUCT, memory=256, max_df=0.05):
+    """Rank the substitutes of every product by their weighted overlap,
+    among the products with a grade as good or better
+
+    Args:
+        limit (int, optional): substitutes kept per product.
+        Defaults to SUBSTITUTES_PER_PRODUCT.
+        memory (int, optional): megabytes of candidate pairs scored at once.
+        Defaults to 256.
+        max_df (float, optional): share of the products above which
+        a category adds to the score without pairing the products.
+        Defaults to 0.05.
+
+    Returns:
+        int: number of substitutes saved
+    """
+    matrix = CategoryMatrix.load()
+    common = matrix.common_categories(max_df)
+    table = ProductSubstitute._meta.db_table
+    saved = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+        cursor.execute(f"DELETE FROM {table}")
+        for start, end in matrix.blocks(memory * 2**20 // PAIR_BYTES, common):
+            products, others, ranks, scores = matrix.score_block(
+                start, end, common, limit
+            )
+            cursor.copy_expert(
+                f"COPY {table} (product_id, substitute_id, rank, score) "
+                "FROM STDIN WITH (FORMAT csv)",
+                copy_buffer(
+                    zip(
+                        matrix.ids[products].tolist(),
+                        matrix.ids[others].tolist(),
+                        ranks.tolist(),
+                        np.round(scores, 6).tolist(),
+                    )
+                ),
+            )
+            saved += len(products)
+        cursor.execute(
+            f"UPDATE {Product._meta.db_table} SET substitutes_computed = true "
+            "WHERE NOT substitutes_computed"
+        )
+    return saved
@@ -0,0 +1,183 @@
+"""Local mirror of the product images: each image of Open Food Facts is
+downloaded once, then resized into card thumbnails served from MEDIA_ROOT
+"""
+import io
+import os
+
+from django.conf import settings
+from PIL import Image
+from product.importer.fetch import OffClient
+from product.models import Product
+
+# inner size of a product card
+CARD_SIZE = (330, 460)
+THUMBNAILS_DIR = "thumbnails"
+
+
+def thumbnail_paths(product_id):
+    """Paths of the thumbnails of a product, relative to MEDIA_ROOT,
+    spread over 256 directories
+
+    Args:
+        product_id (int): id of the product
+
+    Returns:
+        tuple: paths of the JPEG and the WebP thumbnails
+    """
+    base = os.path.join(THUMBNAILS_DIR, f"{product_id % 256:02x}", str(product_id))
+    return f"{base}.jpg", f"{base}.webp"
+
+
+def save_atomically(image, path, **params):
+    """Save an image under MEDIA_ROOT, replacing the previous file at once
+    so that the web server never reads a partial file
+
+    Args:
+        image (Image): image to save
+        path (string): path relative to MEDIA_ROOT
+        params: format and options of Image.save
+    """
+    target = os.path.join(settings.MEDIA_ROOT, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f"{target}.{os.getpid()}.tmp"
+    image.save(temporary, **params)
+    os.replace(temporary, target)
+
+
+def make_thumbnails(body, product_id, size=CARD_SIZE):
+    """Resize an image into the card thumbnails of a product, keeping its
+    proportions on a white background
+
+    Args:
+        body (bytes): content of the original image
+        product_id (int): id of the product
+        size (tuple, optional): width and height of the thumbnails.
+        Defaults to CARD_SIZE.
+
+    Returns:
+        tuple: paths of the JPEG and the WebP thumbnails, relative to MEDIA_ROOT
+    """
+    with Image.open(io.BytesIO(body)) as original:
+        original.draft("RGB", size)
+        image = original.convert("RGB")
+    image.thumbnail(size, Image.LANCZOS)
+    card = Image.new("RGB", size, "white")
+    card.paste(image, ((size[0] - image.width) // 2, (size[1] - image.height) // 2))
+    jpeg_path, webp_path = thumbnail_paths(product_id)
+    save_atomically(card, jpeg_path, format="JPEG", quality=82, optimize=True)
+    save_atomically(card, webp_path, format="WEBP", quality=80, method=4)
+    return jpeg_path, webp_path
+
+
+class ImageMirror:
+    """ImageMirror downloads the images of the products with a pool of threads
+    and keeps their thumbnails up to date: an image already mirrored is
+    requested with its validators and skipped when it did not change
+
+    Args:
+        workers (int, optional): images downloaded and resized together.
+        Defaults to 8.
+        force (bool, optional): rebuild the thumbnails of every image.
+        Defaults to False.
+    """
+
+    def __init__(self, workers=8, force=False):
+        # the urls of the images are absolute
+        self.client = OffClient(base_url="", workers=workers)
+        self.force = force
+        self.created = 0
+        self.unchanged = 0
+        self.failed = 0
+
+    def is_mirrored(self, product):
+        """Tell whether the thumbnails of a product match its image
+
+        Args:
+            product (Product): product with its image url
+
+        Returns:
+            boolean: true when the thumbnails were built from the image url
+        """
+        return (
+            not self.force
+            and product.image_source == product.image_url
+            and bool(product.thumbnail)
+            and os.path.exists(os.path.join(settings.MEDIA_ROOT, product.thumbnail))
+        )
+
+    def fetch(self, product):
+        """Download the image of a product and build its thumbnails,
+        in a thread of the pool
+
+        Args:
+            product (Product): product to mirror
+
+        Returns:
+            Product: the product, with its thumbnail fields updated,
+            or None when its image did not change
+        """
+        if self.is_mirrored(product):
+            self.client.validators[product.image_url] = (
+                product.image_etag,
+                product.image_last_modified,
+            )
+        try:
+            response = self.client.get(product.image_url, conditional=True)
+        finally:
+            # the validators are kept on the product, not by the client
+            self.client.validators.pop(product.image_url, None)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        product.thumbnail, product.thumbnail_webp = make_thumbnails(
+            response.content, product.pk
+        )
+        product.image_source = product.image_url
+        product.image_etag = response.headers.get("ETag", "")
+        product.image_last_modified = response.headers.get("Last-Modified", "")
+        return product
+
+    def safe_fetch(self, product):
+        """Mirror the image of a product, keeping the error of a failure
+
+        Args:
+            product (Product): product to mirror
+
+        Returns:
+            object: result of fetch, or the exception raised
+        """
+        try:
+            return self.fetch(product)
+        except Exception as exx:  # pylint: disable=broad-except
+            return exx
+
+    def mirror(self, products, batch_size=500):
+        """Mirror the images of products, saving their thumbnail fields by chunks
+
+        Args:
+            products (iterable): products to mirror
+            batch_size (int, optional): products saved per query. Defaults to 500.
+        """
+        fields = [
+            "thumbnail",
+            "thumbnail_webp",
+            "image_source",
+            "image_etag",
+            "image_last_modified",
+        ]
+        mirrored = []
+        for result in self.client.map(self.safe_fetch, products):
+            if isinstance(result, Exception):
+                self.failed += 1
+                print("Une des images n'a pu être importée, voici l'erreur :", result)
+            elif result is None:
+                self.unchanged += 1
+            else:
+                self.created += 1
+                mirrored.append(result)
+                print(".", end="")
+            if len(mirrored) >= batch_size:
+                Product.objects.bulk_update(mirrored, fields)
+                mirrored = []
+        if mirrored:
+            Product.objects.bulk_update(mirrored, fields)
@@ -0,0 +1,73 @@
+"""Checkpoint journal of import_off, used to resume an interrupted import
+"""
+from collections import namedtuple
+
+from product.models import ImportCheckpoint
+
+# marker following the products of a committed unit in a stream of products
+Checkpoint = namedtuple("Checkpoint", ["category", "page", "done"])
+
+
+def checkpoints(categories=None):
+    """Checkpoints of the categories of an import
+
+    Args:
+        categories (list, optional): categories imported, None for all.
+        Defaults to None.
+
+    Returns:
+        QuerySet: checkpoints of the categories
+    """
+    queryset = ImportCheckpoint.objects.all()
+    if categories is not None:
+        queryset = queryset.filter(category__in=categories)
+    return queryset
+
+
+def start(resume, categories=None):
+    """Open the journal of an import
+
+    Args:
+        resume (bool): keep the units committed by the last import
+        categories (list, optional): categories imported, so that a shard
+        leaves the checkpoints of the others. Defaults to None, for all.
+
+    Returns:
+        tuple: set of the categories done and dictionnary of the last page
+        committed for the categories in progress
+    """
+    if not resume:
+        checkpoints(categories).delete()
+        return set(), {}
+    done = set()
+    pages = {}
+    for category, page, category_done in checkpoints(categories).values_list(
+        "category", "page", "done"
+    ):
+        if category_done:
+            done.add(category)
+        else:
+            pages[category] = page
+    return done, pages
+
+
+def record(checkpoint):
+    """Journal a committed unit
+
+    Args:
+        checkpoint (Checkpoint): unit whose products were written
+    """
+    ImportCheckpoint.objects.update_or_create(
+        category=checkpoint.category,
+        defaults={"page": checkpoint.page, "done": checkpoint.done},
+    )
+
+
+def clear(categories=None):
+    """Empty the journal once an import is complete
+
+    Args:
+        categories (list, optional): categories imported. Defaults to None,
+        for all.
+    """
+    checkpoints(categories).delete()
@@ -0,0 +1,440 @@
+"""Loaders writing Open Food Facts products into the product tables
+"""
+import hashlib
+import io
+import json
+import time
+
+from django.db import (
+    DataError,
+    IntegrityError,
+    OperationalError,
+    connection,
+    transaction,
+)
+from psycopg2.errorcodes import DEADLOCK_DETECTED, SERIALIZATION_FAILURE
+from psycopg2.extras import execute_values
+from product.models import Category, Product
+
+# errors of a chunk aborted for a concurrent import, written again
+RETRIED_ERRORS = {DEADLOCK_DETECTED, SERIALIZATION_FAILURE}
+
+
+def validate_product_dict(product_dict):
+    """Help validate import product when it calls on nutriments
+
+    Args:
+        product_dict (dictionnary): a dictionnary of product selected
+
+    Returns:
+        boolean: true when elements are required
+    """
+    for required in ["nutrition_grade_fr"]:
+        if not product_dict.get(required, "").strip():
+            return False
+    if not product_dict["nutriments"].get("fiber_100g", 0):
+        return False
+    return True
+
+
+def raw_values(data):
+    """Pick the values of an Open Food Facts product stored on Product
+
+    Args:
+        data (dictionnary): elements making up a product
+
+    Returns:
+        dictionnary: values as received, keyed by column name
+    """
+    nutriments = data["nutriments"]
+    return {
+        "name": data.get("product_name"),
+        "nutrition_grade": data.get("nutrition_grade_fr"),
+        "energy_100g": nutriments.get("energy_value"),
+        "energy_unit": nutriments.get("energy_unit"),
+        "carbohydrates_100g": nutriments.get("carbohydrates_100g"),
+        "sugars_100g": nutriments.get("sugars_100g"),
+        "fat_100g": nutriments.get("fat_100g"),
+        "saturated_fat_100g": nutriments.get("saturated-fat_100g"),
+        "salt_100g": nutriments.get("salt_100g"),
+        "sodium_100g": nutriments.get("sodium_100g"),
+        "fiber_100g": nutriments.get("fiber_100g"),
+        "proteins_100g": nutriments.get("proteins_100g"),
+        "url": data.get("url"),
+        "image_url": data.get("image_front_url"),
+    }
+
+
+def content_hash(data):
+    """Digest of the imported content of a product, used to skip
+    the products which did not change since the last import
+
+    Args:
+        data (dictionnary): elements making up a product
+
+    Returns:
+        string: md5 hexdigest of the values and categories of the product
+    """
+    content = json.dumps(
+        [raw_values(data), sorted(split_categories(data))], sort_keys=True, default=str
+    )
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def product_values(data):
+    """Map an Open Food Facts product dictionnary to Product column values
+
+    Args:
+        data (dictionnary): elements making up a product
+
+    Raises:
+        ValueError: a required column is missing or cannot be converted
+
+    Returns:
+        dictionnary: values prepared for the database, keyed by column name
+    """
+    values = {}
+    for column, value in raw_values(data).items():
+        field = Product._meta.get_field(column)
+        if value is None:
+            if not field.null:
+                raise ValueError(f"{column} is missing")
+        else:
+            value = field.get_prep_value(value)
+        values[column] = value
+    values["content_hash"] = content_hash(data)
+    return values
+
+
+def split_categories(data):
+    """Split the categories string of an Open Food Facts product
+
+    Args:
+        data (dictionnary): elements making up a product
+
+    Returns:
+        list: category names of the product
+    """
+    return [name for name in (data.get("categories") or "").split(",") if name]
+
+
+def upsert_clause(columns):
+    """End of the insert upserting products on their name, which leaves
+    unchanged the products whose content hash did not change
+
+    Args:
+        columns (list): columns inserted
+
+    Returns:
+        string: ON CONFLICT and RETURNING clauses of the insert
+    """
+    quote = connection.ops.quote_name
+    table = quote(Product._meta.db_table)
+    updates = ", ".join(
+        f"{quote(column)} = EXCLUDED.{quote(column)}"
+        for column in columns
+        if column != "name"
+    )
+    return (
+        f"ON CONFLICT ({quote('name')}) DO UPDATE SET {updates} "
+        f"WHERE {table}.{quote('content_hash')} "
+        f"IS DISTINCT FROM EXCLUDED.{quote('content_hash')} "
+        f"RETURNING {quote('id')}, {quote('name')}, (xmax = 0) AS inserted"
+    )
+
+
+class BulkLoader:
+    """BulkLoader buffers products and writes them by chunks:
+    one upsert on the product name skipping the products whose content
+    did not change, categories resolved through an in-memory name to id map
+    and one insert on the M2M table. The rows of each statement are sorted,
+    so that concurrent shards lock them in the same order
+
+    Args:
+        batch_size (int, optional): number of products written per chunk.
+        Defaults to 500.
+        retries (int, optional): attempts made at a chunk aborted by
+        a deadlock or a serialization failure. Defaults to 3.
+        backoff (float, optional): seconds waited before the first retry,
+        doubled at each retry. Defaults to 0.1.
+    """
+
+    def __init__(self, batch_size=500, retries=3, backoff=0.1):
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.buffer = {}
+        self.category_ids = None
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        # time spent writing the chunks
+        self.seconds = 0.0
+
+    @property
+    def written(self):
+        """Number of products created or updated so far"""
+        return self.created + self.updated
+
+    def add(self, data):
+        """Buffer a validated product and write the chunk when it is full
+
+        Args:
+            data (dictionnary): elements making up a product
+        """
+        try:
+            values = product_values(data)
+        except (KeyError, TypeError, ValueError) as exx:
+            self.failed += 1
+            print("Un des produits n'a pu être importé, voici l'erreur :", exx)
+            return
+        self.add_row(values, split_categories(data))
+
+    def add_row(self, values, categories):
+        """Buffer a normalized product and write the chunk when it is full
+
+        Args:
+            values (dictionnary): values of the product, keyed by column name
+            categories (list): category names of the product
+        """
+        # the last occurrence of a name wins, as an upsert cannot
+        # touch the same row twice
+        self.buffer[values["name"]] = (values, categories)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered products, falling back to one product
+        at a time when the chunk breaks a constraint"""
+        if not self.buffer:
+            return
+        started = time.perf_counter()
+        rows = [self.buffer[name] for name in sorted(self.buffer)]
+        self.buffer = {}
+        self.resolve_categories({name for _, names in rows for name in names})
+        try:
+            created, updated, unchanged = self.write_chunk(rows)
+        except (DataError, IntegrityError):
+            created = updated = unchanged = 0
+            for row in rows:
+                try:
+                    counts = self.write_chunk([row])
+                except (DataError, IntegrityError) as exx:
+                    self.failed += 1
+                    print("Un des produits n'a pu être importé, voici l'erreur :", exx)
+                else:
+                    created += counts[0]
+                    updated += counts[1]
+                    unchanged += counts[2]
+        self.created += created
+        self.updated += updated
+        self.unchanged += unchanged
+        self.seconds += time.perf_counter() - started
+        print("." * (created + updated), end="")
+
+    def write_chunk(self, rows):
+        """Write a chunk in a transaction of its own, again when a concurrent
+        import aborted it
+
+        Args:
+            rows (list): tuples of product values and category names,
+            sorted by name
+
+        Raises:
+            OperationalError: the chunk was aborted at each attempt
+
+        Returns:
+            tuple: numbers of products created, updated and unchanged
+        """
+        for attempt in range(self.retries):
+            try:
+                with transaction.atomic():
+                    return self.write(rows)
+            except OperationalError as exx:
+                if (
+                    getattr(exx.__cause__, "pgcode", None) not in RETRIED_ERRORS
+                    or attempt == self.retries - 1
+                ):
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+
+    def resolve_categories(self, names):
+        """Fill the name to id map, creating the unknown categories
+
+        Args:
+            names (set): category names used by the products of a chunk
+        """
+        if self.category_ids is None:
+            self.category_ids = dict(Category.objects.values_list("name", "id"))
+        missing = sorted(name for name in names if name not in self.category_ids)
+        if missing:
+            Category.objects.bulk_create(
+                [Category(name=name) for name in missing], ignore_conflicts=True
+            )
+            self.category_ids.update(
+                Category.objects.filter(name__in=missing).values_list("name", "id")
+            )
+
+    def write(self, rows):
+        """Upsert a chunk of products and link them to their categories
+
+        Args:
+            rows (list): tuples of product values and category names
+
+        Returns:
+            tuple: numbers of products created, updated and unchanged
+        """
+        columns = list(rows[0][0])
+        quote = connection.ops.quote_name
+        upsert = (
+            f"INSERT INTO {quote(Product._meta.db_table)} "
+            f"({', '.join(quote(column) for column in columns)}) VALUES %s "
+            f"{upsert_clause(columns)}"
+        )
+        through = Product.categories.through
+        link = (
+            f"INSERT INTO {quote(through._meta.db_table)} "
+            f"({quote('product_id')}, {quote('category_id')}) VALUES %s "
+            "ON CONFLICT DO NOTHING"
+        )
+        with connection.cursor() as cursor:
+            returned = execute_values(
+                cursor,
+                upsert,
+                [[values[column] for column in columns] for values, _ in rows],
+                page_size=len(rows),
+                fetch=True,
+            )
+            # unchanged products are not returned, nor are their categories
+            product_ids = {name: product_id for product_id, name, _ in returned}
+            links = {
+                (product_ids[values["name"]], self.category_ids[name])
+                for values, names in rows
+                if values["name"] in product_ids
+                for name in names
+            }
+            if links:
+                execute_values(cursor, link, sorted(links), page_size=len(links))
+        created = sum(1 for _, _, inserted in returned if inserted)
+        return created, len(returned) - created, len(rows) - len(returned)
+
+    def rate(self):
+        """Throughput of the loader since it was created
+
+        Returns:
+            float: products written per second
+        """
+        elapsed = time.perf_counter() - self.started
+        return self.written / elapsed if elapsed else 0.0
+
+
+def copy_buffer(rows):
+    """Format rows for COPY ... WITH (FORMAT csv): strings are always quoted,
+    so that only the unquoted empty fields are read as NULL
+
+    Args:
+        rows (iterable): lists of values
+
+    Returns:
+        StringIO: CSV lines ready to be copied
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(
+            ",".join(
+                ""
+                if value is None
+                else '"' + value.replace('"', '""') + '"'
+                if isinstance(value, str)
+                else str(value)
+                for value in row
+            )
+            + "\n"
+        )
+    buffer.seek(0)
+    return buffer
+
+
+class CopyLoader(BulkLoader):
+    """CopyLoader writes the chunks of BulkLoader with PostgreSQL COPY:
+    the products and their categories are streamed into staging tables,
+    then merged with set-based inserts. Staging tables are temporary,
+    so they are not WAL-logged and each connection has its own.
+
+    Args:
+        batch_size (int, optional): number of products written per chunk.
+        Defaults to 500.
+    """
+
+    def resolve_categories(self, names):
+        """Categories are merged from the staging tables by write
+
+        Args:
+            names (set): category names used by the products of a chunk
+        """
+
+    def write(self, rows):
+        """Copy a chunk of products into the staging tables and merge them
+
+        Args:
+            rows (list): tuples of product values and category names
+
+        Returns:
+            tuple: numbers of products created, updated and unchanged
+        """
+        columns = list(rows[0][0])
+        quote = connection.ops.quote_name
+        product_table = quote(Product._meta.db_table)
+        category_table = quote(Category._meta.db_table)
+        through_table = quote(Product.categories.through._meta.db_table)
+        column_list = ", ".join(quote(column) for column in columns)
+        products = copy_buffer(
+            [values[column] for column in columns] for values, _ in rows
+        )
+        links = copy_buffer(
+            (values["name"], name) for values, names in rows for name in names
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS import_staging_product AS "
+                f"SELECT {column_list} FROM {product_table} WITH NO DATA"
+            )
+            cursor.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS import_staging_link "
+                "(product_name text, category_name text)"
+            )
+            cursor.execute("TRUNCATE import_staging_product, import_staging_link")
+            cursor.copy_expert(
+                f"COPY import_staging_product ({column_list}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                products,
+            )
+            cursor.copy_expert(
+                "COPY import_staging_link FROM STDIN WITH (FORMAT csv)", links
+            )
+            cursor.execute(
+                f"INSERT INTO {category_table} ({quote('name')}) "
+                "SELECT DISTINCT category_name FROM import_staging_link "
+                "ORDER BY category_name "
+                f"ON CONFLICT ({quote('name')}) DO NOTHING"
+            )
+            # unchanged products are not returned, nor are their categories
+            cursor.execute(
+                f"WITH upserted AS (INSERT INTO {product_table} ({column_list}) "
+                f"SELECT {column_list} FROM import_staging_product "
+                f"ORDER BY {quote('name')} {upsert_clause(columns)}), "
+                f"linked AS (INSERT INTO {through_table} "
+                f"({quote('product_id')}, {quote('category_id')}) "
+                f"SELECT upserted.{quote('id')}, category.{quote('id')} "
+                "FROM upserted JOIN import_staging_link link "
+                f"ON link.product_name = upserted.{quote('name')} "
+                f"JOIN {category_table} category "
+                f"ON category.{quote('name')} = link.category_name "
+                f"ORDER BY upserted.{quote('id')}, category.{quote('id')} "
+                "ON CONFLICT DO NOTHING) "
+                "SELECT count(*) FILTER (WHERE inserted), count(*) FROM upserted"
+            )
+            created, returned = cursor.fetchone()
+        return created, returned - created, len(rows) - returned
@@ -0,0 +1,126 @@
+"""MinHash signatures of the categories of the products, split into LSH bands:
+two products whose category sets are similar share a bucket in one band at
+least, so that their candidate substitutes are found through the GIN index
+of Product.lsh_buckets instead of counting the categories of every product
+"""
+import io
+
+import numpy as np
+from django.db import connection, transaction
+from product.importer.idf import CategoryMatrix
+from product.models import Product
+
+# Mersenne prime of the universal hash functions of the signatures
+PRIME = 2**31 - 1
+# seed of the hash functions, the buckets of two builds must match
+SEED = 17
+
+
+def hash_functions(count):
+    """Coefficients of the universal hash functions (a * x + b) mod PRIME
+
+    Args:
+        count (int): number of hash functions
+
+    Returns:
+        tuple: arrays of the a and b coefficients
+    """
+    generator = np.random.default_rng(SEED)
+    return (
+        generator.integers(1, PRIME, size=count, dtype=np.uint64),
+        generator.integers(0, PRIME, size=count, dtype=np.uint64),
+    )
+
+
+def signatures(matrix, count, start, end):
+    """MinHash signatures of the category sets of a range of products
+
+    Args:
+        matrix (CategoryMatrix): categories of the products
+        count (int): number of hash functions
+        start (int): index of the first product
+        end (int): index following the last product
+
+    Returns:
+        ndarray: one row of count minimums per product, PRIME for a product
+        without categories
+    """
+    multipliers, offsets = hash_functions(count)
+    result = np.full((end - start, count), PRIME, dtype=np.uint64)
+    # the pointers of the range end with the end of its last product
+    stop = end + 1
+    pointers = matrix.product_ptr[start:stop]
+    filled = np.flatnonzero(np.diff(pointers))
+    if len(filled):
+        first, last = pointers[0], pointers[-1]
+        values = matrix.category_ids[matrix.product_categories[first:last]]
+        hashes = (values.astype(np.uint64)[:, None] * multipliers + offsets) % PRIME
+        result[filled] = np.minimum.reduceat(hashes, pointers[filled] - first, axis=0)
+    return result
+
+
+def buckets(signature, bands, rows):
+    """Buckets of the products, one per band of rows minimums
+
+    Args:
+        signature (ndarray): MinHash signatures of the products
+        bands (int): number of bands
+        rows (int): minimums per band
+
+    Returns:
+        ndarray: one bucket per band and per product, as signed 64-bit integers
+    """
+    result = np.empty((len(signature), bands), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for band in range(bands):
+            # FNV-1a over the minimums, seeded by the band
+            value = np.full(len(signature), 0xCBF29CE484222325 ^ band, dtype=np.uint64)
+            for row in range(band * rows, (band + 1) * rows):
+                value = (value ^ signature[:, row]) * np.uint64(0x100000001B3)
+            result[:, band] = value
+    return result.view(np.int64)
+
+
+def rebuild(bands=32, rows=2, batch_size=10000):
+    """Compute the LSH buckets of every product
+
+    Args:
+        bands (int, optional): number of bands, more bands find more
+        substitutes with more candidates. Defaults to 32.
+        rows (int, optional): minimums per band, more rows keep the
+        candidates sharing more categories. Defaults to 2.
+        batch_size (int, optional): products hashed and copied at once.
+        Defaults to 10000.
+
+    Returns:
+        int: number of products indexed
+    """
+    matrix = CategoryMatrix.load()
+    empty = np.diff(matrix.product_ptr) == 0
+    table = Product._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS import_lsh_buckets "
+            "(id integer, lsh_buckets bigint[]) ON COMMIT DROP"
+        )
+        for start in range(0, len(matrix.ids), batch_size):
+            end = min(start + batch_size, len(matrix.ids))
+            values = buckets(signatures(matrix, bands * rows, start, end), bands, rows)
+            buffer = io.StringIO()
+            for product_id, row, without in zip(
+                matrix.ids[start:end].tolist(),
+                values.tolist(),
+                empty[start:end].tolist(),
+            ):
+                array = "" if without else ",".join(map(str, row))
+                buffer.write(f'{product_id},"{{{array}}}"\n')
+            buffer.seek(0)
+            cursor.copy_expert(
+                "COPY import_lsh_buckets FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        cursor.execute(
+            f"UPDATE {table} SET lsh_buckets = staged.lsh_buckets "
+            f"FROM import_lsh_buckets staged WHERE {table}.id = staged.id "
+            f"AND {table}.lsh_buckets IS DISTINCT FROM staged.lsh_buckets"
+        )
+    return len(matrix.ids)
@@ -0,0 +1,182 @@
+"""Staged import pipeline: threads fetching pages, a pool of processes
+decoding and normalizing them, and a single writer batching the database writes
+"""
+import json
+import math
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import ijson
+from product.importer import journal
+from product.importer.journal import Checkpoint
+from product.importer.loaders import (
+    product_values,
+    split_categories,
+    validate_product_dict,
+)
+from product.importer.report import ImportReport
+
+# page of a category listing, body is None when the listing did not change
+Page = namedtuple("Page", ["category", "number", "last", "body"])
+
+
+def decode_page(body):
+    """Decode, validate and normalize the products of a page,
+    in a process of the pool
+
+    Args:
+        body (bytes): JSON body of a search page
+
+    Returns:
+        tuple: normalized rows, number of products skipped,
+        error messages and seconds spent
+    """
+    started = time.perf_counter()
+    rows = []
+    skipped = 0
+    errors = []
+    for data in json.loads(body).get("products", []):
+        try:
+            if not validate_product_dict(data):
+                skipped += 1
+                continue
+            rows.append((product_values(data), split_categories(data)))
+        except (AttributeError, KeyError, TypeError, ValueError) as exx:
+            errors.append(str(exx))
+    return rows, skipped, errors, time.perf_counter() - started
+
+
+class Pipeline:
+    """Pipeline connects the stages of an import with bounded queues,
+    so that a slow stage holds back the others instead of filling the memory
+
+    Args:
+        command (Command): import_off command, giving its client and options
+        loader (BulkLoader): single writer of the pipeline
+        processes (int, optional): size of the pool decoding the pages.
+        Defaults to the number of CPUs.
+        page_size (int, optional): products requested per page. Defaults to 500.
+        report (ImportReport, optional): report holding the counters of the
+        stages, the fetch stage being counted by its observation of the client.
+        Defaults to a new report.
+    """
+
+    def __init__(self, command, loader, processes=None, page_size=500, report=None):
+        self.command = command
+        self.client = command.client
+        self.loader = loader
+        self.processes = processes or os.cpu_count() or 1
+        self.page_size = page_size
+        self.report = report or ImportReport()
+        self.fetch = self.report.stage("fetch")
+        self.decode = self.report.stage("decode")
+        self.write = self.report.stage("write")
+        self.skipped = 0
+
+    def payload(self, category_name, page):
+        """Query string of a page of a category listing
+
+        Args:
+            category_name (string): a name of category
+            page (int): number of the page
+
+        Returns:
+            dictionnary: parameters of the search
+        """
+        return {
+            "action": "process",
+            "tagtype_0": "categories",
+            "tag_contains_0": "contains",
+            "tag_0": category_name,
+            "sort_by": "unique_scans_n",
+            "page_size": self.page_size,
+            "page": page,
+            "json": 1,
+        }
+
+    def fetch_pages(self, category_name, start_page=1):
+        """Download the pages of a category, in a thread of the client
+
+        Args:
+            category_name (string): a name of category
+            start_page (int, optional): first page requested. Defaults to 1.
+
+        Yields:
+            Page: each page with its raw body, None for a page answered by a 304
+        """
+        number = start_page
+        last_page = None
+        while last_page is None or number <= last_page:
+            response = self.client.get(
+                "/cgi/search.pl?",
+                params=self.payload(category_name, number),
+                conditional=self.command.delta,
+            )
+            if response.status_code != 304:
+                response.raise_for_status()
+            body = response.content if response.status_code == 200 else None
+            # a page answered by a 304 gives no count and the following pages
+            # may have changed, the walk goes on up to a page answered in full
+            if last_page is None and body:
+                # the count comes first in the body, the page is not decoded here
+                count = next(ijson.items(body, "count"), None)
+                # a page at or past the count is short or empty, the last one
+                last_page = max(math.ceil(int(count or 0) / self.page_size), number)
+            yield Page(
+                category_name,
+                number,
+                last_page is not None and number >= last_page,
+                body,
+            )
+            number += 1
+
+    def run(self, categories, pages=None):
+        """Import the categories through the stages of the pipeline
+
+        Args:
+            categories (list): names of the categories to import
+            pages (dictionnary, optional): last page committed for the categories
+            in progress. Defaults to None.
+        """
+        pages = pages or {}
+        with ProcessPoolExecutor(
+            max_workers=self.processes, initializer=django.setup
+        ) as pool:
+            # start the processes before the fetching threads are running
+            pool.submit(os.getpid).result()
+            pending = deque()
+            for page in self.client.stream(
+                lambda name: self.fetch_pages(name, pages.get(name, 0) + 1),
+                categories,
+                maxsize=2 * self.client.workers,
+            ):
+                future = pool.submit(decode_page, page.body) if page.body else None
+                pending.append((page, future))
+                if len(pending) >= 2 * self.processes:
+                    self.write_page(*pending.popleft())
+            while pending:
+                self.write_page(*pending.popleft())
+
+    def write_page(self, page, future):
+        """Write the products of a decoded page and journal it
+
+        Args:
+            page (Page): page fetched
+            future (Future): result of decode_page, None for an unchanged page
+        """
+        if future is not None:
+            rows, skipped, errors, seconds = future.result()
+            self.decode.add(items=len(rows) + skipped + len(errors), seconds=seconds)
+            self.skipped += skipped
+            self.loader.failed += len(errors)
+            for error in errors:
+                print("Un des produits n'a pu être importé, voici l'erreur :", error)
+            started = time.perf_counter()
+            for values, categories in rows:
+                self.loader.add_row(values, categories)
+            self.loader.flush()
+            self.write.add(items=len(rows), seconds=time.perf_counter() - started)
+        journal.record(Checkpoint(page.category, page.number, page.last))
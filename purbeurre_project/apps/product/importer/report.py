@@ -0,0 +1,236 @@
+"""Profiling report of import_off: time spent by stage, latency of the
+Open Food Facts API, queries issued and products written
+"""
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+class StageCounter:
+    """StageCounter sums the work done by a stage of the import
+
+    Args:
+        name (string): name of the stage
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items=0, size=0, seconds=0.0):
+        """Count the work of a stage, from any thread
+
+        Args:
+            items (int, optional): items handled. Defaults to 0.
+            size (int, optional): bytes handled. Defaults to 0.
+            seconds (float, optional): time spent. Defaults to 0.0.
+        """
+        with self.lock:
+            self.items += items
+            self.bytes += size
+            self.seconds += seconds
+
+    def rate(self):
+        """Throughput of the stage
+
+        Returns:
+            float: items handled per second spent in the stage
+        """
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        """Work of the stage, for the JSON report
+
+        Returns:
+            dictionnary: items, bytes, seconds and rate of the stage
+        """
+        return {
+            "items": self.items,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 6),
+            "rate": round(self.rate(), 3),
+        }
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.items} in {self.seconds:.1f}s "
+            f"({self.rate():.1f}/s, {self.bytes} bytes)"
+        )
+
+
+def percentiles(values):
+    """Summarize latencies with nearest-rank percentiles
+
+    Args:
+        values (list): latencies in seconds
+
+    Returns:
+        dictionnary: count, p50, p90, p99 and max of the latencies
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(fraction):
+        return round(ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)], 6)
+
+    return {
+        "count": len(ordered),
+        "p50": rank(0.5),
+        "p90": rank(0.9),
+        "p99": rank(0.99),
+        "max": round(ordered[-1], 6),
+    }
+
+
+class ImportReport:
+    """ImportReport collects the measures of an import: it observes the
+    responses of OffClient, wraps the queries of the import connection
+    and holds the counters of the stages
+
+    Args:
+        options (dictionnary, optional): options of the command, copied
+        into the report. Defaults to None.
+    """
+
+    def __init__(self, options=None):
+        self.options = options or {}
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.stages = {}
+        # category or endpoint -> latencies of its requests
+        self.latencies = defaultdict(list)
+        self.downloaded = defaultdict(int)
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """Counter of a stage, created on first use
+
+        Args:
+            name (string): name of the stage
+
+        Returns:
+            StageCounter: counter of the stage
+        """
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = StageCounter(name)
+            return self.stages[name]
+
+    @contextmanager
+    def timed(self, name, items=1):
+        """Count the time spent by a block in a stage
+
+        Args:
+            name (string): name of the stage
+            items (int, optional): items handled by the block. Defaults to 1.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(name).add(items=items, seconds=time.perf_counter() - started)
+
+    def observe(self, path, params, seconds, size):
+        """Record a response of OffClient, from any fetching thread
+
+        Args:
+            path (string): endpoint requested
+            params (dictionnary): query string, giving the category requested
+            seconds (float): latency of the response
+            size (int): bytes received on the wire, before decompression
+        """
+        label = (params or {}).get("tag_0", path)
+        with self.lock:
+            self.latencies[label].append(seconds)
+            self.downloaded[label] += size
+        self.stage("fetch").add(items=1, size=size, seconds=seconds)
+
+    def __call__(self, execute, sql, params, many, context):
+        """Count the queries of the import connection, as an execute wrapper
+
+        Args:
+            execute (callable): next wrapper or execution of the query
+            sql (string): query executed
+            params (list): parameters of the query
+            many (bool): query executed with executemany
+            context (dictionnary): connection and cursor of the query
+
+        Returns:
+            object: result of the execution
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+    def as_dict(self, loader=None, processed=0, skipped=0):
+        """Build the machine-readable report
+
+        Args:
+            loader (BulkLoader, optional): loader of the import, None for
+            the row loader. Defaults to None.
+            processed (int, optional): products read. Defaults to 0.
+            skipped (int, optional): products failing the validation.
+            Defaults to 0.
+
+        Returns:
+            dictionnary: report ready to be dumped as JSON
+        """
+        wall_seconds = time.perf_counter() - self.started
+        products = {"processed": processed, "skipped": skipped}
+        if loader is not None:
+            products.update(
+                created=loader.created,
+                updated=loader.updated,
+                unchanged=loader.unchanged,
+                failed=loader.failed,
+            )
+        latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(wall_seconds, 6),
+            "options": self.options,
+            "stages": {name: stage.as_dict() for name, stage in self.stages.items()},
+            "http": {
+                "wire_bytes": sum(self.downloaded.values()),
+                "latency": percentiles(latencies),
+                "categories": {
+                    label: {
+                        "wire_bytes": self.downloaded[label],
+                        "latency": percentiles(values),
+                    }
+                    for label, values in self.latencies.items()
+                },
+            },
+            "queries": {
+                "count": self.queries,
+                "seconds": round(self.query_seconds, 6),
+            },
+            "products": products,
+            "products_per_second": round(
+                processed / wall_seconds if wall_seconds else 0.0, 3
+            ),
+        }
+
+    def to_json(self, **kwargs):
+        """Serialize the report
+
+        Args:
+            kwargs: arguments of as_dict
+
+        Returns:
+            string: the report as indented JSON
+        """
+        return json.dumps(self.as_dict(**kwargs), indent=2, default=str)
@@ -0,0 +1,290 @@
+"""Shadow catalogue of import_off: the next version of the product tables
+is built in a schema of its own, then swapped with the live tables
+in one short transaction, so that readers only see complete catalogues
+"""
+import re
+import time
+from contextlib import contextmanager
+
+from django.db import OperationalError, connection, transaction
+from psycopg2.errorcodes import LOCK_NOT_AVAILABLE
+from product.models import Category, Product
+
+SHADOW_SCHEMA = "import_shadow"
+RETIRED_SCHEMA = "import_retired"
+
+
+def catalogue_tables():
+    """Tables swapped by the import, in the order they are created
+
+    Returns:
+        list: names of the category, product and M2M tables
+    """
+    return [
+        Category._meta.db_table,
+        Product._meta.db_table,
+        Product.categories.through._meta.db_table,
+    ]
+
+
+def retarget(definition, schema):
+    """Point the references of a foreign key definition to a schema
+
+    Args:
+        definition (string): definition given by pg_get_constraintdef
+        schema (string): schema of the referenced table
+
+    Returns:
+        string: definition referencing the table of the schema
+    """
+    return re.sub(
+        r"REFERENCES (?:\S+\.)?(\w+)\(",
+        lambda match: f"REFERENCES {schema}.{match.group(1)}(",
+        definition,
+    )
+
+
+def foreign_keys(cursor, schema, inside):
+    """Foreign keys referencing the catalogue tables of a schema
+
+    Args:
+        cursor (CursorWrapper): cursor of the import connection
+        schema (string): schema of the catalogue tables
+        inside (bool): keep the keys declared by the catalogue tables,
+        otherwise the keys declared by the other tables
+
+    Returns:
+        list: tuples of declaring table, qualified and not,
+        constraint name and definition
+    """
+    cursor.execute(
+        "SELECT quote_ident(nspname) || '.' || quote_ident(relname), relname, "
+        "conname, pg_get_constraintdef(pg_constraint.oid) FROM pg_constraint "
+        "JOIN pg_class ON pg_class.oid = conrelid "
+        "JOIN pg_namespace ON pg_namespace.oid = relnamespace "
+        "WHERE contype = 'f' AND confrelid = ANY(%s::regclass[]) "
+        "AND (conrelid = ANY(%s::regclass[])) = %s",
+        [
+            [f"{schema}.{table}" for table in catalogue_tables()],
+            [f"{schema}.{table}" for table in catalogue_tables()],
+            inside,
+        ],
+    )
+    return cursor.fetchall()
+
+
+def indexes(cursor, schema, table):
+    """Indexes of a table, keyed by what they index
+
+    Args:
+        cursor (CursorWrapper): cursor of the import connection
+        schema (string): schema of the table
+        table (string): name of the table
+
+    Returns:
+        dictionnary: index name keyed by uniqueness and indexed columns
+    """
+    cursor.execute(
+        "SELECT index.relname, pg_index.indisunique, "
+        "pg_get_indexdef(pg_index.indexrelid) FROM pg_index "
+        "JOIN pg_class index ON index.oid = pg_index.indexrelid "
+        "WHERE pg_index.indrelid = %s::regclass ORDER BY index.relname",
+        [f"{schema}.{table}"],
+    )
+    return {
+        (unique, definition.split(" USING ", 1)[1]): name
+        for name, unique, definition in cursor.fetchall()
+    }
+
+
+def exists():
+    """Tell whether a shadow catalogue is in progress
+
+    Returns:
+        boolean: true when the shadow tables exist
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM pg_tables WHERE schemaname = %s "
+            "AND tablename = ANY(%s)",
+            [SHADOW_SCHEMA, catalogue_tables()],
+        )
+        return cursor.fetchone()[0] == len(catalogue_tables())
+
+
+def prepare(resume=False):
+    """Create the shadow tables as a copy of the live catalogue, keeping
+    the ids referenced by the favorites of the customers
+
+    Args:
+        resume (bool, optional): keep the shadow tables of an interrupted
+        import. Defaults to False.
+    """
+    if resume and exists():
+        return
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT current_schema()")
+        live = cursor.fetchone()[0]
+        cursor.execute(f"DROP SCHEMA IF EXISTS {quote(SHADOW_SCHEMA)} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {quote(SHADOW_SCHEMA)}")
+        for table in catalogue_tables():
+            cursor.execute(
+                f"CREATE TABLE {quote(SHADOW_SCHEMA)}.{quote(table)} "
+                f"(LIKE {quote(live)}.{quote(table)} INCLUDING ALL)"
+            )
+            cursor.execute(
+                f"INSERT INTO {quote(SHADOW_SCHEMA)}.{quote(table)} "
+                f"SELECT * FROM {quote(live)}.{quote(table)}"
+            )
+        for _, table, name, definition in foreign_keys(cursor, live, inside=True):
+            cursor.execute(
+                f"ALTER TABLE {quote(SHADOW_SCHEMA)}.{quote(table)} "
+                f"ADD CONSTRAINT {quote(name)} "
+                f"{retarget(definition, quote(SHADOW_SCHEMA))}"
+            )
+
+
+@contextmanager
+def redirect():
+    """Send the queries of the import connection to the shadow tables,
+    the other tables being found in the live schema"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW search_path")
+        search_path = cursor.fetchone()[0]
+        cursor.execute(f"SET search_path = {quote(SHADOW_SCHEMA)}, {search_path}")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SET search_path = {search_path}")
+
+
+def analyze():
+    """Refresh the planner statistics of the shadow tables before the swap"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for table in catalogue_tables():
+            cursor.execute(f"ANALYZE {quote(SHADOW_SCHEMA)}.{quote(table)}")
+
+
+def exchange(cursor, lock_timeout):
+    """Move the live tables away and the shadow tables in, keeping the names
+    of their indexes, the ownership of their sequences and the foreign keys
+    of the favorites, added back NOT VALID so that the swap does not scan
+    the tables declaring them
+
+    Args:
+        cursor (CursorWrapper): cursor of the swap transaction
+        lock_timeout (string): longest wait for the live tables
+
+    Returns:
+        list: tuples of qualified declaring table and constraint name
+        of the foreign keys left to validate
+    """
+    quote = connection.ops.quote_name
+    tables = catalogue_tables()
+    cursor.execute("SELECT current_schema()")
+    live = cursor.fetchone()[0]
+    # deferred foreign key checks would prevent altering the favorites
+    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    cursor.execute("SET LOCAL lock_timeout = %s", [lock_timeout])
+    cursor.execute(
+        "LOCK TABLE "
+        + ", ".join(f"{quote(live)}.{quote(table)}" for table in tables)
+        + " IN ACCESS EXCLUSIVE MODE"
+    )
+    names = {table: indexes(cursor, live, table) for table in tables}
+    sequences = {}
+    for table in tables:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [f"{live}.{table}"])
+        sequences[table] = cursor.fetchone()[0]
+    outside = foreign_keys(cursor, live, inside=False)
+    for table, _, name, _ in outside:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {quote(name)}")
+    cursor.execute(f"DROP SCHEMA IF EXISTS {quote(RETIRED_SCHEMA)} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {quote(RETIRED_SCHEMA)}")
+    for table in tables:
+        # a sequence would follow the table owning it into the retired schema
+        if sequences[table]:
+            cursor.execute(f"ALTER SEQUENCE {sequences[table]} OWNED BY NONE")
+        cursor.execute(
+            f"ALTER TABLE {quote(live)}.{quote(table)} "
+            f"SET SCHEMA {quote(RETIRED_SCHEMA)}"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(SHADOW_SCHEMA)}.{quote(table)} SET SCHEMA {quote(live)}"
+        )
+        if sequences[table]:
+            cursor.execute(
+                f"ALTER SEQUENCE {sequences[table]} "
+                f"OWNED BY {quote(live)}.{quote(table)}.{quote('id')}"
+            )
+    # the old tables free their index names once they are dropped
+    cursor.execute(f"DROP SCHEMA {quote(RETIRED_SCHEMA)} CASCADE")
+    renames = []
+    for table in tables:
+        for key, name in indexes(cursor, live, table).items():
+            if key in names[table] and names[table][key] != name:
+                renames.append((name, names[table][key]))
+    for position, (name, _) in enumerate(renames):
+        cursor.execute(
+            f"ALTER INDEX {quote(live)}.{quote(name)} "
+            f"RENAME TO {quote(f'import_swap_{position}')}"
+        )
+    for position, (_, name) in enumerate(renames):
+        cursor.execute(
+            f"ALTER INDEX {quote(live)}.{quote(f'import_swap_{position}')} "
+            f"RENAME TO {quote(name)}"
+        )
+    for table, _, name, definition in outside:
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} "
+            f"{retarget(definition, quote(live))} NOT VALID"
+        )
+    cursor.execute(f"DROP SCHEMA {quote(SHADOW_SCHEMA)}")
+    return [(table, name) for table, _, name, _ in outside]
+
+
+def validate(keys):
+    """Check the rows of the foreign keys added back by the swap, once it
+    is committed: the validation only holds a lock letting the favorites
+    be read and written
+
+    Args:
+        keys (list): tuples of qualified declaring table and constraint name
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for table, name in keys:
+            cursor.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {quote(name)}")
+
+
+def swap(lock_timeout="2s", retries=5, backoff=1.0):
+    """Replace the live catalogue by the shadow catalogue in one transaction.
+    The transaction gives up when the readers hold the live tables longer
+    than the lock timeout, so that the readers queued behind it never wait
+    long, and is tried again later. The foreign keys of the favorites are
+    validated after the commit.
+
+    Args:
+        lock_timeout (string, optional): longest wait for the live tables.
+        Defaults to "2s".
+        retries (int, optional): attempts made before giving up. Defaults to 5.
+        backoff (float, optional): seconds waited before the first retry,
+        doubled at each retry. Defaults to 1.0.
+    """
+    for attempt in range(retries):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                keys = exchange(cursor, lock_timeout)
+            validate(keys)
+            return
+        except OperationalError as exx:
+            if (
+                getattr(exx.__cause__, "pgcode", None) != LOCK_NOT_AVAILABLE
+                or attempt == retries - 1
+            ):
+                raise
+            time.sleep(backoff * 2**attempt)
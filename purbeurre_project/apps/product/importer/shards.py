@@ -0,0 +1,89 @@
+"""Sharded imports: the categories are split between several import_off
+processes, which coordinate through PostgreSQL advisory locks
+"""
+import zlib
+from contextlib import ExitStack, contextmanager
+
+from django.db import connection
+
+
+class LockUnavailable(Exception):
+    """The advisory lock is held by another import"""
+
+
+def lock_key(*parts):
+    """Key of an advisory lock, stable from one process to another
+
+    Args:
+        parts (tuple): names and numbers identifying the lock
+
+    Returns:
+        int: key of the lock
+    """
+    return zlib.crc32(":".join(str(part) for part in parts).encode())
+
+
+def in_shard(name, shards, index):
+    """Tell whether a category or a product belongs to a shard
+
+    Args:
+        name (string): name of the category or the product
+        shards (int): number of shards
+        index (int): index of the shard, from 0
+
+    Returns:
+        boolean: true when the shard imports the name
+    """
+    return zlib.crc32(name.encode()) % shards == index
+
+
+@contextmanager
+def advisory_lock(*parts, shared=False, wait=True):
+    """Hold a session advisory lock of the import connection
+
+    Args:
+        parts (tuple): names and numbers identifying the lock
+        shared (bool, optional): share the lock with the other shared holders.
+        Defaults to False.
+        wait (bool, optional): wait for the lock, otherwise give up at once.
+        Defaults to True.
+
+    Raises:
+        LockUnavailable: the lock is held and wait is false
+    """
+    key = lock_key(*parts)
+    suffix = "_shared" if shared else ""
+    with connection.cursor() as cursor:
+        if wait:
+            cursor.execute(f"SELECT pg_advisory_lock{suffix}(%s)", [key])
+        else:
+            cursor.execute(f"SELECT pg_try_advisory_lock{suffix}(%s)", [key])
+            if not cursor.fetchone()[0]:
+                raise LockUnavailable(":".join(str(part) for part in parts))
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT pg_advisory_unlock{suffix}(%s)", [key])
+
+
+@contextmanager
+def import_lock(shards=1, index=0):
+    """Keep the imports of several nodes from overlapping: an import holds
+    the global lock alone, while the shards of an import share it and each
+    holds the lock of its shard
+
+    Args:
+        shards (int, optional): number of shards. Defaults to 1.
+        index (int, optional): index of the shard, from 0. Defaults to 0.
+
+    Raises:
+        LockUnavailable: another import or the same shard is running
+    """
+    with ExitStack() as stack:
+        if shards == 1:
+            stack.enter_context(advisory_lock("import_off", wait=False))
+        else:
+            stack.enter_context(advisory_lock("import_off", shared=True, wait=False))
+            stack.enter_context(advisory_lock("import_off", shards, index, wait=False))
+        yield
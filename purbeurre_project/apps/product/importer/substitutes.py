@@ -0,0 +1,202 @@
+"""Ranked substitutes: the best substitutes of every product are computed once
+after an import, so that the substitute page reads them with one lookup
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from product.models import Category, Product, ProductSubstitute
+
+# substitutes kept per product, ten pages of the substitute results
+SUBSTITUTES_PER_PRODUCT = 60
+
+
+def refresh_categories(product_ids=None):
+    """Copy the categories of products to their category_ids array
+    and their category signature, and count the products of the categories
+    they joined or left
+
+    Args:
+        product_ids (list, optional): ids of the products whose categories
+        changed. Defaults to None, for all.
+
+    Returns:
+        int: number of products changed
+    """
+    products = Product._meta.db_table
+    through = Product.categories.through._meta.db_table
+    where = "" if product_ids is None else "WHERE product.id = ANY(%s)"
+    params = [] if product_ids is None else [list(product_ids)]
+    with connection.cursor() as cursor:
+        if product_ids is not None:
+            # the categories left are read before the arrays change
+            cursor.execute(
+                f"""
+                SELECT unnest(category_ids) FROM {products} WHERE id = ANY(%s)
+                UNION SELECT category_id FROM {through} WHERE product_id = ANY(%s)
+                """,
+                params * 2,
+            )
+            categories = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            f"""
+            UPDATE {products}
+            SET category_ids = linked.category_ids,
+                category_signature = linked.signature
+            FROM (
+                SELECT product.id,
+                    coalesce(array_agg(link.category_id ORDER BY link.category_id)
+                        FILTER (WHERE link.category_id IS NOT NULL), '{{}}')
+                        AS category_ids,
+                    coalesce(md5(string_agg(
+                        link.category_id::text, ',' ORDER BY link.category_id
+                    )), '') AS signature
+                FROM {products} product
+                LEFT JOIN {through} link ON link.product_id = product.id
+                {where}
+                GROUP BY product.id
+            ) linked
+            WHERE {products}.id = linked.id
+            AND ({products}.category_signature <> linked.signature
+                OR {products}.category_ids <> linked.category_ids)
+            """,
+            params,
+        )
+        changed = cursor.rowcount
+        count_products(cursor, None if product_ids is None else categories)
+        return changed
+
+
+def count_products(cursor, category_ids=None):
+    """Store the number of products of categories, read by
+    Product.array_substitutes to look up the rarest categories
+
+    Args:
+        cursor (cursor): cursor of the refresh
+        category_ids (list, optional): ids of the categories counted.
+        Defaults to None, for all.
+    """
+    categories = Category._meta.db_table
+    through = Product.categories.through._meta.db_table
+    where = "" if category_ids is None else "WHERE category.id = ANY(%s)"
+    cursor.execute(
+        f"""
+        UPDATE {categories}
+        SET product_count = counted.products
+        FROM (
+            SELECT category.id, count(link.product_id) AS products
+            FROM {categories} category
+            LEFT JOIN {through} link ON link.category_id = category.id
+            {where}
+            GROUP BY category.id
+        ) counted
+        WHERE {categories}.id = counted.id
+        AND {categories}.product_count <> counted.products
+        """,
+        [] if category_ids is None else [category_ids],
+    )
+
+
+def rebuild(limit=SUBSTITUTES_PER_PRODUCT, common=4):
+    """Rank the substitutes of every product as Product.substitutes does:
+    products sharing enough categories with a grade as good or better,
+    one per grade and energy, ordered by grade then energy.
+    The categories are counted once per category signature and grade,
+    then the substitutes are shared by the products of the signature
+
+    Args:
+        limit (int, optional): substitutes kept per product.
+        Defaults to SUBSTITUTES_PER_PRODUCT.
+        common (int, optional): categories shared with the product.
+        Defaults to 4.
+
+    Returns:
+        int: number of substitutes saved
+    """
+    table = ProductSubstitute._meta.db_table
+    products = Product._meta.db_table
+    through = Product.categories.through._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+        cursor.execute(f"DELETE FROM {table}")
+        refresh_categories()
+        cursor.execute(
+            f"""
+            WITH representatives AS (
+                SELECT DISTINCT ON (category_signature, nutrition_grade)
+                    id, category_signature, nutrition_grade
+                FROM {products}
+                WHERE category_signature <> ''
+                ORDER BY category_signature, nutrition_grade, id
+            ),
+            shared AS (
+                -- a representative is a candidate of the other products
+                -- of its signature, so it is not left out here
+                SELECT mine.product_id AS representative_id,
+                    other.product_id AS substitute_id, count(*) AS shared
+                FROM representatives
+                JOIN {through} mine ON mine.product_id = representatives.id
+                JOIN {through} other ON other.category_id = mine.category_id
+                GROUP BY mine.product_id, other.product_id
+                HAVING count(*) >= %(common)s
+            ),
+            candidates AS (
+                SELECT DISTINCT ON (
+                    product.id, substitute.nutrition_grade, substitute.energy_100g
+                )
+                    product.id AS product_id, shared.substitute_id, shared.shared,
+                    substitute.nutrition_grade, substitute.energy_100g
+                FROM shared
+                JOIN representatives
+                    ON representatives.id = shared.representative_id
+                JOIN {products} product
+                    ON product.category_signature = representatives.category_signature
+                    AND product.nutrition_grade = representatives.nutrition_grade
+                JOIN {products} substitute ON substitute.id = shared.substitute_id
+                WHERE substitute.nutrition_grade <= representatives.nutrition_grade
+                AND substitute.id <> product.id
+                ORDER BY product.id, substitute.nutrition_grade,
+                    substitute.energy_100g, substitute.id
+            ),
+            ranked AS (
+                SELECT product_id, substitute_id, shared, row_number() OVER (
+                    PARTITION BY product_id
+                    ORDER BY nutrition_grade, energy_100g, substitute_id
+                ) AS rank
+                FROM candidates
+            )
+            INSERT INTO {table} (product_id, substitute_id, rank, score)
+            SELECT product_id, substitute_id, rank, shared
+            FROM ranked
+            WHERE rank <= %(limit)s
+            """,
+            {"common": common, "limit": limit},
+        )
+        saved = cursor.rowcount
+        cursor.execute(
+            f"UPDATE {products} SET substitutes_computed = true "
+            "WHERE NOT substitutes_computed"
+        )
+    return saved
+
+
+def rank(method=None, limit=SUBSTITUTES_PER_PRODUCT, **options):
+    """Rank the substitutes of every product with the ranking chosen,
+    so that an import keeps the ranking of compute_substitutes
+
+    Args:
+        method (string, optional): "overlap" for rebuild, "idf" for
+        the ranking of product.importer.idf. Defaults to None, for
+        the SUBSTITUTE_RANKING setting.
+        limit (int, optional): substitutes kept per product.
+        Defaults to SUBSTITUTES_PER_PRODUCT.
+        options: memory and max_df of the idf ranking
+
+    Returns:
+        int: number of substitutes saved
+    """
+    method = method or settings.SUBSTITUTE_RANKING
+    if method == "overlap":
+        return rebuild(limit=limit)
+    # idf reads SUBSTITUTES_PER_PRODUCT from this module
+    from product.importer import idf  # pylint: disable=import-outside-toplevel
+
+    return idf.rebuild(limit=limit, **options)
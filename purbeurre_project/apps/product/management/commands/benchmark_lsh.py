@@ -0,0 +1,96 @@
+"""
+The custom management command benchmark_lsh measures the recall and the
+latency of Product.similar_substitutes against Product.substitutes.
+"""
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from product.importer.report import percentiles
+from product.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to compare the approximate substitutes found
+    through the LSH buckets with the exact substitutes
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Benchmark the recall and latency of the LSH substitute search"
+
+    def add_arguments(self, parser):
+        """Options of the benchmark_lsh command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--samples", type=int, default=200, help="number of products looked up"
+        )
+        parser.add_argument(
+            "--bands",
+            type=int,
+            nargs="+",
+            default=[4, 8, 16, 32],
+            help="bands of the buckets looked up, one measure each",
+        )
+        parser.add_argument(
+            "--common",
+            type=int,
+            default=4,
+            help="number of categories shared with the product",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="seed of the products sampled"
+        )
+
+    @staticmethod
+    def timed(queryset):
+        """Evaluate a substitute query
+
+        Args:
+            queryset (QuerySet): substitutes of a product
+
+        Returns:
+            tuple: grades and energies of the substitutes, seconds spent
+        """
+        started = time.perf_counter()
+        found = set(queryset.values_list("nutrition_grade", "energy_100g"))
+        return found, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        """Main method to benchmark the LSH substitute search"""
+        ids = list(Product.objects.exclude(lsh_buckets=[]).values_list("id", flat=True))
+        if not ids:
+            raise CommandError("Run build_lsh before the benchmark")
+        sample = random.Random(options.get("seed", 0)).sample(
+            ids, min(options.get("samples", 200), len(ids))
+        )
+        common = options.get("common", 4)
+        products = list(Product.objects.filter(pk__in=sample))
+        exact, timings = [], []
+        for product in products:
+            found, seconds = self.timed(product.substitutes(common))
+            exact.append(found)
+            timings.append(seconds)
+        result = {"products": len(ids), "exact": percentiles(timings), "lsh": {}}
+        for bands in options.get("bands", [4, 8, 16, 32]):
+            timings, recalls = [], []
+            for product, expected in zip(products, exact):
+                found, seconds = self.timed(
+                    product.similar_substitutes(common, bands=bands)
+                )
+                timings.append(seconds)
+                # the ties on grade and energy may keep different products
+                if expected:
+                    recalls.append(len(found & expected) / len(expected))
+            result["lsh"][bands] = {
+                "recall": round(sum(recalls) / len(recalls), 4) if recalls else 1.0,
+                "latency": percentiles(timings),
+            }
+        self.stdout.write(json.dumps(result, indent=2))
@@ -0,0 +1,78 @@
+"""
+The custom management command benchmark_search compares the search of the
+product names by substring with the full-text search of product.search.
+"""
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from product.importer.report import percentiles
+from product.models import Product
+from product.plans import view_queryset
+from product.views import SearchResultsView
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to time the first page of the search results
+    of both modes on the same terms
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Benchmark the search of the names by substring and by full text"
+
+    def add_arguments(self, parser):
+        """Options of the benchmark_search command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=200,
+            help="number of names whose first word is searched",
+        )
+        parser.add_argument(
+            "--terms", nargs="*", default=[], help="terms searched, over the samples"
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="seed of the names sampled"
+        )
+
+    def handle(self, *args, **options):
+        """Main method to benchmark the search of the names"""
+        ids = list(Product.objects.values_list("id", flat=True))
+        if not ids:
+            raise CommandError("Import products before the benchmark")
+        terms = options.get("terms")
+        if not terms:
+            sample = random.Random(options.get("seed", 0)).sample(
+                ids, min(options.get("samples", 200), len(ids))
+            )
+            names = Product.objects.filter(pk__in=sample).values_list("name", flat=True)
+            terms = [name.split()[0] for name in names if name.split()]
+        timings = {"contains": [], "text": []}
+        found = {"contains": 0, "text": 0}
+        for term in terms:
+            for mode in timings:
+                started = time.perf_counter()
+                page = list(view_queryset(SearchResultsView, q=term, mode=mode))
+                timings[mode].append(time.perf_counter() - started)
+                found[mode] += len(page)
+        self.stdout.write(
+            json.dumps(
+                {
+                    "products": len(ids),
+                    "terms": len(terms),
+                    "contains": percentiles(timings["contains"]),
+                    "text": percentiles(timings["text"]),
+                    "found": found,
+                },
+                indent=2,
+            )
+        )
@@ -0,0 +1,99 @@
+"""
+The custom management command benchmark_substitutes compares the substitute
+query of the database with the in-process indexes of product.bitsets
+and product.nutrients.
+"""
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from product.bitsets import SubstituteIndex
+from product.importer.report import percentiles
+from product.models import Product
+from product.nutrients import NutrientIndex
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to time the substitute lookups of the database
+    and of the bitset and nutrient indexes on the same products
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Benchmark the substitute lookups of the database and the in-process indexes"
+
+    def add_arguments(self, parser):
+        """Options of the benchmark_substitutes command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--samples", type=int, default=200, help="number of products looked up"
+        )
+        parser.add_argument(
+            "--common",
+            type=int,
+            default=4,
+            help="number of categories shared with the product",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="seed of the products sampled"
+        )
+
+    def handle(self, *args, **options):
+        """Main method to benchmark the substitute lookups"""
+        ids = list(Product.objects.values_list("id", flat=True))
+        if not ids:
+            raise CommandError("Import products before the benchmark")
+        started = time.perf_counter()
+        index = SubstituteIndex.load()
+        loaded = time.perf_counter() - started
+        started = time.perf_counter()
+        nutrients = NutrientIndex.load(index)
+        nutrients_loaded = time.perf_counter() - started
+        sample = random.Random(options.get("seed", 0)).sample(
+            ids, min(options.get("samples", 200), len(ids))
+        )
+        common = options.get("common", 4)
+        timings = {"sql": [], "index": [], "nutrients": []}
+        mismatches = 0
+        for product in Product.objects.filter(pk__in=sample):
+            started = time.perf_counter()
+            expected = list(
+                product.substitutes(common).values_list(
+                    "nutrition_grade", "energy_100g"
+                )
+            )
+            timings["sql"].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            found = index.substitutes(product.pk, common)
+            timings["index"].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            nutrients.nearest(product.pk, nb_common_categories=common)
+            timings["nutrients"].append(time.perf_counter() - started)
+            # the ties on grade and energy may keep different products
+            if [index.keys[index.positions[pk]] for pk in found] != expected:
+                mismatches += 1
+        self.stdout.write(
+            json.dumps(
+                {
+                    "products": len(ids),
+                    "categories": len(index.bitsets) + len(index.sparse),
+                    "dense_categories": len(index.bitsets),
+                    "load_seconds": round(loaded, 6),
+                    "sql": percentiles(timings["sql"]),
+                    "index": percentiles(timings["index"]),
+                    "nutrients_load_seconds": round(nutrients_loaded, 6),
+                    "nutrients": percentiles(timings["nutrients"]),
+                    "mismatches": mismatches,
+                },
+                indent=2,
+            )
+        )
+        if mismatches:
+            raise CommandError(f"{mismatches} products found other substitutes")
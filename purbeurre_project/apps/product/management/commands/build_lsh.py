@@ -0,0 +1,58 @@
+"""
+The custom management command build_lsh computes the LSH buckets of the
+categories of every product, used by Product.similar_substitutes.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from product.importer import lsh, shards
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to index the category sets of the products
+    with MinHash signatures split into LSH bands
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Compute the LSH buckets of the categories of every product"
+
+    def add_arguments(self, parser):
+        """Options of the build_lsh command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--bands",
+            type=int,
+            default=32,
+            help="buckets per product, more bands find more substitutes",
+        )
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=2,
+            help="minimums per band, more rows keep fewer and closer candidates",
+        )
+
+    def handle(self, *args, **options):
+        """Main method to index the categories of the products"""
+        self.stdout.write("LSH indexing in progress...")
+        started = time.perf_counter()
+        try:
+            # the categories must not change while they are hashed
+            with shards.import_lock():
+                indexed = lsh.rebuild(
+                    bands=options.get("bands", 32), rows=options.get("rows", 2)
+                )
+        except shards.LockUnavailable as exx:
+            raise CommandError(
+                f"An import holds the lock {exx}, try again once it is done"
+            ) from exx
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{indexed} products indexed in {elapsed:.1f}s")
+        self.stdout.write(self.style.SUCCESS("Products successfully indexed !"))
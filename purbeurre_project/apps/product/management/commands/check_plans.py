@@ -0,0 +1,66 @@
+"""
+The custom management command check_plans explains the substitute, search
+and favorites queries on the catalogue and fails when a plan regresses.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Func
+from product.models import Product
+from product.plans import check
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to guard the plans of the queries of the product
+    pages against sequential scans and growing costs
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Explain the queries of the product pages and fail on a plan regression"
+
+    def add_arguments(self, parser):
+        """Options of the check_plans command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--product",
+            type=int,
+            help="id of the product whose substitutes are explained, "
+            "the product with the most categories by default",
+        )
+        parser.add_argument(
+            "--term", default="chocolat", help="terms of the search explained"
+        )
+
+    def handle(self, *args, **options):
+        """Main method to check the plans of the product pages"""
+        products = Product.objects.annotate(
+            size=Func("category_ids", function="cardinality")
+        ).order_by("-size", "id")
+        if options.get("product"):
+            products = products.filter(pk=options["product"])
+        product = products.first()
+        if product is None:
+            raise CommandError("Import products before the check")
+        # the customer with the most favorites, or no favorites at all
+        user = (
+            User.objects.annotate(favorites=Count("customerproduct"))
+            .order_by("-favorites", "id")
+            .first()
+        )
+        report = check(product, user, options.get("term", "chocolat"))
+        self.stdout.write(json.dumps(report, indent=2))
+        failed = [
+            f"{name}: {regression}"
+            for name, result in report.items()
+            for regression in result["regressions"]
+        ]
+        if failed:
+            raise CommandError("Plan regressions: " + ", ".join(failed))
@@ -0,0 +1,85 @@
+"""
+The custom management command compute_substitutes ranks the substitutes
+of every product, after the imports which do not rank them themselves.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from product.importer import shards, substitutes
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to rebuild the ranked substitutes of the products
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Rank the substitutes of every product"
+
+    def add_arguments(self, parser):
+        """Options of the compute_substitutes command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=substitutes.SUBSTITUTES_PER_PRODUCT,
+            help="substitutes kept per product",
+        )
+        parser.add_argument(
+            "--method",
+            choices=["overlap", "idf"],
+            help="rank by grade and energy the products sharing 4 categories "
+            "(overlap), or by the categories shared weighted by their rarity (idf), "
+            "the SUBSTITUTE_RANKING setting by default",
+        )
+        parser.add_argument(
+            "--memory",
+            type=int,
+            default=256,
+            help="megabytes of product pairs scored at once by the idf method",
+        )
+        parser.add_argument(
+            "--max-df",
+            type=float,
+            default=0.05,
+            help="share of the products above which a category does not pair "
+            "products by itself in the idf method",
+        )
+
+    def rebuild(self, options):
+        """Rank the substitutes with the method chosen
+
+        Args:
+            options (dictionnary): options of the command
+
+        Returns:
+            int: number of substitutes saved
+        """
+        return substitutes.rank(
+            options.get("method"),
+            limit=options.get("limit", substitutes.SUBSTITUTES_PER_PRODUCT),
+            memory=options.get("memory", 256),
+            max_df=options.get("max_df", 0.05),
+        )
+
+    def handle(self, *args, **options):
+        """Main method to rank the substitutes of the products"""
+        self.stdout.write("Substitute ranking in progress...")
+        started = time.perf_counter()
+        try:
+            # the products must not change while they are ranked
+            with shards.import_lock():
+                saved = self.rebuild(options)
+        except shards.LockUnavailable as exx:
+            raise CommandError(
+                f"An import holds the lock {exx}, try again once it is done"
+            ) from exx
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{saved} substitutes ranked in {elapsed:.1f}s")
+        self.stdout.write(self.style.SUCCESS("Substitutes successfully ranked !"))
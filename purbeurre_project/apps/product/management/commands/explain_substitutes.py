@@ -0,0 +1,109 @@
+"""
+The custom management command explain_substitutes compares the plans of
+Product.substitutes, joining the through table of the categories, and of
+Product.array_substitutes, reading the category_ids arrays.
+"""
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from product.importer.report import percentiles
+from product.models import Product
+from product.plans import explain, nodes
+
+VARIANTS = {
+    "through": Product.substitutes,
+    "array": Product.array_substitutes,
+}
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to run EXPLAIN ANALYZE on the substitute queries
+    of the same products
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Compare the plans of the substitute queries on the through table and the arrays"
+
+    def add_arguments(self, parser):
+        """Options of the explain_substitutes command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--samples", type=int, default=20, help="number of products explained"
+        )
+        parser.add_argument(
+            "--common",
+            type=int,
+            default=4,
+            help="number of categories shared with the product",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="seed of the products sampled"
+        )
+        parser.add_argument(
+            "--plans",
+            action="store_true",
+            help="write the plans of the first product explained",
+        )
+
+    def handle(self, *args, **options):
+        """Main method to explain the substitute queries"""
+        ids = list(
+            Product.objects.exclude(category_ids=[]).values_list("id", flat=True)
+        )
+        if not ids:
+            raise CommandError("Import products before the comparison")
+        sample = random.Random(options.get("seed", 0)).sample(
+            ids, min(options.get("samples", 20), len(ids))
+        )
+        common = options.get("common", 4)
+        timings = {name: [] for name in VARIANTS}
+        latencies = {name: [] for name in VARIANTS}
+        types = {name: set() for name in VARIANTS}
+        mismatches = 0
+        for product in Product.objects.filter(pk__in=sample):
+            found = {}
+            for name, variant in VARIANTS.items():
+                # the array variant looks up the rarest categories first
+                started = time.perf_counter()
+                found[name] = list(
+                    variant(product, common).values_list(
+                        "nutrition_grade", "energy_100g"
+                    )
+                )
+                latencies[name].append(time.perf_counter() - started)
+                queryset = variant(product, common)
+                result = explain(queryset)
+                timings[name].append(result["Execution Time"] / 1000)
+                types[name].update(node["Node Type"] for node in nodes(result["Plan"]))
+                if options.get("plans") and product.pk == sample[0]:
+                    self.stdout.write(f"-- {name}\n{queryset.explain(analyze=True)}")
+            if found["through"] != found["array"]:
+                mismatches += 1
+        self.stdout.write(
+            json.dumps(
+                {
+                    "products": len(ids),
+                    **{
+                        name: {
+                            "execution": percentiles(timings[name]),
+                            "latency": percentiles(latencies[name]),
+                            "nodes": sorted(types[name]),
+                        }
+                        for name in VARIANTS
+                    },
+                    "mismatches": mismatches,
+                },
+                indent=2,
+            )
+        )
+        if mismatches:
+            raise CommandError(f"{mismatches} products found other substitutes")
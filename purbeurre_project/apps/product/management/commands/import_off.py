@@ -3,11 +3,26 @@ The custom management command import_off is used to run a stand-alone script
 to import data from Open Food Facts.
 """
 import json
+import time
 
-import requests
-from django.core.management.base import BaseCommand
-from django.db import IntegrityError, transaction
-from product.models import Category, Product
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from product.importer.cassette import CassetteStore
+from product.importer.dump import iter_dump
+from product.importer import journal, shadow, shards, substitutes
+from product.importer.fetch import OFF_BASE_URL, NotModified, OffClient
+from product.importer.journal import Checkpoint
+from product.importer.loaders import (
+    BulkLoader,
+    CopyLoader,
+    content_hash,
+    validate_product_dict,
+)
+from product.importer.pipeline import Pipeline
+from product.importer.report import ImportReport
+from product.models import Category, CategoryListing, Product
+from product.pagination import bump_catalogue_version
+from product import search, signals
 
 
 class Command(BaseCommand):
@@ -22,20 +37,134 @@ class Command(BaseCommand):
 
     help = "Import data from Open Food Facts API"
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = OffClient()
+        self.processed = 0
+        self.skipped = 0
+        self.delta = False
+        # categories of the shard, None when importing a dump
+        self.categories = None
+        self.report = ImportReport()
+
+    def add_arguments(self, parser):
+        """Options of the import_off command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--loader",
+            choices=["row", "bulk", "copy"],
+            default="bulk",
+            help="write products one by one (row), by upserted chunks (bulk, "
+            "the default) or by chunks copied into staging tables then merged (copy)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="number of products written per chunk with the bulk and copy loaders",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="number of category requests kept in flight",
+        )
+        parser.add_argument(
+            "--base-url",
+            default=OFF_BASE_URL,
+            help="root of the Open Food Facts API",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="walk every page of the categories, parsing products as they arrive",
+        )
+        parser.add_argument(
+            "--from-dump",
+            metavar="PATH",
+            help="import a JSONL or CSV dump of Open Food Facts, optionally gzipped, "
+            "instead of requesting the API",
+        )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help="send conditional requests and skip the category listings "
+            "which did not change since the last import",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="skip the categories and pages committed by an interrupted import",
+        )
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            help="fetch, decode and write every page of the categories in stages "
+            "connected by bounded queues",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="number of processes decoding the pages in the pipeline, "
+            "defaults to the number of CPUs",
+        )
+        parser.add_argument(
+            "--shadow",
+            action="store_true",
+            help="build the catalogue in shadow tables and swap them with "
+            "the live tables once complete, so that the site never reads "
+            "a catalogue in progress",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=1,
+            help="number of import_off processes sharing the categories",
+        )
+        parser.add_argument(
+            "--shard-index",
+            type=int,
+            default=0,
+            help="index of the shard imported by this process, from 0",
+        )
+        cassettes = parser.add_mutually_exclusive_group()
+        cassettes.add_argument(
+            "--record",
+            metavar="DIR",
+            help="record the responses of Open Food Facts in gzipped cassettes in DIR",
+        )
+        cassettes.add_argument(
+            "--replay",
+            metavar="DIR",
+            help="answer the requests with the cassettes recorded in DIR, "
+            "without network",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="print a JSON report of the time spent by stage, the latency "
+            "of the requests, the queries issued and the products written",
+        )
+        parser.add_argument(
+            "--report",
+            metavar="FILE",
+            help="write the JSON profiling report to FILE",
+        )
+
     def get_populate_categories(self):
         """
         Method to populate all categories containing
         greater than or equal to 5000 products
 
-        Args:
-            url_categories (string): endpoint Open Food Facts Api for categories
-
         Returns:
             list: all categories selected
         """
-        url_categories = "https://fr.openfoodfacts.org/categories.json"
         print("Requesting categories")
-        category_response = requests.get(url=url_categories)
+        category_response = self.client.get("/categories.json")
         if category_response.status_code != 200:
             self.stdout.write(
                 self.style.ERROR(
@@ -64,7 +193,6 @@ class Command(BaseCommand):
         Returns:
             list: list of product dictionnary
         """
-        url_products = "https://fr.openfoodfacts.org/cgi/search.pl?"
         payload = {
             "action": "process",
             "tagtype_0": "categories",
@@ -75,14 +203,68 @@ class Command(BaseCommand):
             "json": 1,
         }
         print(f"Requesting products for category of {category_name}")
-        product_response = requests.get(url=url_products, params=payload)
+        product_response = self.client.get(
+            "/cgi/search.pl?", params=payload, conditional=self.delta
+        )
+        if product_response.status_code == 304:
+            print(f"Products for category of {category_name} did not change")
+            return []
         if product_response.status_code != 200:
             self.stdout.write(
                 self.style.ERROR(
                     "Searching for products with the Open Food Facts API is not available."
                 )
             )
-        return json.loads(product_response.content)["products"]
+        started = time.perf_counter()
+        products = json.loads(product_response.content)["products"]
+        self.report.stage("decode").add(
+            items=len(products), seconds=time.perf_counter() - started
+        )
+        return products
+
+    def iter_products_for_category(
+        self, category_name, page_size=500, start_page=1, checkpoints=False
+    ):
+        """Stream the products of a category through every page of the search
+
+        Args:
+            category_name (string): a name of category
+            page_size (int, optional): products requested per page. Defaults to 500.
+            start_page (int, optional): first page requested. Defaults to 1.
+            checkpoints (bool, optional): follow the products of each page
+            by a Checkpoint. Defaults to False.
+
+        Yields:
+            dictionnary: each product, as soon as it is parsed
+        """
+        page = start_page
+        while True:
+            payload = {
+                "action": "process",
+                "tagtype_0": "categories",
+                "tag_contains_0": "contains",
+                "tag_0": category_name,
+                "sort_by": "unique_scans_n",
+                "page_size": page_size,
+                "page": page,
+                "json": 1,
+            }
+            print(f"Requesting page {page} of products for category of {category_name}")
+            received = 0
+            try:
+                for product in self.client.iter_items(
+                    "/cgi/search.pl?", payload, "products.item", self.delta
+                ):
+                    received += 1
+                    yield product
+            except NotModified:
+                # the page did not change, the next ones may have
+                received = page_size
+            if checkpoints:
+                yield Checkpoint(category_name, page, received < page_size)
+            if received < page_size:
+                return
+            page += 1
 
     def validate_product_dict(self, product_dict):
         """Help validate import product when it calls on nutriments
@@ -93,12 +275,7 @@ class Command(BaseCommand):
         Returns:
             boolean: true when elements are required
         """
-        for required in ["nutrition_grade_fr"]:
-            if not product_dict.get(required, "").strip():
-                return False
-        if not product_dict["nutriments"].get("fiber_100g", 0):
-            return False
-        return True
+        return validate_product_dict(product_dict)
 
     def update_product(self, product, data):
         """Method to update database with existing products
@@ -107,8 +284,12 @@ class Command(BaseCommand):
             product (object): from Product model
             data (dictionnary): elements making up a product
         """
+        digest = content_hash(data)
+        if product.content_hash == digest:
+            return
         try:
             with transaction.atomic():
+                product.content_hash = digest
                 product.name = data.get("product_name")
                 product.nutrition_grade = data.get("nutrition_grade_fr")
                 product.energy_100g = data["nutriments"].get("energy_value")
@@ -152,6 +333,7 @@ class Command(BaseCommand):
             proteins_100g=data["nutriments"].get("proteins_100g"),
             url=data.get("url"),
             image_url=data.get("image_front_url"),
+            content_hash=content_hash(data),
         )
         print(".", end="")
         category_list = data.get("categories")
@@ -167,28 +349,309 @@ class Command(BaseCommand):
         """
 
         for product_dict in products_list:
-            if not self.validate_product_dict(product_dict):
+            if isinstance(product_dict, Checkpoint):
+                journal.record(product_dict)
+                continue
+            self.processed += 1
+            with self.report.timed("validate"):
+                valid = self.validate_product_dict(product_dict)
+            if not valid:
+                self.skipped += 1
                 print("S", end="")
                 continue
-            # if product exists on DB
-            if Product.objects.filter(name=product_dict.get("product_name")).exists():
-                # update product
-                self.update_product(
-                    product=Product.objects.get(name=product_dict.get("product_name")),
-                    data=product_dict,
+            with self.report.timed("write"):
+                # if product exists on DB
+                if Product.objects.filter(
+                    name=product_dict.get("product_name")
+                ).exists():
+                    # update product
+                    self.update_product(
+                        product=Product.objects.get(
+                            name=product_dict.get("product_name")
+                        ),
+                        data=product_dict,
+                    )
+                else:
+                    try:
+                        # create product
+                        self.create_product(product_dict)
+                    except Exception as exx:
+                        print(
+                            "Un des produits n'a pu être importé, voici l'erreur :",
+                            exx,
+                        )
+
+    def bulk_populate_products(self, products_list, loader):
+        """Method to populate database with products by chunks
+
+        Args:
+            products_list (list): a list of products that can be used to create new ones
+            loader (BulkLoader): buffer writing the products by chunks
+        """
+        for product_dict in products_list:
+            if isinstance(product_dict, Checkpoint):
+                # the unit is journaled once its products are written
+                loader.flush()
+                journal.record(product_dict)
+                continue
+            self.processed += 1
+            with self.report.timed("validate"):
+                valid = self.validate_product_dict(product_dict)
+            if not valid:
+                self.skipped += 1
+                print("S", end="")
+                continue
+            loader.add(product_dict)
+
+    def load_validators(self):
+        """Give the client the validators stored by the last import"""
+        self.client.validators = {
+            listing.url: (listing.etag, listing.last_modified)
+            for listing in CategoryListing.objects.all()
+        }
+
+    def save_validators(self):
+        """Store the validators of the listings received during the import"""
+        with transaction.atomic():
+            CategoryListing.objects.filter(url__in=self.client.validators).delete()
+            CategoryListing.objects.bulk_create(
+                CategoryListing(url=url, etag=etag, last_modified=last_modified)
+                for url, (etag, last_modified) in self.client.validators.items()
+            )
+
+    def select_categories(self, options):
+        """Select the categories left to import
+
+        Args:
+            options (dictionnary): options of the command
+
+        Returns:
+            tuple: list of the category names and dictionnary of the last page
+            committed for the categories in progress
+        """
+        # the shards create the categories one after the other
+        with shards.advisory_lock("import_off", "categories"):
+            populated = self.get_populate_categories()
+        self.categories = [
+            category["name"]
+            for category in populated
+            if shards.in_shard(
+                category["name"],
+                options.get("shards", 1),
+                options.get("shard_index", 0),
+            )
+        ]
+        done, pages = journal.start(options.get("resume", False), self.categories)
+        categories = [name for name in self.categories if name not in done]
+        return categories, pages
+
+    def get_batches(self, options):
+        """Select where the products are read from
+
+        Args:
+            options (dictionnary): options of the command
+
+        Returns:
+            iterable: batches of product dictionnaries, lists or streams
+        """
+        if options.get("from_dump"):
+            shard_count = options.get("shards", 1)
+            shard_index = options.get("shard_index", 0)
+            return [
+                (
+                    product
+                    for product in iter_dump(options["from_dump"])
+                    if shard_count == 1
+                    or shards.in_shard(
+                        product.get("product_name") or "", shard_count, shard_index
+                    )
                 )
+            ]
+        categories, pages = self.select_categories(options)
+        # the next categories are requested while the products
+        # of the previous ones are written
+        if options.get("stream", False):
+            return [
+                self.client.stream(
+                    lambda name: self.iter_products_for_category(
+                        name, start_page=pages.get(name, 0) + 1, checkpoints=True
+                    ),
+                    categories,
+                )
+            ]
+        return (
+            products + [Checkpoint(name, 1, True)]
+            for name, products in zip(
+                categories, self.client.map(self.get_products_for_category, categories)
+            )
+        )
+
+    def run_pipeline(self, loader, options):
+        """Import the categories through the staged pipeline
+
+        Args:
+            loader (BulkLoader): single writer of the pipeline
+            options (dictionnary): options of the command
+        """
+        pipeline = Pipeline(
+            self, loader, processes=options.get("processes"), report=self.report
+        )
+        pipeline.run(*self.select_categories(options))
+        self.processed += pipeline.decode.items
+        self.skipped += pipeline.skipped
+        for counter in (pipeline.fetch, pipeline.decode, pipeline.write):
+            self.stdout.write(f"\n{counter}")
+
+    def run_import(self, loader, options):
+        """Import the products with the loader chosen
+
+        Args:
+            loader (BulkLoader): buffer writing the products by chunks,
+            None to write them one by one
+            options (dictionnary): options of the command
+        """
+        if options.get("pipeline", False):
+            self.run_pipeline(loader, options)
+            loader.flush()
+            return
+        for products in self.get_batches(options):
+            if loader is None:
+                self.populate_products(products)
+            else:
+                self.bulk_populate_products(products, loader)
+        if loader is not None:
+            loader.flush()
+            self.report.stage("write").add(
+                items=loader.written + loader.unchanged, seconds=loader.seconds
+            )
+
+    def refresh_catalogue(self):
+        """Copy the categories of the products imported to their arrays
+        and store the search vectors of their names, as the loaders write
+        the imported columns only"""
+        with self.report.timed("categories"):
+            substitutes.refresh_categories()
+        with self.report.timed("search"):
+            search.refresh_vectors()
+
+    def import_products(self, loader, options):
+        """Import the products once the import lock is held
+
+        Args:
+            loader (BulkLoader): buffer writing the products by chunks,
+            None to write them one by one
+            options (dictionnary): options of the command
+        """
+        with connection.execute_wrapper(self.report):
+            if options.get("shadow", False):
+                shadow.prepare(resume=options.get("resume", False))
+                with shadow.redirect():
+                    self.run_import(loader, options)
+                    # the shadow catalogue is complete before it is swapped in
+                    self.refresh_catalogue()
+                with self.report.timed("swap"):
+                    shadow.analyze()
+                    shadow.swap()
             else:
-                try:
-                    # create product
-                    self.create_product(product_dict)
-                except Exception as exx:
-                    print("Un des produits n'a pu être importé, voici l'erreur :", exx)
+                self.run_import(loader, options)
+        if loader is not None:
+            self.stdout.write(
+                f"\n{loader.created} products created, {loader.updated} updated, "
+                f"{loader.unchanged} unchanged, {loader.failed} failed "
+                f"({loader.rate():.1f} products/sec written)"
+            )
+        # the shards clean up after their import one after the other
+        with shards.advisory_lock("import_off", "cleanup"):
+            if self.delta:
+                self.save_validators()
+            if not options.get("from_dump"):
+                journal.clear(self.categories)
+            if not options.get("shadow", False):
+                self.refresh_catalogue()
+            # the counts of the lists cached by this process are stale
+            bump_catalogue_version()
+        # the shards leave the ranking to compute_substitutes, run once all are done
+        if options.get("shards", 1) == 1:
+            with self.report.timed("substitutes"):
+                substitutes.rank()
 
     def handle(self, *args, **options):
         """Main method to download data from Open Food Facts API"""
         self.stdout.write("Product downloads in progress...")
-        # Process for products
-        for category in self.get_populate_categories():
-            products = self.get_products_for_category(category["name"])
-            self.populate_products(products)
+        self.report = ImportReport(
+            options={
+                name: options.get(name)
+                for name in (
+                    "loader",
+                    "batch_size",
+                    "workers",
+                    "stream",
+                    "from_dump",
+                    "delta",
+                    "resume",
+                    "pipeline",
+                    "processes",
+                    "shadow",
+                    "replay",
+                    "shards",
+                    "shard_index",
+                )
+            }
+        )
+        self.client = OffClient(
+            base_url=options.get("base_url", OFF_BASE_URL),
+            workers=options.get("workers", 4),
+        )
+        self.client.observer = self.report.observe
+        if options.get("record") or options.get("replay"):
+            self.client.use_cassettes(
+                CassetteStore(options.get("record") or options["replay"]),
+                record=bool(options.get("record")),
+            )
+        self.delta = options.get("delta", False)
+        if self.delta:
+            self.load_validators()
+        started = time.perf_counter()
+        loader = None
+        if options.get("loader", "bulk") == "bulk":
+            loader = BulkLoader(batch_size=options.get("batch_size", 500))
+        elif options.get("loader") == "copy":
+            loader = CopyLoader(batch_size=options.get("batch_size", 500))
+        if options.get("pipeline", False) and (
+            loader is None or options.get("from_dump")
+        ):
+            raise CommandError(
+                "--pipeline imports the API with the bulk or copy loader"
+            )
+        if not 0 <= options.get("shard_index", 0) < options.get("shards", 1):
+            raise CommandError("--shard-index must be between 0 and --shards - 1")
+        if options.get("shards", 1) > 1 and options.get("shadow", False):
+            raise CommandError(
+                "--shadow swaps the whole catalogue, it cannot be sharded"
+            )
+        try:
+            with shards.import_lock(
+                options.get("shards", 1), options.get("shard_index", 0)
+            ):
+                # the products written are refreshed at once, not one by one
+                with signals.suspended():
+                    self.import_products(loader, options)
+        except shards.LockUnavailable as exx:
+            raise CommandError(
+                f"Another import holds the lock {exx}, try again once it is done"
+            ) from exx
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"\n{self.processed} products processed in {elapsed:.1f}s "
+            f"({self.processed / elapsed if elapsed else 0:.1f} products/sec)"
+        )
+        if options.get("profile") or options.get("report"):
+            report = self.report.to_json(
+                loader=loader, processed=self.processed, skipped=self.skipped
+            )
+            if options.get("report"):
+                with open(options["report"], "w") as report_file:
+                    report_file.write(report + "\n")
+            if options.get("profile"):
+                self.stdout.write(report)
         self.stdout.write(self.style.SUCCESS("Data successfully downloaded !"))
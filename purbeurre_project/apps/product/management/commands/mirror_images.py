@@ -0,0 +1,69 @@
+"""
+The custom management command mirror_images is run after import_off
+to serve the product images from MEDIA_ROOT instead of Open Food Facts.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from product.importer.images import ImageMirror
+from product.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Command class is used to download the images of the products
+    and build their card thumbnails
+
+    Args:
+        BaseCommand (class): analyze the command line parameters,
+        which are used to determine the code to be called consequently
+    """
+
+    help = "Mirror the product images of Open Food Facts as local thumbnails"
+
+    def add_arguments(self, parser):
+        """Options of the mirror_images command
+
+        Args:
+            parser (ArgumentParser): parser of the command line
+        """
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="number of images downloaded and resized together",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="rebuild the thumbnails of the images which did not change",
+        )
+
+    def handle(self, *args, **options):
+        """Main method to mirror the images of the products"""
+        self.stdout.write("Image downloads in progress...")
+        started = time.perf_counter()
+        mirror = ImageMirror(
+            workers=options.get("workers", 8), force=options.get("force", False)
+        )
+        products = (
+            Product.objects.exclude(image_url="")
+            .only(
+                "id",
+                "image_url",
+                "thumbnail",
+                "thumbnail_webp",
+                "image_source",
+                "image_etag",
+                "image_last_modified",
+            )
+            .order_by("id")
+            .iterator()
+        )
+        mirror.mirror(products)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"\n{mirror.created} images mirrored, {mirror.unchanged} unchanged, "
+            f"{mirror.failed} failed in {elapsed:.1f}s"
+        )
+        self.stdout.write(self.style.SUCCESS("Images successfully mirrored !"))
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.2 on 2026-10-17 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_product_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryListing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField(unique=True)),
+                ('etag', models.TextField(blank=True, default='')),
+                ('last_modified', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.2 on 2026-10-17 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0007_auto_20261017_2253'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.TextField(unique=True)),
+                ('page', models.IntegerField(default=0)),
+                ('done', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.2 on 2026-10-17 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0008_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_etag',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_last_modified',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_source',
+            field=models.URLField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail_webp',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        # the loaders of import_off insert the imported columns only
+        migrations.RunSQL(
+            "ALTER TABLE product_product "
+            "ALTER COLUMN image_etag SET DEFAULT '', "
+            "ALTER COLUMN image_last_modified SET DEFAULT '', "
+            "ALTER COLUMN image_source SET DEFAULT '', "
+            "ALTER COLUMN thumbnail SET DEFAULT '', "
+            "ALTER COLUMN thumbnail_webp SET DEFAULT ''",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
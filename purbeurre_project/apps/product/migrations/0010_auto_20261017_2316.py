@@ -0,0 +1,37 @@
+# Generated by Django 3.1.2 on 2026-10-17 21:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_auto_20261017_2314'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='substitutes_computed',
+            field=models.BooleanField(default=False),
+        ),
+        # the loaders of import_off insert the imported columns only
+        migrations.RunSQL(
+            "ALTER TABLE product_product "
+            "ALTER COLUMN substitutes_computed SET DEFAULT false",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.CreateModel(
+            name='ProductSubstitute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranked', to='product.product')),
+                ('substitute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='substitute_of', to='product.product')),
+            ],
+            options={
+                'unique_together': {('product', 'rank')},
+            },
+        ),
+    ]
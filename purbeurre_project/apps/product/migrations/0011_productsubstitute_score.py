@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-17 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0010_auto_20261017_2316'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsubstitute',
+            name='score',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.2 on 2026-10-17 21:33
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0011_productsubstitute_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='lsh_buckets',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, size=None),
+        ),
+        # the loaders of import_off insert the imported columns only
+        migrations.RunSQL(
+            "ALTER TABLE product_product "
+            "ALTER COLUMN lsh_buckets SET DEFAULT '{}'",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['lsh_buckets'], name='product_pro_lsh_buc_0f8029_gin'),
+        ),
+    ]
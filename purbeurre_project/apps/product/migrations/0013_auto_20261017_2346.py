@@ -0,0 +1,36 @@
+# Generated by Django 3.1.2 on 2026-10-17 21:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0012_auto_20261017_2333'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='category_signature',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        # the loaders of import_off insert the imported columns only
+        migrations.RunSQL(
+            "ALTER TABLE product_product "
+            "ALTER COLUMN category_signature SET DEFAULT ''",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "UPDATE product_product SET category_signature = signed.signature "
+            "FROM (SELECT product_id, md5(string_agg("
+            "category_id::text, ',' ORDER BY category_id)) AS signature "
+            "FROM product_product_categories GROUP BY product_id) signed "
+            "WHERE product_product.id = signed.product_id",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category_signature', 'nutrition_grade'], name='product_pro_categor_f1bd2b_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.2 on 2026-10-17 21:48
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0013_auto_20261017_2346'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='category_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+        ),
+        # the loaders of import_off insert the imported columns only
+        migrations.RunSQL(
+            "ALTER TABLE product_product "
+            "ALTER COLUMN category_ids SET DEFAULT '{}'",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "UPDATE product_product SET category_ids = linked.category_ids "
+            "FROM (SELECT product_id, array_agg(category_id ORDER BY category_id) "
+            "AS category_ids FROM product_product_categories GROUP BY product_id) linked "
+            "WHERE product_product.id = linked.product_id",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['category_ids'], name='product_pro_categor_8572a4_gin'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.2 on 2026-10-17 22:01
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # the indexes are built without locking the writes of the imports
+    atomic = False
+
+    dependencies = [
+        ('product', '0014_auto_20261017_2348'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['nutrition_grade', 'energy_100g'], name='product_pro_nutriti_3b4719_idx'),
+        ),
+        # the through table of the categories is created by Django,
+        # the substitute query reads its products by category
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS product_product_categories_category_product "
+            "ON product_product_categories (category_id, product_id)",
+            reverse_sql="DROP INDEX CONCURRENTLY IF EXISTS product_product_categories_category_product",
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.2 on 2026-10-17 22:21
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0015_auto_20261018_0001'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # the accents are folded by translate, the unaccent extension
+        # being left out of the PostgreSQL servers the site runs on
+        migrations.RunSQL(
+            "CREATE OR REPLACE FUNCTION product_unaccent(text) RETURNS text "
+            "LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$ "
+            "SELECT replace(replace(replace(replace(translate($1, "
+            "'àâäáãåçéèêëíìîïñóòôöõúùûüýÿÀÂÄÁÃÅÇÉÈÊËÍÌÎÏÑÓÒÔÖÕÚÙÛÜÝŸ', "
+            "'aaaaaaceeeeiiiinooooouuuuyyAAAAAACEEEEIIIINOOOOOUUUUYY'), "
+            "'œ', 'oe'), 'Œ', 'OE'), 'æ', 'ae'), 'Æ', 'AE') $$",
+            reverse_sql="DROP FUNCTION product_unaccent(text)",
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.2 on 2026-10-17 22:37
+
+from django.db import migrations
+
+# products whose search vector is stored per transaction
+BATCH = 5000
+
+
+def fill_search_vectors(apps, schema_editor):
+    """Store the search vectors by ranges of ids, each range committed
+    on its own so that the writes to the products wait for one range at most
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(min(id), 0), coalesce(max(id), -1) FROM product_product")
+        first, last = cursor.fetchone()
+        for start in range(first, last + 1, BATCH):
+            cursor.execute(
+                "UPDATE product_product SET search_vector = "
+                "to_tsvector('french'::regconfig, COALESCE(product_unaccent(name), '')) "
+                "WHERE id >= %s AND id < %s AND search_vector IS NULL",
+                [start, start + BATCH],
+            )
+
+
+class Migration(migrations.Migration):
+
+    # each batch is committed apart, rather than the whole table at once
+    atomic = False
+
+    dependencies = [
+        ('product', '0016_auto_20261018_0021'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.2 on 2026-10-17 22:37
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    # the index is built without locking the writes of the imports
+    atomic = False
+
+    dependencies = [
+        ('product', '0017_auto_20261018_0037'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_pro_search__e78047_gin'),
+        ),
+    ]
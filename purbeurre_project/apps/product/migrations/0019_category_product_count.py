@@ -0,0 +1,31 @@
+# Generated by Django 3.1.2 on 2026-10-17 22:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0018_auto_20261018_0037'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.IntegerField(default=0),
+        ),
+        # the loaders of import_off insert the names of the categories only
+        migrations.RunSQL(
+            "ALTER TABLE product_category "
+            "ALTER COLUMN product_count SET DEFAULT 0",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "UPDATE product_category SET product_count = counted.products "
+            "FROM (SELECT category_id, count(*) AS products "
+            "FROM product_product_categories GROUP BY category_id) counted "
+            "WHERE product_category.id = counted.category_id",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
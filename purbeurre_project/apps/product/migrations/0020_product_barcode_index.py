@@ -0,0 +1,22 @@
+# Generated by Django 3.1.2 on 2026-10-18 00:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    # the index is built without locking the writes of the imports
+    atomic = False
+
+    dependencies = [
+        ('product', '0019_category_product_count'),
+    ]
+
+    operations = [
+        # the baskets find the products by the barcode of their url
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS product_product_barcode "
+            "ON product_product ((substring(url from '/produit/([0-9]+)')))",
+            reverse_sql="DROP INDEX CONCURRENTLY IF EXISTS product_product_barcode",
+        ),
+    ]
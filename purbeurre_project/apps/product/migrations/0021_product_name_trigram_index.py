@@ -0,0 +1,36 @@
+# Generated by Django 3.1.2 on 2026-10-18 00:41
+
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    # pg_trgm ships with the contrib modules of Postgres, a server without
+    # them keeps the search of the names on the index of their order
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # the substring search filters upper(name) with LIKE, as icontains does
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS product_product_name_trgm "
+        "ON product_product USING gin ((upper(name::text)) gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS product_product_name_trgm")
+
+
+class Migration(migrations.Migration):
+
+    # the index is built without locking the writes of the imports
+    atomic = False
+
+    dependencies = [
+        ('product', '0020_product_barcode_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.2 on 2026-10-18 00:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0021_product_name_trigram_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField(default=1)),
+            ],
+        ),
+        # the single row of the version, bumped by the imports and the signals
+        migrations.RunSQL(
+            "INSERT INTO product_catalogueversion (id, version) VALUES (1, 1)",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
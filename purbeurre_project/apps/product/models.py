@@ -1,7 +1,12 @@
 """Product app models
 """
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.expressions import RawSQL
 
 
 class Category(models.Model):
@@ -12,6 +17,8 @@ class Category(models.Model):
     """
 
     name = models.TextField(null=False, unique=True)
+    # products in the category, counted by refresh_categories
+    product_count = models.IntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -39,10 +46,57 @@ class Product(models.Model):
     url = models.URLField(unique=True, null=True)
     image_url = models.URLField()
     categories = models.ManyToManyField(Category)
+    content_hash = models.CharField(max_length=32, blank=True, default="")
+    thumbnail = models.CharField(max_length=255, blank=True, default="")
+    thumbnail_webp = models.CharField(max_length=255, blank=True, default="")
+    image_source = models.URLField(blank=True, default="")
+    image_etag = models.TextField(blank=True, default="")
+    image_last_modified = models.TextField(blank=True, default="")
+    substitutes_computed = models.BooleanField(default=False)
+    # md5 of the sorted ids of the categories, shared by the products
+    # whose substitutes are computed once
+    category_signature = models.CharField(max_length=32, blank=True, default="")
+    # sorted ids of the categories, copied from the through table
+    category_ids = ArrayField(models.IntegerField(), blank=True, default=list)
+    # LSH buckets of the MinHash signature of the categories, one per band
+    lsh_buckets = ArrayField(models.BigIntegerField(), blank=True, default=list)
+    # words of the name, accents folded, for the full-text search of product.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["lsh_buckets"]),
+            GinIndex(fields=["category_ids"]),
+            GinIndex(fields=["search_vector"]),
+            models.Index(fields=["category_signature", "nutrition_grade"]),
+            models.Index(fields=["nutrition_grade", "energy_100g"]),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def card_image(self):
+        """Image of the product card, the local thumbnail once mirrored
+
+        Returns:
+            string: url of the image
+        """
+        if self.thumbnail:
+            return settings.MEDIA_URL + self.thumbnail
+        return self.image_url
+
+    @property
+    def card_image_webp(self):
+        """WebP variant of the image of the product card
+
+        Returns:
+            string: url of the WebP thumbnail, empty until mirrored
+        """
+        if self.thumbnail_webp:
+            return settings.MEDIA_URL + self.thumbnail_webp
+        return ""
+
     def substitutes(self, nb_common_categories=4):
         """Substitute method to find healthy product matching with categories
 
@@ -67,14 +121,140 @@ class Product(models.Model):
             .values_list("product_id")
         )
 
+        # lowest id wins among equal grade and energy
         return (
             Product.objects.filter(pk__in=related_products)
             .exclude(id=self.id)
-            .order_by("nutrition_grade", "energy_100g")
+            .order_by("nutrition_grade", "energy_100g", "id")
+            .distinct("nutrition_grade", "energy_100g")
+        )
+
+    def array_substitutes(self, nb_common_categories=4):
+        """Substitutes found on the category_ids arrays: the candidates share
+        a category with the product through the GIN index, then their shared
+        categories are counted on the arrays instead of the through table.
+        A product sharing nb_common_categories of its n categories holds one
+        of any n - nb_common_categories + 1 of them, the rarest are looked up
+
+        Args:
+            nb_common_categories (int, optional): number of categories
+            which are match with categories product searched.
+            Defaults to 4.
+
+        Returns:
+            QuerySet: substitute products, ordered by nutriscore and energy
+        """
+        # the counts are stored by refresh_categories, one left behind by
+        # a deleted product only makes its category look more common
+        rarest = list(
+            Category.objects.filter(id__in=self.category_ids)
+            .order_by("product_count", "id")
+            .values_list("id", flat=True)[
+                : max(len(self.category_ids) - nb_common_categories + 1, 0)
+            ]
+        )
+        return (
+            Product.objects.filter(
+                category_ids__overlap=rarest,
+                nutrition_grade__lte=self.nutrition_grade,
+            )
+            .exclude(id=self.id)
+            .annotate(
+                matches=RawSQL(
+                    "cardinality(ARRAY(SELECT unnest(category_ids) "
+                    "INTERSECT SELECT unnest(%s::integer[])))",
+                    [self.category_ids],
+                )
+            )
+            .filter(matches__gte=nb_common_categories)
+            # lowest id wins among equal grade and energy, as in substitutes
+            .order_by("nutrition_grade", "energy_100g", "id")
+            .distinct("nutrition_grade", "energy_100g")
+        )
+
+    def ranked_substitutes(self):
+        """Substitutes precomputed after the last import, read with one lookup
+        on the index of ProductSubstitute, or found by the substitutes query
+        for a product imported since
+
+        Returns:
+            QuerySet: substitute products, the best first
+        """
+        if not self.substitutes_computed:
+            return self.substitutes()
+        return (
+            Product.objects.filter(substitute_of__product=self)
+            .annotate(rank=models.F("substitute_of__rank"))
+            .order_by("rank")
+        )
+
+    def similar_substitutes(self, nb_common_categories=4, bands=None):
+        """Approximate substitutes: the candidates are the products sharing
+        an LSH bucket with the product, found through the GIN index,
+        then checked as in the substitutes method
+
+        Args:
+            nb_common_categories (int, optional): number of categories
+            which are match with categories product searched.
+            Defaults to 4.
+            bands (int, optional): bands of the buckets looked up, fewer bands
+            find fewer candidates sooner. Defaults to None, for all.
+
+        Returns:
+            QuerySet: substitute products, ordered by nutriscore and energy
+        """
+        if not self.lsh_buckets:
+            return self.substitutes(nb_common_categories)
+        candidates = (
+            Product.objects.filter(
+                lsh_buckets__overlap=self.lsh_buckets[:bands],
+                nutrition_grade__lte=self.nutrition_grade,
+            )
+            .exclude(id=self.id)
+            .values("id")
+        )
+        related_products = (
+            self.categories.through.objects.filter(
+                product__in=candidates, category__in=self.categories.all()
+            )
+            .values("product_id")
+            .annotate(matches=models.Count("category_id"))
+            .filter(matches__gte=nb_common_categories)
+            .values_list("product_id")
+        )
+        # lowest id wins among equal grade and energy, as in substitutes
+        return (
+            Product.objects.filter(pk__in=related_products)
+            .order_by("nutrition_grade", "energy_100g", "id")
             .distinct("nutrition_grade", "energy_100g")
         )
 
 
+class ProductSubstitute(models.Model):
+    """Product Substitute model maps to the table of the best substitutes
+    of each product, rebuilt after each import
+
+    Args:
+        models (subclass): a python class that subclasses django.db.models.Model
+    """
+
+    product = models.ForeignKey(
+        Product, related_name="ranked", on_delete=models.CASCADE
+    )
+    substitute = models.ForeignKey(
+        Product, related_name="substitute_of", on_delete=models.CASCADE
+    )
+    rank = models.PositiveSmallIntegerField()
+    # categories shared with the product, weighted when ranked by idf
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [["product", "rank"]]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.substitute_id} ({self.rank})"
+
+
 class CustomerProduct(models.Model):
     """Customer Product model maps to favorites database table
 
@@ -92,3 +272,50 @@ class CustomerProduct(models.Model):
 
     class Meta:
         unique_together = [["customer", "product", "substitute"]]
+
+
+class CategoryListing(models.Model):
+    """Category Listing model keeps the validators of the last response
+    received for a listing of Open Food Facts, to send conditional requests
+
+    Args:
+        models (subclass): a python class that subclasses django.db.models.Model
+    """
+
+    url = models.TextField(unique=True)
+    etag = models.TextField(blank=True, default="")
+    last_modified = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return self.url
+
+
+class ImportCheckpoint(models.Model):
+    """Import Checkpoint model journals the units committed by import_off,
+    so that an interrupted import can be resumed
+
+    Args:
+        models (subclass): a python class that subclasses django.db.models.Model
+    """
+
+    category = models.TextField(unique=True)
+    page = models.IntegerField(default=0)
+    done = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.category} ({self.page})"
+
+
+class CatalogueVersion(models.Model):
+    """Catalogue Version model holds the version of the catalogue in a single
+    row, bumped when the products change, so that every worker leaves
+    the counts it cached for a previous version
+
+    Args:
+        models (subclass): a python class that subclasses django.db.models.Model
+    """
+
+    version = models.IntegerField(default=1)
+
+    def __str__(self):
+        return str(self.version)
@@ -0,0 +1,153 @@
+"""Nearest substitutes by nutriments: among the products sharing categories
+with a product, the closest ones in a normalized nutriment space, so that
+a substitute of a spread is a spread of similar composition rather than
+the lightest product of its categories
+"""
+import threading
+
+from django.db import connection
+from product import bitsets
+from product.models import Product
+
+# nutriments of the distance, sodium is left out as it follows salt
+NUTRIMENTS = [
+    "energy_100g",
+    "carbohydrates_100g",
+    "sugars_100g",
+    "fat_100g",
+    "saturated_fat_100g",
+    "salt_100g",
+    "fiber_100g",
+    "proteins_100g",
+]
+# nearest substitutes kept per product
+NEAREST = 30
+
+
+class NutrientIndex:
+    """NutrientIndex holds the nutriments of the products of a SubstituteIndex,
+    in the order of its positions: each nutriment is log-scaled, as a few
+    products hold most of the salt or the sugar, then standardized
+
+    Args:
+        index (SubstituteIndex): category bitsets of the products
+        rows (iterable): id then nutriments of the products
+    """
+
+    def __init__(self, index, rows):
+        # NumPy is loaded by the workers serving the nearest substitutes only
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        self.index = index
+        values = np.zeros((len(index.ids), len(NUTRIMENTS)), dtype=np.float32)
+        for row in rows:
+            position = index.positions.get(row[0])
+            if position is not None:
+                values[position] = [value or 0 for value in row[1:]]
+        values = np.log1p(np.maximum(values, 0))
+        deviations = values.std(axis=0)
+        self.vectors = (values - values.mean(axis=0)) / np.where(
+            deviations > 0, deviations, 1
+        )
+
+    @classmethod
+    def load(cls, index):
+        """Load the nutriments of the products of an index
+
+        Args:
+            index (SubstituteIndex): category bitsets of the products
+
+        Returns:
+            NutrientIndex: nutriments of the products
+        """
+        return cls(index, Product.objects.values_list("id", *NUTRIMENTS).iterator())
+
+    def nearest(self, product_id, count=NEAREST, nb_common_categories=4):
+        """Nearest substitutes of a product by nutriments
+
+        Args:
+            product_id (int): id of the product
+            count (int, optional): substitutes returned. Defaults to NEAREST.
+            nb_common_categories (int, optional): number of categories
+            shared with the product. Defaults to 4.
+
+        Returns:
+            list: ids of the substitutes, the nearest first
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        candidates = self.index.matches(product_id, nb_common_categories)
+        if not len(candidates):
+            return []
+        position = self.index.positions[product_id]
+        distances = ((self.vectors[candidates] - self.vectors[position]) ** 2).sum(
+            axis=1
+        )
+        if len(candidates) > count:
+            kept = np.argpartition(distances, count - 1)[:count]
+            candidates, distances = candidates[kept], distances[kept]
+        # the positions follow the grades and energies, for the ties
+        order = np.lexsort((candidates, distances))
+        return [self.index.ids[position] for position in candidates[order]]
+
+
+_nutrient_index = None
+_lock = threading.Lock()
+_refreshing = False
+
+
+def refresh_nutrient_index(index=None):
+    """Load the nutriments of a category index and put them in place
+    of the stale ones, or of none, in the thread loading them
+
+    Args:
+        index (SubstituteIndex, optional): category index loaded since.
+        Defaults to None, for the index of the worker, loaded first.
+    """
+    global _nutrient_index, _refreshing  # pylint: disable=global-statement
+    try:
+        _nutrient_index = NutrientIndex.load(index or bitsets.get_index())
+    finally:
+        with _lock:
+            _refreshing = False
+        connection.close()
+
+
+def get_nutrient_index():
+    """Nutriments of the worker, loaded by a thread of its own from the first
+    request, then refreshed once the category index is, the stale nutriments
+    being served meanwhile with their own category index
+
+    Returns:
+        NutrientIndex: nutriments of the products, None until first loaded
+    """
+    global _refreshing  # pylint: disable=global-statement
+    nutrient_index = _nutrient_index
+    # the category index is loaded with the first nutriments, in their thread
+    index = bitsets.get_index() if nutrient_index is not None else None
+    if nutrient_index is None or nutrient_index.index is not index:
+        with _lock:
+            start, _refreshing = not _refreshing, True
+        if start:
+            threading.Thread(
+                target=refresh_nutrient_index, args=(index,), daemon=True
+            ).start()
+    return nutrient_index
+
+
+def find_nearest(product, count=NEAREST):
+    """Nearest substitutes of a product from the indexes of the worker,
+    or the substitutes query before they are loaded and for a product
+    imported since
+
+    Args:
+        product (Product): product whose substitutes are searched
+        count (int, optional): substitutes returned. Defaults to NEAREST.
+
+    Returns:
+        object: SubstituteList, or the QuerySet of Product.substitutes
+    """
+    index = get_nutrient_index()
+    if index is None or product.pk not in index.index:
+        return product.substitutes()
+    return bitsets.SubstituteList(index.nearest(product.pk, count))
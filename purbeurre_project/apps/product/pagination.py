@@ -0,0 +1,442 @@
+"""Pagination of the product lists without an exact count on each page.
+The substitutes are paged by keyset: a page is read after the last
+substitute of the previous page, on the ordering of the query then the id,
+instead of skipping the previous pages with an OFFSET, so that a deep page
+is read as fast as the first one. The search results and the favorites are
+paged by number, counted by the estimate of the planner for a large list
+"""
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import (
+    EmptyPage,
+    InvalidPage,
+    Page,
+    PageNotAnInteger,
+    Paginator,
+)
+from django.db import connection
+from django.db.models import F, Q, QuerySet
+from django.utils.functional import cached_property
+from product.models import CatalogueVersion
+
+# salt of the cursors, a cursor of another form of the site is refused
+SALT = "product.pagination"
+# id of the row holding the version of the catalogue
+CATALOGUE_VERSION = 1
+
+
+class InvalidCursor(InvalidPage):
+    """The cursor of a page was not signed by the site"""
+
+
+def catalogue_version():
+    """Version of the catalogue, the counts of another version are stale.
+    It is kept in the database, as the cache of a worker is its own
+
+    Returns:
+        int: version of the catalogue, 0 before the first bump
+    """
+    version = (
+        CatalogueVersion.objects.filter(pk=CATALOGUE_VERSION)
+        .values_list("version", flat=True)
+        .first()
+    )
+    return version or 0
+
+
+def bump_catalogue_version():
+    """Leave the counts cached for the catalogue as it was, by every worker"""
+    bumped = CatalogueVersion.objects.filter(pk=CATALOGUE_VERSION).update(
+        version=F("version") + 1
+    )
+    if not bumped:
+        CatalogueVersion.objects.get_or_create(pk=CATALOGUE_VERSION)
+
+
+def estimate_count(queryset):
+    """Rows the planner expects from a query, without running it
+
+    Args:
+        queryset (QuerySet): query counted
+
+    Returns:
+        int: rows estimated from the statistics of the tables
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        # psycopg2 decodes the json of the plan
+        return cursor.fetchone()[0][0]["Plan"]["Plan Rows"]
+
+
+def exact_count(queryset):
+    """Exact count of a query, cached for the version of the catalogue
+    and for PAGINATOR_COUNT_TTL seconds
+
+    Args:
+        queryset (QuerySet): query counted
+
+    Returns:
+        int: rows of the query
+    """
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f"{sql} {params!r}".encode()).hexdigest()
+    key = f"product:count:{catalogue_version()}:{digest}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PAGINATOR_COUNT_TTL)
+    return count
+
+
+def count_rows(object_list, threshold=None):
+    """Count of a list, estimated by the planner for a large query
+
+    Args:
+        object_list (object): QuerySet, or a list of objects
+        threshold (int, optional): estimated rows from which the estimate
+        is kept. Defaults to None, for PAGINATOR_ESTIMATE_THRESHOLD.
+
+    Returns:
+        tuple: count, and whether it is estimated
+    """
+    if not isinstance(object_list, QuerySet):
+        return len(object_list), False
+    if threshold is None:
+        threshold = settings.PAGINATOR_ESTIMATE_THRESHOLD
+    estimate = estimate_count(object_list)
+    if estimate >= threshold:
+        return estimate, True
+    return exact_count(object_list), False
+
+
+def encode_cursor(data):
+    """Opaque cursor of a page
+
+    Args:
+        data (dictionnary): position of the page
+
+    Returns:
+        string: signed cursor, safe in an url
+    """
+    return signing.dumps(data, salt=SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """Position of a page from its cursor
+
+    Args:
+        cursor (string): signed cursor
+
+    Raises:
+        InvalidCursor: the cursor was altered
+
+    Returns:
+        dictionnary: position of the page
+    """
+    try:
+        return signing.loads(cursor, salt=SALT)
+    except signing.BadSignature as error:
+        raise InvalidCursor("Invalid cursor") from error
+
+
+def ordering_keys(queryset):
+    """Fields ordering a query, the id last to break the ties
+
+    Args:
+        queryset (QuerySet): query ordered by ascending fields
+
+    Returns:
+        list: names of the fields
+    """
+    keys = [key for key in queryset.query.order_by if key not in ("id", "pk")]
+    return keys + ["id"]
+
+
+def beyond(keys, values, reverse=False):
+    """Condition on the rows after, or before, a row in the order of keys
+
+    Args:
+        keys (list): names of the fields ordering the rows
+        values (list): values of the fields on the row
+        reverse (bool, optional): rows before the row. Defaults to False.
+
+    Returns:
+        Q: condition of the rows
+    """
+    lookup = "lt" if reverse else "gt"
+    condition = Q()
+    for position, key in enumerate(keys):
+        equal = dict(zip(keys[:position], values))
+        condition |= Q(**equal, **{f"{key}__{lookup}": values[position]})
+    return condition
+
+
+def evaluated(queryset, objects):
+    """QuerySet of the objects of a page, evaluated already, so that
+    the page is read as a QuerySet without another query
+
+    Args:
+        queryset (QuerySet): query of the objects
+        objects (list): objects of the page, in order
+
+    Returns:
+        QuerySet: objects of the page
+    """
+    page = queryset.filter(pk__in=[item.pk for item in objects])
+    page._result_cache = objects  # pylint: disable=protected-access
+    return page
+
+
+class KeysetPage:
+    """KeysetPage holds the objects of a page and the cursors of its neighbours
+
+    Args:
+        object_list (object): objects of the page
+        paginator (KeysetPaginator): paginator of the page
+        next_cursor (string): cursor of the next page, None on the last page
+        previous_cursor (string): cursor of the previous page,
+        None on the first page
+    """
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """KeysetPaginator pages a query after the keys of the last object
+    of the previous page, or a list held in memory by its offsets
+
+    Args:
+        object_list (object): QuerySet ordered by ascending fields,
+        or a list of objects
+        per_page (int): objects per page
+    """
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    @cached_property
+    def count(self):
+        """Number of objects, counted on demand only
+
+        Returns:
+            int: number of objects, estimated for a large query
+        """
+        return count_rows(self.object_list)[0]
+
+    def page(self, cursor=None):
+        """Page of a cursor
+
+        Args:
+            cursor (string, optional): cursor of the page. Defaults to None,
+            for the first page.
+
+        Raises:
+            InvalidCursor: the cursor was altered
+
+        Returns:
+            KeysetPage: objects of the page
+        """
+        position = decode_cursor(cursor) if cursor else {}
+        if isinstance(self.object_list, QuerySet):
+            return self.keyset_page(position)
+        return self.offset_page(position.get("offset", 0))
+
+    def offset_page(self, offset):
+        """Page of a list held in memory, read by its offset
+
+        Args:
+            offset (int): offset of the first object of the page
+
+        Returns:
+            KeysetPage: objects of the page
+        """
+        offset = max(offset, 0)
+        end = offset + self.per_page
+        objects = list(self.object_list[offset:end])
+        return KeysetPage(
+            objects,
+            self,
+            encode_cursor({"offset": end}) if len(self.object_list) > end else None,
+            encode_cursor({"offset": offset - self.per_page}) if offset else None,
+        )
+
+    def keyset_page(self, position):
+        """Page of a query, read after or before the keys of a row
+
+        Args:
+            position (dictionnary): keys of the row after or before the page,
+            empty for the first page
+
+        Returns:
+            KeysetPage: objects of the page
+        """
+        queryset = self.object_list
+        keys = ordering_keys(queryset)
+        if queryset.query.distinct_fields:
+            # the keys filter the distinct rows, not the rows they are kept from
+            queryset = queryset.model.objects.filter(
+                pk__in=queryset.values("pk")
+            ).order_by(*keys)
+        reverse = "before" in position
+        values = position.get("before") or position.get("after")
+        if values:
+            queryset = queryset.filter(beyond(keys, values, reverse))
+        if reverse:
+            queryset = queryset.order_by(*[f"-{key}" for key in keys])
+        else:
+            queryset = queryset.order_by(*keys)
+        objects = list(queryset[: self.per_page + 1])
+        more = len(objects) > self.per_page
+        objects = objects[: self.per_page]
+        if reverse:
+            objects.reverse()
+        first = [getattr(objects[0], key) for key in keys] if objects else None
+        last = [getattr(objects[-1], key) for key in keys] if objects else None
+        # a page read backward comes from the page following it
+        has_next = more if not reverse else True
+        has_previous = more if reverse else bool(values)
+        return KeysetPage(
+            evaluated(self.object_list, objects),
+            self,
+            encode_cursor({"after": last}) if has_next and last else None,
+            encode_cursor({"before": first}) if has_previous and first else None,
+        )
+
+
+class LookaheadPage(Page):
+    """LookaheadPage knows whether a page follows from the row read
+    after its objects, rather than from the count of the paginator
+
+    Args:
+        object_list (object): objects of the page
+        number (int): number of the page
+        paginator (EstimatedPaginator): paginator of the page
+        following (bool): whether a page follows
+    """
+
+    def __init__(self, object_list, number, paginator, following):
+        super().__init__(object_list, number, paginator)
+        self.following = following
+
+    def has_next(self):
+        return self.following
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 if self.object_list else 0
+
+
+class EstimatedPaginator(Paginator):
+    """EstimatedPaginator pages a list by number without counting it
+    on each page: the count of a large query is the estimate of the planner,
+    the count of a smaller one is cached, and a page reads one object more
+    to know whether another page follows, and the count is exact once the
+    last page is read. The orphans are not merged, as they would need the count
+
+    Args:
+        object_list (object): QuerySet, or a list of objects
+        per_page (int): objects per page
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True):
+        super().__init__(object_list, per_page, 0, allow_empty_first_page)
+        # objects up to the end of the page read, and whether more follow
+        self.seen = (0, True)
+
+    @cached_property
+    def counted(self):
+        """Count of the objects, estimated for a large query, unless the
+        last page was read
+
+        Returns:
+            tuple: count, and whether it is estimated
+        """
+        seen, following = self.seen
+        if not following:
+            return seen, False
+        count, estimated = count_rows(self.object_list)
+        return max(count, seen), estimated
+
+    @property
+    def count(self):
+        return self.counted[0]
+
+    @property
+    def estimated(self):
+        return self.counted[1]
+
+    def validate_number(self, number):
+        """Number of a page, without checking that the page exists
+
+        Args:
+            number (object): number of the page
+
+        Raises:
+            PageNotAnInteger: the number is not an integer
+            EmptyPage: the number is less than 1
+
+        Returns:
+            int: number of the page
+        """
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError) as error:
+            raise PageNotAnInteger("That page number is not an integer") from error
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+        return number
+
+    def page(self, number):
+        """Page of a number, read with the object following it
+
+        Args:
+            number (object): number of the page
+
+        Raises:
+            EmptyPage: the page holds no objects
+
+        Returns:
+            LookaheadPage: objects of the page
+        """
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page + 1
+        objects = list(self.object_list[bottom:top])
+        if not objects and (number > 1 or not self.allow_empty_first_page):
+            raise EmptyPage("That page contains no results")
+        following = len(objects) > self.per_page
+        objects = objects[: self.per_page]
+        self.seen = (bottom + len(objects), following)
+        if isinstance(self.object_list, QuerySet):
+            objects = evaluated(self.object_list, objects)
+        return LookaheadPage(objects, number, self, following)
@@ -0,0 +1,145 @@
+"""Plans of the queries of the product pages: each query is explained on the
+catalogue, and its plan regresses when it scans a large table sequentially
+or when its estimated cost grows over its budget
+"""
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test import RequestFactory
+from product.models import CustomerProduct, Product
+from product.views import FavoritesView, SearchResultsView
+
+# tables growing with the catalogue and the customers
+LARGE_TABLES = {
+    Product._meta.db_table,
+    Product.categories.through._meta.db_table,
+    CustomerProduct._meta.db_table,
+}
+# estimated cost allowed to each query, below the 5,400 of a sequential scan
+# of the products of a catalogue of 50,000 products. The substring search
+# reads the trigram index of the names, created where Postgres has pg_trgm,
+# and the full-text search the GIN index of the search vectors; the latter
+# sorts the 0.5% of the names the planner expects for a word missing from its
+# statistics
+PLAN_BUDGETS = {
+    "substitutes": 4000,
+    "search": 2000,
+    "fulltext": 4000,
+    "favorites": 100,
+}
+
+
+def explain(queryset):
+    """Run and explain a query
+
+    Args:
+        queryset (QuerySet): query explained
+
+    Returns:
+        dictionnary: plan, planning and execution times of the query
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+        # psycopg2 decodes the json of the plan
+        return cursor.fetchone()[0][0]
+
+
+def nodes(plan):
+    """Nodes of a plan, the root first
+
+    Args:
+        plan (dictionnary): node of a plan in the JSON format of EXPLAIN
+
+    Returns:
+        list: the node and the nodes below it
+    """
+    found = [plan]
+    for child in plan.get("Plans", []):
+        found += nodes(child)
+    return found
+
+
+def regressions(plan, budget):
+    """Regressions of a plan
+
+    Args:
+        plan (dictionnary): root node of a plan in the JSON format of EXPLAIN
+        budget (float): estimated cost allowed to the query
+
+    Returns:
+        list: descriptions of the regressions, empty for a plan as expected
+    """
+    found = [
+        f"Seq Scan on {node['Relation Name']}"
+        for node in nodes(plan)
+        if node["Node Type"] == "Seq Scan" and node["Relation Name"] in LARGE_TABLES
+    ]
+    if plan["Total Cost"] > budget:
+        found.append(f"cost {plan['Total Cost']} over {budget}")
+    return found
+
+
+def view_queryset(view_class, user=None, **params):
+    """Query of a list view, on its first page
+
+    Args:
+        view_class (class): ListView of the query
+        user (User, optional): user of the request. Defaults to None.
+        params: parameters of the request
+
+    Returns:
+        QuerySet: objects of the first page of the view
+    """
+    request = RequestFactory().get("/", params)
+    request.user = user or AnonymousUser()
+    view = view_class()
+    view.setup(request)
+    return view.get_queryset()[: view.paginate_by]
+
+
+def queries(product, user, term):
+    """Queries of the product pages whose plans are checked
+
+    Args:
+        product (Product): product whose substitutes are searched
+        user (User): customer whose favorites are listed
+        term (string): terms searched
+
+    Returns:
+        dictionnary: queryset of each query, by name of its budget
+    """
+    return {
+        "substitutes": product.substitutes(),
+        "search": view_queryset(SearchResultsView, q=term),
+        "fulltext": view_queryset(SearchResultsView, q=term, mode="text"),
+        "favorites": view_queryset(FavoritesView, user=user),
+    }
+
+
+def check(product, user, term, budgets=None):
+    """Explain the queries of the product pages
+
+    Args:
+        product (Product): product whose substitutes are searched
+        user (User): customer whose favorites are listed
+        term (string): terms searched
+        budgets (dictionnary, optional): estimated cost allowed to each
+        query. Defaults to None, for PLAN_BUDGETS.
+
+    Returns:
+        dictionnary: cost, times, buffers and regressions of each query
+    """
+    budgets = budgets or PLAN_BUDGETS
+    report = {}
+    for name, queryset in queries(product, user, term).items():
+        result = explain(queryset)
+        plan = result["Plan"]
+        report[name] = {
+            "cost": plan["Total Cost"],
+            "planning_ms": result["Planning Time"],
+            "execution_ms": result["Execution Time"],
+            "shared_hit_blocks": plan["Shared Hit Blocks"],
+            "shared_read_blocks": plan["Shared Read Blocks"],
+            "regressions": regressions(plan, budgets[name]),
+        }
+    return report
@@ -0,0 +1,69 @@
+"""Full-text search of the product names: each name is stored as a tsvector
+of the French configuration, its accents folded, in a column indexed by GIN,
+and the terms searched are folded the same way, so that a search reads the
+index instead of scanning the names and ranks the products by relevance
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, Func, TextField, Value
+
+from product.models import Product
+
+# text search configuration of the names
+SEARCH_CONFIG = "french"
+
+
+class Unaccent(Func):
+    """Text without its accents, folded by the product_unaccent function
+    of the migrations"""
+
+    function = "product_unaccent"
+    output_field = TextField()
+
+
+def name_vector():
+    """Search vector of the name of a product
+
+    Returns:
+        SearchVector: words of the name, accents folded
+    """
+    return SearchVector(Unaccent(F("name")), config=SEARCH_CONFIG)
+
+
+def refresh_vectors(product_ids=None):
+    """Store the search vector of products, as the loaders of import_off
+    write the imported columns only
+
+    Args:
+        product_ids (list, optional): ids of the products whose name
+        changed. Defaults to None, for the products without a vector,
+        created since the last refresh: the upsert never renames a product.
+
+    Returns:
+        int: number of products refreshed
+    """
+    products = Product.objects.all()
+    if product_ids is None:
+        products = products.filter(search_vector__isnull=True)
+    else:
+        products = products.filter(pk__in=product_ids)
+    return products.update(search_vector=name_vector())
+
+
+def search_products(terms):
+    """Products whose name holds the terms, the most relevant first
+
+    Args:
+        terms (string): terms searched, in the syntax of web search engines:
+        "quoted words", or, -excluded
+
+    Returns:
+        QuerySet: products by relevance, then by name
+    """
+    query = SearchQuery(
+        Unaccent(Value(terms or "")), config=SEARCH_CONFIG, search_type="websearch"
+    )
+    return (
+        Product.objects.filter(search_vector=query)
+        .annotate(relevance=SearchRank(F("search_vector"), query))
+        .order_by("-relevance", "name")
+    )
@@ -0,0 +1,95 @@
+"""Signals of the product app
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from product.importer.substitutes import refresh_categories
+from product.models import CustomerProduct, Product
+from product.pagination import bump_catalogue_version
+from product.search import refresh_vectors
+
+
+# products written by an import, refreshed by the import once it is done
+_import = threading.local()
+
+
+@contextmanager
+def suspended():
+    """Leave the arrays, the search vectors and the counts of the products
+    written in the block to the bulk refresh of import_off"""
+    _import.running = True
+    try:
+        yield
+    finally:
+        _import.running = False
+
+
+def importing():
+    """Tell whether the thread runs an import
+
+    Returns:
+        boolean: true in the block of suspended
+    """
+    return getattr(_import, "running", False)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def update_category_ids(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep the category array and signature of the products whose categories
+    change through the ORM, the importer refreshes them itself
+
+    Args:
+        sender (class): through model of the categories
+        instance (Model): product or category changed
+        action (string): kind of change
+        reverse (bool): true when the categories side changed
+        pk_set (set): primary keys of the other side
+    """
+    if reverse and action == "pre_clear":
+        # the products of a cleared category are gone once it is cleared
+        instance.cleared_products = list(
+            instance.product_set.values_list("id", flat=True)
+        )
+    if action not in ("post_add", "post_remove", "post_clear") or importing():
+        return
+    bump_catalogue_version()
+    if not reverse:
+        refresh_categories([instance.pk])
+    elif action == "post_clear":
+        refresh_categories(instance.cleared_products)
+    else:
+        refresh_categories(list(pk_set))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=CustomerProduct)
+@receiver(post_delete, sender=CustomerProduct)
+def expire_counts(sender, **kwargs):
+    """Leave the counts of the product lists cached before a product
+    or a favorite changed
+
+    Args:
+        sender (class): model changed
+    """
+    if not importing():
+        bump_catalogue_version()
+
+
+@receiver(post_save, sender=Product)
+def update_search_vector(sender, instance, update_fields, **kwargs):
+    """Keep the search vector of a product saved through the ORM,
+    the importer refreshes the products it creates itself
+
+    Args:
+        sender (class): model of the products
+        instance (Product): product saved
+        update_fields (frozenset): fields saved, None for all of them
+    """
+    if importing():
+        return
+    if update_fields is None or "name" in update_fields:
+        refresh_vectors([instance.pk])
@@ -0,0 +1,108 @@
+"""Tests of the substitutes of a basket, found in one query
+"""
+import pytest
+from django.db import connection
+from django.urls import reverse
+from product.baskets import BARCODE_SQL, barcode, basket_substitutes
+from product.importer.substitutes import rebuild
+from product.models import Category, Product
+
+
+@pytest.fixture
+def basket(make_product):
+    """Spreads and drinks, of which the basket holds one of each
+
+    Args:
+        make_product (fixture): creates the products
+
+    Returns:
+        list: the spread and the drink of the basket
+
+    """
+    spreads = [Category.objects.create(name=f"spread{index}") for index in range(4)]
+    drinks = [Category.objects.create(name=f"drink{index}") for index in range(4)]
+    spread = make_product("spread", "e", 900, spreads)
+    drink = make_product("drink", "d", 400, drinks)
+    for index in range(8):
+        make_product(f"spread{index}", "abcde"[index % 5], 100 + index, spreads)
+        make_product(f"drink{index}", "abcde"[index % 5], 200 + index, drinks)
+    make_product("lonely", "a", 10, spreads[:1])
+    return [spread, drink]
+
+
+@pytest.mark.django_db
+def test_basket_finds_the_substitutes_in_one_query(basket, django_assert_num_queries):
+    """Valid if each product of the basket finds the best substitutes of the
+    query, ranked or not, in a single query
+
+    Args:
+        basket (fixture): products of the basket
+        django_assert_num_queries (fixture): counts the queries
+    """
+    spread, drink = basket
+    with django_assert_num_queries(1):
+        found = basket_substitutes([spread.pk], [barcode(drink.url)], limit=3)
+    assert list(found) == [spread.pk, drink.pk]
+    for product in basket:
+        expected = [item.pk for item in product.substitutes()[:3]]
+        assert found[product.pk]["product"].name == product.name
+        assert [item.pk for item in found[product.pk]["substitutes"]] == expected
+    rebuild()
+    ranked = basket_substitutes([spread.pk, drink.pk], limit=60)
+    for product in Product.objects.filter(pk__in=[spread.pk, drink.pk]):
+        expected = [item.pk for item in product.ranked_substitutes()]
+        assert [item.pk for item in ranked[product.pk]["substitutes"]] == expected
+
+
+@pytest.mark.django_db
+def test_barcodes_are_looked_up_by_index(basket):
+    """Valid if the barcode of the basket query is the expression indexed
+
+    Args:
+        basket (fixture): products of the basket
+    """
+    code = barcode(basket[1].url)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id FROM {Product._meta.db_table} WHERE {BARCODE_SQL} = %s", [code]
+        )
+        assert cursor.fetchall() == [(basket[1].pk,)]
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute(
+            f"EXPLAIN SELECT id FROM {Product._meta.db_table} "
+            f"WHERE {BARCODE_SQL} = ANY(%s::text[])",
+            [[code]],
+        )
+        plan = "\n".join(line for line, in cursor.fetchall())
+    assert "product_product_barcode" in plan
+
+
+@pytest.mark.django_db
+def test_basket_view_returns_the_cards(basket, client):
+    """Valid if the basket view serves the substitutes as JSON, with the
+    products not found, and refuses an invalid basket or an id out of the
+    integers of Postgres
+
+    Args:
+        basket (fixture): products of the basket
+        client (fixture): client of the tests
+    """
+    spread, drink = basket
+    url = reverse("basket")
+    response = client.get(
+        url, {"ids": f"{spread.pk},999999", "codes": f"{barcode(drink.url)},42"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [product["name"] for product in data["products"]] == ["spread", "drink"]
+    assert data["missing"] == {"ids": [999999], "codes": ["42"]}
+    assert len(data["products"][0]["substitutes"]) == 6
+    first = data["products"][0]["substitutes"][0]
+    assert first["nutrition_grade"] == "a"
+    assert first["details"] == reverse("details", args=[first["id"]])
+    assert client.get(url).status_code == 400
+    assert client.get(url, {"ids": "spread"}).status_code == 400
+    for value in ("0", "-1", str(2**31), "9" * 30):
+        assert client.get(url, {"ids": f"{spread.pk},{value}"}).status_code == 400
+    assert client.get(url, {"ids": spread.pk, "limit": 0}).status_code == 400
+    assert client.post(url, {"ids": spread.pk}).status_code == 405
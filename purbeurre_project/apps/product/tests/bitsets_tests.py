@@ -0,0 +1,213 @@
+"""Tests of the in-process substitute index
+"""
+import io
+import json
+import random
+import threading
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from product import bitsets
+from product.bitsets import SubstituteIndex, SubstituteList, find_substitutes
+from product.models import Category, Product
+
+
+@pytest.fixture
+def catalogue(random_catalogue):
+    """Products in random categories, with grades and energies repeated
+    so that several products tie
+
+    Args:
+        random_catalogue (fixture): creates the products
+
+    Returns:
+        list: the products
+    """
+    return random_catalogue(
+        15,
+        150,
+        12,
+        lambda generator, size: [
+            generator.choice([50, 100, 200, 400]) for _ in range(size)
+        ],
+        lambda generator, categories: generator.sample(
+            categories, generator.randint(1, 8)
+        ),
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("common", [1, 3, 4, 6])
+def test_index_matches_the_query(catalogue, common):
+    """Valid if the index finds the substitutes of the query, in its order
+
+    Args:
+        catalogue (fixture): products in random categories
+        common (int): number of categories shared
+    """
+    index = SubstituteIndex.load()
+    for product in catalogue:
+        expected = list(
+            product.substitutes(common).values_list("nutrition_grade", "energy_100g")
+        )
+        found = index.substitutes(product.pk, common)
+        # the ties on grade and energy may keep different products
+        assert [index.keys[index.positions[pk]] for pk in found] == expected
+        assert product.pk not in found
+
+
+@pytest.mark.parametrize("dense_share", [1, bitsets.DENSE_SHARE, 10**6])
+def test_sparse_and_dense_categories_match_alike(dense_share, monkeypatch):
+    """Valid if the products sharing categories are found alike, whether
+    the categories are kept as positions, as bitsets, or both
+
+    Args:
+        dense_share (int): share of the catalogue over which a category
+        is kept as a bitset
+        monkeypatch (fixture): sets the share
+    """
+    monkeypatch.setattr(bitsets, "DENSE_SHARE", dense_share)
+    generator = random.Random(15)
+    products = [
+        (product_id, generator.choice("abcde"), generator.choice([50, 100, 200]))
+        for product_id in range(1, 401)
+    ]
+    # the categories halve in size every other one
+    memberships = [
+        (product[0], category_id)
+        for product in products
+        for category_id in range(16)
+        if generator.random() < 0.9 / 2 ** (category_id // 2)
+    ]
+    index = SubstituteIndex(products, memberships)
+    assert bool(index.sparse) == (dense_share < 10**6)
+    assert bool(index.bitsets) == (dense_share > 1)
+    for product_id, _, _ in products:
+        position = index.positions[product_id]
+        grade = index.keys[position][0]
+        mine = set(index.categories[position])
+        for common in (1, 3, 4):
+            expected = [
+                other
+                for other, categories in enumerate(index.categories)
+                if other != position
+                and index.keys[other][0] <= grade
+                and len(mine.intersection(categories)) >= common
+            ]
+            assert index.matches(product_id, common).tolist() == expected
+
+
+@pytest.mark.django_db
+def test_substitute_list_pages_in_order(catalogue):
+    """Valid if a page of the substitutes is read in the order of the index
+
+    Args:
+        catalogue (fixture): products in random categories
+    """
+    ids = [product.pk for product in reversed(catalogue)]
+    substitutes = SubstituteList(ids)
+    assert len(substitutes) == len(catalogue)
+    assert [product.pk for product in substitutes[3:9]] == ids[3:9]
+    assert substitutes[0].pk == ids[0]
+
+
+@pytest.mark.django_db
+def test_product_imported_since_falls_back_on_the_query(
+    catalogue, settings, monkeypatch
+):
+    """Valid if a product unknown to the index finds its substitutes live
+
+    Args:
+        catalogue (fixture): products in random categories
+        settings (fixture): settings of the tests
+        monkeypatch (fixture): restores the index of the worker
+    """
+    monkeypatch.setattr(bitsets, "_index", None)
+    settings.SUBSTITUTE_INDEX_TTL = 3600
+    find_substitutes(catalogue[0])
+    newcomer = Product.objects.create(
+        name="newcomer",
+        nutrition_grade="e",
+        energy_100g=10,
+        energy_unit="kJ",
+        carbohydrates_100g=1,
+        sugars_100g=1,
+        fat_100g=1,
+        saturated_fat_100g=1,
+        salt_100g=1,
+        sodium_100g=1,
+        fiber_100g=1,
+        proteins_100g=1,
+        url="http://newcomer.fr",
+        image_url="http://newcomer.fr/product.jpg",
+    )
+    newcomer.categories.set(Category.objects.all())
+    assert list(find_substitutes(newcomer, 1)) == list(newcomer.substitutes(1))
+
+
+@pytest.mark.django_db
+def test_stale_index_is_served_while_refreshed(catalogue, settings, monkeypatch):
+    """Valid if a request past the TTL gets the stale index at once, while
+    a single thread loads the new index and puts it in place
+
+    Args:
+        catalogue (fixture): products in random categories
+        settings (fixture): settings of the tests
+        monkeypatch (fixture): restores the index of the worker
+    """
+    settings.SUBSTITUTE_INDEX_TTL = 60
+    stale = SubstituteIndex.load()
+    stale.loaded_at -= 61
+    fresh = SubstituteIndex.load()
+    monkeypatch.setattr(bitsets, "_index", stale)
+    released = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(threading.current_thread())
+        released.wait(5)
+        return fresh
+
+    monkeypatch.setattr(SubstituteIndex, "load", load)
+    assert bitsets.get_index() is stale
+    assert bitsets.get_index() is stale
+    released.set()
+    loads[0].join(5)
+    assert bitsets.get_index() is fresh
+    assert len(loads) == 1 and loads[0] is not threading.current_thread()
+
+
+@pytest.mark.django_db
+def test_substitute_view_reads_the_index(catalogue, client, settings, monkeypatch):
+    """Valid if the substitute page serves the substitutes of the index
+
+    Args:
+        catalogue (fixture): products in random categories
+        client (fixture): client of the tests
+        settings (fixture): settings of the tests
+        monkeypatch (fixture): restores the index of the worker
+    """
+    monkeypatch.setattr(bitsets, "_index", None)
+    settings.SUBSTITUTE_INDEX = True
+    product = catalogue[0]
+    expected = SubstituteIndex.load().substitutes(product.pk)[:6]
+    response = client.get(reverse("substitute", args=[product.pk]))
+    assert response.status_code == 200
+    assert [item.pk for item in response.context["object_list"]] == expected
+
+
+@pytest.mark.django_db
+def test_benchmark_substitutes(catalogue):
+    """Valid if the benchmark times both lookups and finds no mismatch
+
+    Args:
+        catalogue (fixture): products in random categories
+    """
+    output = io.StringIO()
+    call_command("benchmark_substitutes", samples=20, common=3, stdout=output)
+    result = json.loads(output.getvalue())
+    assert result["products"] == len(catalogue)
+    assert result["sql"]["count"] == result["index"]["count"] == 20
+    assert result["nutrients"]["count"] == 20
+    assert result["mismatches"] == 0
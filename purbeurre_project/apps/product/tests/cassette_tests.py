@@ -0,0 +1,56 @@
+"""Tests of the cassettes recording and replaying Open Food Facts responses
+"""
+import pytest
+from django.core.management import call_command
+from product.importer.cassette import CassetteMiss, CassetteStore
+from product.importer.fetch import OffClient
+from product.models import Product
+
+
+def test_replay_answers_conditional_requests(stand_in, tmp_path):
+    """Valid if a replayed response keeps its validators and answers
+    a conditional request with a 304
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        tmp_path (fixture): temporary directory of the cassettes
+    """
+    stand_in.etag = '"v1"'
+    stand_in.routes["/categories.json"] = [(200, {"tags": []})]
+    recorder = OffClient(base_url=stand_in.url)
+    recorder.use_cassettes(CassetteStore(str(tmp_path)), record=True)
+    assert recorder.get("/categories.json").json() == {"tags": []}
+
+    player = OffClient(base_url=stand_in.url)
+    player.use_cassettes(CassetteStore(str(tmp_path)))
+    assert player.get("/categories.json", conditional=True).json() == {"tags": []}
+    assert player.get("/categories.json", conditional=True).status_code == 304
+    assert len(stand_in.calls) == 1
+    with pytest.raises(CassetteMiss):
+        player.get("/cgi/search.pl?")
+
+
+@pytest.mark.django_db
+def test_import_off_replays_recorded_import(stand_in, tmp_path, off_product):
+    """Valid if an import recorded once is replayed offline with the same result
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        tmp_path (fixture): temporary directory of the cassettes
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.routes["/categories.json"] = [
+        (200, {"tags": [{"name": "foo", "products": 5000}]})
+    ]
+    stand_in.routes["/cgi/search.pl"] = [
+        (200, {"products": [off_product("p1"), off_product("p2")]})
+    ]
+    call_command("import_off", base_url=stand_in.url, stream=True, record=tmp_path)
+    recorded = set(Product.objects.values_list("name", flat=True))
+    Product.objects.all().delete()
+    stand_in.calls.clear()
+    stand_in.routes["/cgi/search.pl"] = [(500, {})]
+    call_command("import_off", base_url=stand_in.url, stream=True, replay=tmp_path)
+    assert recorded == {"p1", "p2"}
+    assert set(Product.objects.values_list("name", flat=True)) == recorded
+    assert not stand_in.calls
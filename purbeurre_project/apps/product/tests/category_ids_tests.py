@@ -0,0 +1,102 @@
+"""Tests of the substitutes found on the category_ids arrays
+"""
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from product.importer.substitutes import refresh_categories
+from product.models import Category, Product
+
+
+@pytest.fixture
+def catalogue(random_catalogue):
+    """Products drawn from a few families of overlapping categories,
+    linked in bulk as the importer does
+
+    Args:
+        random_catalogue (fixture): creates the products
+
+    Returns:
+        list: the products
+    """
+
+    def draw(generator, categories):
+        first = generator.randrange(5) * 6
+        return generator.sample(categories[first:][:6], generator.randint(3, 6))
+
+    return random_catalogue(
+        5, 80, 30, lambda generator, size: generator.sample(range(1000), size), draw
+    )
+
+
+@pytest.mark.django_db
+def test_category_ids_follow_the_categories(catalogue):
+    """Valid if the arrays hold the sorted categories, through the ORM too
+
+    Args:
+        catalogue (fixture): products in families of categories
+    """
+    assert refresh_categories() == 0
+    product = Product.objects.get(pk=catalogue[0].pk)
+    expected = sorted(product.categories.values_list("id", flat=True))
+    assert product.category_ids == expected
+    extra = Category.objects.create(name="extra")
+    product.categories.add(extra)
+    product.refresh_from_db()
+    assert product.category_ids == sorted(expected + [extra.pk])
+    assert Category.objects.get(pk=extra.pk).product_count == 1
+    product.categories.clear()
+    product.refresh_from_db()
+    assert product.category_ids == []
+    assert Category.objects.get(pk=extra.pk).product_count == 0
+    counted = Category.objects.annotate(products=Count("product"))
+    for category in counted:
+        assert category.product_count == category.products
+
+
+@pytest.mark.django_db
+def test_array_substitutes_match_the_query(catalogue):
+    """Valid if the arrays find the substitutes of the through table,
+    the lowest id among equal grade and energy, without reading the table
+
+    Args:
+        catalogue (fixture): products in families of categories
+    """
+    # a twin of a product, of the same grade and energy, is kept for
+    # the product only, which is not its own substitute
+    twin = Product.objects.get(pk=catalogue[0].pk)
+    categories = list(twin.categories.all())
+    twin.pk, twin.name, twin.url = None, "twin", "http://twin.fr"
+    twin.save()
+    twin.categories.set(categories)
+    ties = 0
+    for product in Product.objects.all():
+        for common in (3, 4):
+            with CaptureQueriesContext(connection) as queries:
+                found = list(product.array_substitutes(common))
+            assert found == list(product.substitutes(common))
+            if product.pk != catalogue[0].pk:
+                assert twin not in found
+                ties += catalogue[0] in found
+            through = Product.categories.through._meta.db_table
+            assert not [query for query in queries if through in query["sql"]]
+    assert ties
+
+
+@pytest.mark.django_db
+def test_explain_substitutes_compares_the_plans(catalogue):
+    """Valid if the comparison explains both queries on the same products
+
+    Args:
+        catalogue (fixture): products in families of categories
+    """
+    output = io.StringIO()
+    call_command("explain_substitutes", samples=10, stdout=output)
+    result = json.loads(output.getvalue())
+    assert result["mismatches"] == 0
+    assert result["through"]["execution"]["count"] == 10
+    assert result["array"]["execution"]["count"] == 10
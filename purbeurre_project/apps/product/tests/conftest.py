@@ -0,0 +1,266 @@
+"""Fixtures shared by the tests of the product app
+"""
+import gzip
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from product.importer.substitutes import refresh_categories
+from product.models import Category, Product
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serve the responses registered on the server for each path"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer with the next response registered for the path"""
+        server = self.server
+        path = self.path.split("?")[0]
+        if server.etag and self.headers.get("If-None-Match") == server.etag:
+            server.calls.append(self.path)
+            self.send_response(304)
+            self.end_headers()
+            return
+        with server.lock:
+            server.calls.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            queue = server.routes[path]
+            status, payload = queue.pop(0) if len(queue) > 1 else queue[0]
+        time.sleep(server.delay)
+        if isinstance(payload, bytes):
+            body, content_type = payload, "image/jpeg"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if server.etag:
+            self.send_header("ETag", server.etag)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, *args):
+        """Keep the test output quiet"""
+
+
+@pytest.fixture
+def stand_in():
+    """Local HTTP server answering like the Open Food Facts API
+
+    Yields:
+        ThreadingHTTPServer: server whose routes are set by the tests
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.routes = {}
+    server.calls = []
+    server.delay = 0
+    server.etag = None
+    server.in_flight = server.max_in_flight = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def other_node():
+    """Session of another node holding advisory locks
+
+    Yields:
+        cursor: cursor of a second connection to the test database
+    """
+    other = psycopg2.connect(**connection.get_connection_params())
+    other.autocommit = True
+    yield other.cursor()
+    other.close()
+
+
+@pytest.fixture
+def off_product():
+    """Factory of the product dictionnaries returned by Open Food Facts
+
+    Returns:
+        function: builds a product from its name, nutriscore, categories,
+        url and fibers for 100g
+    """
+
+    def build(name, grade="a", categories="foo", url=None, fiber="2"):
+        """Build a product dictionnary as returned by Open Food Facts
+
+        Args:
+            name (string): name of the product
+            grade (string, optional): nutriscore. Defaults to "a".
+            categories (string, optional): categories of the product.
+            Defaults to "foo".
+            url (string, optional): url of the product. Defaults to None.
+            fiber (string, optional): fibers for 100g. Defaults to "2".
+
+        Returns:
+            dictionnary: a product dictionnary
+        """
+        return {
+            "product_name": name,
+            "nutrition_grade_fr": grade,
+            "url": url or f"http://{name}.fr",
+            "image_front_url": f"http://{name}.fr/product.jpg",
+            "categories": categories,
+            "nutriments": {
+                "energy_value": "1",
+                "energy_unit": "gr",
+                "carbohydrates_100g": "2",
+                "sugars_100g": "2",
+                "fat_100g": "2",
+                "saturated-fat_100g": "2",
+                "salt_100g": "2",
+                "sodium_100g": "2",
+                "fiber_100g": fiber,
+                "proteins_100g": "2",
+            },
+        }
+
+    return build
+
+
+@pytest.fixture
+def make_product():
+    """Factory of the products of the catalogue
+
+    Returns:
+        function: creates a product from its name, nutrition grade, energy,
+        categories, url and nutriments
+    """
+    barcodes = itertools.count(3000000000001)
+
+    def create(name, grade="c", energy=100, categories=(), url=None, **nutriments):
+        """Create a product in categories
+
+        Args:
+            name (string): name of the product
+            grade (string, optional): nutrition grade. Defaults to "c".
+            energy (int, optional): energy of the product. Defaults to 100.
+            categories (list, optional): categories of the product.
+            Defaults to ().
+            url (string, optional): url of the product. Defaults to None,
+            for an url of Open Food Facts holding a new barcode.
+            nutriments: values for 100g, 1 for those left out
+
+        Returns:
+            Product: the product created
+        """
+        values = {
+            "carbohydrates_100g": 1,
+            "sugars_100g": 1,
+            "fat_100g": 1,
+            "saturated_fat_100g": 1,
+            "salt_100g": 1,
+            "sodium_100g": 1,
+            "fiber_100g": 1,
+            "proteins_100g": 1,
+        }
+        values.update(nutriments)
+        product = Product.objects.create(
+            name=name,
+            nutrition_grade=grade,
+            energy_100g=energy,
+            energy_unit="kJ",
+            url=url or f"https://fr.openfoodfacts.org/produit/{next(barcodes)}",
+            image_url=f"http://{name}.fr/product.jpg",
+            **values,
+        )
+        if categories:
+            product.categories.set(categories)
+        return product
+
+    return create
+
+
+@pytest.fixture
+def random_catalogue():
+    """Factory of the catalogues of products in random categories, linked
+    in bulk as the importer does, and analyzed for the planner
+
+    Returns:
+        function: creates the products from a seed, their number,
+        the number of categories, and the draws of their energies
+        and of their categories
+    """
+
+    def create(seed, size, nb_categories, energies, draw):
+        """Create products in random categories
+
+        Args:
+            seed (int): seed of the catalogue
+            size (int): number of products
+            nb_categories (int): number of categories
+            energies (function): draws the energies of the products,
+            from the generator and the number of products
+            draw (function): draws the categories of a product,
+            from the generator and the categories
+
+        Returns:
+            list: the products
+        """
+        generator = random.Random(seed)
+        categories = Category.objects.bulk_create(
+            [Category(name=f"c{index}") for index in range(nb_categories)]
+        )
+        products = Product.objects.bulk_create(
+            [
+                Product(
+                    name=f"p{index}",
+                    nutrition_grade=generator.choice("abcde"),
+                    energy_100g=energy,
+                    energy_unit="kJ",
+                    carbohydrates_100g=1,
+                    sugars_100g=1,
+                    fat_100g=1,
+                    saturated_fat_100g=1,
+                    salt_100g=1,
+                    sodium_100g=1,
+                    fiber_100g=1,
+                    proteins_100g=1,
+                    url=f"http://p{index}.fr",
+                    image_url=f"http://p{index}.fr/product.jpg",
+                )
+                for index, energy in enumerate(energies(generator, size))
+            ]
+        )
+        through = Product.categories.through
+        through.objects.bulk_create(
+            [
+                through(product_id=product.pk, category_id=category.pk)
+                for product in products
+                for category in draw(generator, categories)
+            ]
+        )
+        refresh_categories()
+        # plan the substitute query on the statistics of the catalogue
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return products
+
+    return create
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Empty the cache before each test, as the version of the catalogue
+    rolled back after a test is bumped again to the same numbers
+    """
+    cache.clear()
@@ -0,0 +1,124 @@
+"""Tests of the counts of the product lists paged by number
+"""
+import pytest
+from django.core.paginator import EmptyPage
+from django.db import connection
+from django.urls import reverse
+from product.models import Product
+from product.pagination import EstimatedPaginator, count_rows
+
+
+@pytest.fixture
+def chocolates(make_product):
+    """Seven chocolates and a biscuit
+
+    Args:
+        make_product (fixture): creates the products
+
+    Returns:
+        QuerySet: the chocolates, by name
+
+    """
+    for index in range(7):
+        make_product(f"chocolat {index}", "abcde"[index % 5], 100 * index)
+    make_product("biscuit", "c", 1000)
+    return Product.objects.filter(name__icontains="chocolat").order_by("name")
+
+
+@pytest.mark.django_db
+def test_counts_are_estimated_or_cached(
+    chocolates, settings, django_assert_num_queries, make_product
+):
+    """Valid if a large list is counted by the planner, and a smaller one
+    counted once for the catalogue as it is
+
+    Args:
+        chocolates (fixture): chocolates by name
+        settings (fixture): settings of the test
+        django_assert_num_queries (fixture): counts the queries
+        make_product (fixture): creates the products
+    """
+    settings.PAGINATOR_ESTIMATE_THRESHOLD = 0
+    count, estimated = count_rows(chocolates)
+    assert estimated and count >= 0
+    settings.PAGINATOR_ESTIMATE_THRESHOLD = 1000
+    assert count_rows(chocolates) == (7, False)
+    with django_assert_num_queries(2):
+        # the plan and the version are read, the count is not run again
+        assert count_rows(chocolates) == (7, False)
+    make_product("chocolat 7", "a", 10)
+    assert count_rows(chocolates) == (8, False)
+    assert count_rows(list(chocolates)) == (8, False)
+
+
+@pytest.mark.django_db
+def test_counts_follow_the_version_of_the_database(chocolates, settings):
+    """Valid if a cached count is kept through a change without signals,
+    and left once another process bumps the version in the database
+
+    Args:
+        chocolates (fixture): chocolates by name
+        settings (fixture): settings of the test
+    """
+    settings.PAGINATOR_ESTIMATE_THRESHOLD = 1000
+    assert count_rows(chocolates) == (7, False)
+    Product.objects.filter(name="chocolat 0").update(name="cake")
+    assert count_rows(chocolates) == (7, False)
+    # as an import_off run by another process bumps it
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE product_catalogueversion SET version = version + 1 WHERE id = 1"
+        )
+    assert count_rows(chocolates) == (6, False)
+
+
+@pytest.mark.django_db
+def test_pages_look_ahead(chocolates, django_assert_num_queries):
+    """Valid if a page knows whether another follows without a count,
+    and the count is exact once the last page is read
+
+    Args:
+        chocolates (fixture): chocolates by name
+        django_assert_num_queries (fixture): counts the queries
+    """
+    paginator = EstimatedPaginator(chocolates, 3)
+    with django_assert_num_queries(1):
+        page = paginator.page(2)
+        assert page.has_next() and page.has_previous()
+        assert [page.start_index(), page.end_index()] == [4, 6]
+    assert page.object_list.count() == 3
+    paginator = EstimatedPaginator(chocolates, 3)
+    with django_assert_num_queries(1):
+        page = paginator.page(3)
+        assert not page.has_next()
+        assert (paginator.count, paginator.num_pages) == (7, 3)
+        assert not paginator.estimated
+    with pytest.raises(EmptyPage):
+        paginator.page(4)
+
+
+@pytest.mark.django_db
+def test_search_hides_the_last_page_of_an_estimate(chocolates, client, settings):
+    """Valid if the search results link the next page, but neither the last
+    one nor the numbered pages when the count is estimated
+
+    Args:
+        chocolates (fixture): chocolates by name
+        client (fixture): client of the tests
+        settings (fixture): settings of the test
+    """
+    url = reverse("search")
+    settings.PAGINATOR_ESTIMATE_THRESHOLD = 1000
+    response = client.get(url, {"q": "chocolat"})
+    assert response.context["page_obj"].has_next()
+    assert "fa-angle-double-right" in response.content.decode()
+    settings.PAGINATOR_ESTIMATE_THRESHOLD = 0
+    response = client.get(url, {"q": "chocolat"})
+    assert response.context["page_obj"].has_next()
+    assert "fa-angle-double-right" not in response.content.decode()
+    assert response.content.decode().count("&page=") == 1
+    following = client.get(url, {"q": "chocolat", "page": 2})
+    assert len(following.context["object_list"]) == 1
+    # the count is exact once the last page is read
+    assert not following.context["page_obj"].paginator.estimated
+    assert not following.context["page_obj"].has_next()
@@ -0,0 +1,106 @@
+"""Tests of the import from Open Food Facts bulk dumps
+"""
+# pylint: disable=redefined-outer-name
+import gzip
+import json
+
+import pytest
+import responses
+from django.core.management import call_command
+from product.importer.dump import iter_dump
+from product.models import Category, Product
+from product.search import search_products
+
+CSV_HEADER = (
+    "code\turl\tproduct_name\tcategories\tnutrition_grade_fr\timage_url\t"
+    "energy_100g\tfat_100g\tsaturated-fat_100g\tcarbohydrates_100g\t"
+    "sugars_100g\tfiber_100g\tproteins_100g\tsalt_100g\tsodium_100g\n"
+)
+
+
+@pytest.fixture
+def jsonl_dump(tmp_path):
+    """Gzipped JSONL dump with a valid product and a product without fiber
+
+    Args:
+        tmp_path (fixture): temporary directory
+
+    Returns:
+        Path: path of the dump
+    """
+    products = [
+        {
+            "code": "301",
+            "product_name": "Yaourt",
+            "nutrition_grades": "a",
+            "categories": "foo,bar",
+            "image_url": "http://yaourt.fr/product.jpg",
+            "nutriments": {
+                "energy_100g": 420,
+                "carbohydrates_100g": 2,
+                "sugars_100g": 2,
+                "fat_100g": 2,
+                "saturated-fat_100g": 2,
+                "salt_100g": 0.2,
+                "sodium_100g": 0.1,
+                "fiber_100g": 1.5,
+                "proteins_100g": 4,
+            },
+        },
+        {"code": "302", "product_name": "Soda", "nutrition_grades": "e"},
+    ]
+    path = tmp_path / "products.jsonl.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as dump:
+        for product in products:
+            dump.write(json.dumps(product) + "\n")
+        dump.write("not json\n")
+    return path
+
+
+def test_jsonl_dump_is_shaped_like_the_api(jsonl_dump):
+    """Valid if a product of the JSONL dump gets the keys of the API
+
+    Args:
+        jsonl_dump (fixture): gzipped JSONL dump
+    """
+    products = list(iter_dump(jsonl_dump))
+    assert len(products) == 2
+    assert products[0]["nutrition_grade_fr"] == "a"
+    assert products[0]["url"] == "https://fr.openfoodfacts.org/produit/301"
+    assert products[0]["nutriments"]["energy_value"] == 420
+
+
+@pytest.mark.django_db
+def test_import_off_from_jsonl_dump_without_network(jsonl_dump):
+    """Valid if a dump is imported without requesting the API
+
+    Args:
+        jsonl_dump (fixture): gzipped JSONL dump
+    """
+    with responses.RequestsMock():
+        call_command("import_off", from_dump=str(jsonl_dump))
+    product = Product.objects.get(name="Yaourt")
+    assert product.energy_100g == 420
+    assert {categ.name for categ in product.categories.all()} == {"foo", "bar"}
+    assert list(search_products("yaourts")) == [product]
+    assert not Product.objects.filter(name="Soda").exists()
+
+
+@pytest.mark.django_db
+def test_import_off_from_csv_dump(tmp_path):
+    """Valid if a tab separated dump is imported
+
+    Args:
+        tmp_path (fixture): temporary directory
+    """
+    path = tmp_path / "products.csv"
+    path.write_text(
+        CSV_HEADER + "401\thttp://chips.fr\tChips\tsnacks\td\thttp://chips.fr/c.jpg\t"
+        "2200.5\t30\t3\t50\t1\t4\t6\t1.2\t0.5\n",
+        encoding="utf-8",
+    )
+    call_command("import_off", from_dump=str(path), loader="row")
+    product = Product.objects.get(name="Chips")
+    assert product.nutrition_grade == "d"
+    assert product.fiber_100g == 4
+    assert Category.objects.filter(name="snacks").exists()
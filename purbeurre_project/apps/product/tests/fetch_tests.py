@@ -0,0 +1,133 @@
+"""Tests of the HTTP layer against a local stand-in of Open Food Facts
+"""
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from django.core.management import call_command
+from product.importer.fetch import OffClient
+from product.management.commands.import_off import Command as command_import
+from product.models import CategoryListing, Product
+
+
+def test_client_retries_on_server_errors(stand_in):
+    """Valid if the client retries a 5xx response before succeeding
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+    """
+    stand_in.routes["/categories.json"] = [(503, {}), (502, {}), (200, {"tags": []})]
+    client = OffClient(base_url=stand_in.url, backoff=0.01)
+    response = client.get("/categories.json")
+    assert response.status_code == 200
+    assert response.json() == {"tags": []}
+    assert len(stand_in.calls) == 3
+
+
+def test_client_gives_up_after_the_retries(stand_in):
+    """Valid if the last 5xx response is returned once the retries are spent
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+    """
+    stand_in.routes["/categories.json"] = [(500, {})]
+    client = OffClient(base_url=stand_in.url, retries=2, backoff=0.01)
+    assert client.get("/categories.json").status_code == 500
+    assert len(stand_in.calls) == 3
+
+
+def test_client_keeps_requests_in_flight(stand_in):
+    """Valid if several requests run together and results keep their order
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+    """
+    stand_in.delay = 0.1
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": []})]
+    client = OffClient(base_url=stand_in.url, workers=4)
+    results = list(
+        client.map(
+            lambda index: (index, client.get("/cgi/search.pl?").status_code), range(8)
+        )
+    )
+    assert results == [(index, 200) for index in range(8)]
+    assert stand_in.max_in_flight > 1
+
+
+def test_products_are_streamed_through_every_page(stand_in, off_product):
+    """Valid if the pages are requested until a page is not full
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.routes["/cgi/search.pl"] = [
+        (200, {"count": 5, "products": [off_product("p1"), off_product("p2")]}),
+        (200, {"count": 5, "products": [off_product("p3"), off_product("p4")]}),
+        (200, {"count": 5, "products": [off_product("p5")]}),
+    ]
+    command = command_import()
+    command.client = OffClient(base_url=stand_in.url)
+    products = command.iter_products_for_category("foo", page_size=2)
+    assert [product["product_name"] for product in products] == [
+        "p1",
+        "p2",
+        "p3",
+        "p4",
+        "p5",
+    ]
+    pages = [parse_qs(urlsplit(call).query)["page"] for call in stand_in.calls]
+    assert pages == [["1"], ["2"], ["3"]]
+
+
+def test_stream_raises_errors_of_the_threads():
+    """Valid if an error raised while fetching reaches the consumer"""
+
+    def failing(item):
+        yield item
+        raise ValueError("broken page")
+
+    client = OffClient(workers=2)
+    with pytest.raises(ValueError):
+        list(client.stream(failing, range(3)))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("stream", [False, True])
+def test_import_off_against_stand_in(stand_in, stream, off_product):
+    """Valid if the command imports products served by a local stand-in
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        stream (bool): parse the products while they are downloaded
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.routes["/categories.json"] = [
+        (200, {"tags": [{"name": "foo", "products": 5000}]})
+    ]
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": [off_product("test")]})]
+    call_command("import_off", base_url=stand_in.url, workers=2, stream=stream)
+    assert Product.objects.filter(name="test").exists()
+
+
+@pytest.mark.django_db
+def test_delta_import_skips_unchanged_listings(stand_in, off_product):
+    """Valid if a listing answered by a 304 is not imported again
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.etag = '"v1"'
+    stand_in.routes["/categories.json"] = [
+        (200, {"tags": [{"name": "foo", "products": 5000}]})
+    ]
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": [off_product("test")]})]
+    call_command("import_off", base_url=stand_in.url, delta=True)
+    assert CategoryListing.objects.get().etag == '"v1"'
+    Product.objects.all().delete()
+    call_command("import_off", base_url=stand_in.url, delta=True)
+    assert not Product.objects.exists()
+    stand_in.etag = '"v2"'
+    call_command("import_off", base_url=stand_in.url, delta=True)
+    assert Product.objects.filter(name="test").exists()
+    assert CategoryListing.objects.get().etag == '"v2"'
@@ -0,0 +1,175 @@
+"""Tests of the substitutes ranked by idf-weighted category overlap
+"""
+import io
+import json
+
+import numpy as np
+import pytest
+from django.core.management import call_command
+from product.importer import idf, substitutes
+from product.importer.idf import CategoryMatrix
+from product.models import Category, Product, ProductSubstitute
+
+
+def random_matrix(seed=16, size=120):
+    """Build a matrix of products in random categories
+
+    Args:
+        seed (int, optional): seed of the catalogue. Defaults to 16.
+        size (int, optional): number of products. Defaults to 120.
+
+    Returns:
+        CategoryMatrix: categories of the products
+    """
+    generator = np.random.default_rng(seed)
+    ids = generator.permutation(np.arange(1, size + 1)) * 3
+    pairs = np.array(
+        [
+            (product_id, category_id)
+            for product_id in ids
+            for category_id in generator.choice(
+                20, size=generator.integers(1, 6), replace=False
+            )
+        ]
+    )
+    # a few categories hold most of the products
+    pairs[:, 1] = np.where(pairs[:, 1] < 10, pairs[:, 1] % 2, pairs[:, 1])
+    pairs = np.unique(pairs, axis=0)
+    return CategoryMatrix(
+        ids,
+        generator.integers(ord("a"), ord("e") + 1, size=size),
+        generator.integers(0, 500, size=size),
+        pairs,
+    )
+
+
+def score_all(matrix, max_pairs, common, limit=10):
+    """Rank the substitutes of all the products, block by block
+
+    Args:
+        matrix (CategoryMatrix): categories of the products
+        max_pairs (int): candidate pairs scored at once
+        common (ndarray): indexes of the categories which pair no products
+        limit (int, optional): substitutes kept per product. Defaults to 10.
+
+    Returns:
+        list: product, substitute, rank and score of the substitutes
+    """
+    ranked = []
+    for start, end in matrix.blocks(max_pairs, common):
+        products, others, ranks, scores = matrix.score_block(start, end, common, limit)
+        ranked += zip(
+            products.tolist(), others.tolist(), ranks.tolist(), scores.round(9).tolist()
+        )
+    return ranked
+
+
+def test_blocks_do_not_change_the_ranking():
+    """Valid if scoring by small blocks ranks as scoring at once"""
+    matrix = random_matrix()
+    common = np.array([], dtype=np.int64)
+    assert len(matrix.blocks(50, common)) > 10
+    assert score_all(matrix, 50, common) == score_all(matrix, 10**9, common)
+
+
+def test_common_categories_only_weigh_the_pairs(monkeypatch):
+    """Valid if a pair sharing a rare category keeps the weight of the common
+    categories it shares, and a pair sharing common categories only is dropped
+
+    Args:
+        monkeypatch (fixture): lowers the size of the common categories
+    """
+    monkeypatch.setattr(idf, "MIN_COMMON", 0)
+    matrix = random_matrix()
+    common = matrix.common_categories(0.3)
+    assert list(matrix.category_ids[common]) == [0, 1]
+    full = {
+        (product, other): (rank, score)
+        for product, other, rank, score in score_all(
+            matrix, 10**9, np.array([], dtype=np.int64), limit=200
+        )
+    }
+    pruned = score_all(matrix, 200, common, limit=200)
+    assert pruned
+    assert all(full[product, other][1] == score for product, other, _, score in pruned)
+    paired = {(product, other) for product, other, _, _ in pruned}
+    for (product, other), _ in full.items():
+        categories = set(matrix.categories_of(product)) & set(
+            matrix.categories_of(other)
+        )
+        assert ((product, other) in paired) == bool(categories - set(common))
+
+
+@pytest.mark.django_db
+def test_rare_category_ranks_first():
+    """Valid if sharing a rare category outweighs a better grade"""
+    vegetal = Category.objects.create(name="Aliments et boissons à base de végétaux")
+    spread = Category.objects.create(name="Pâtes à tartiner aux noisettes")
+    drinks = Category.objects.create(name="Boissons")
+    products = {}
+    for name, grade, categories in (
+        ("searched", "d", [vegetal, spread, drinks]),
+        ("spread", "c", [vegetal, spread]),
+        ("drink", "a", [vegetal, drinks]),
+        ("vegetal", "a", [vegetal, drinks]),
+        ("plain", "a", [vegetal]),
+        ("worse", "e", [vegetal, spread, drinks]),
+    ):
+        products[name] = Product.objects.create(
+            name=name,
+            nutrition_grade=grade,
+            energy_100g=100,
+            energy_unit="kJ",
+            carbohydrates_100g=1,
+            sugars_100g=1,
+            fat_100g=1,
+            saturated_fat_100g=1,
+            salt_100g=1,
+            sodium_100g=1,
+            fiber_100g=1,
+            proteins_100g=1,
+            url=f"http://{name}.fr",
+            image_url=f"http://{name}.fr/product.jpg",
+        )
+        products[name].categories.set(categories)
+    products["drink"].categories.add(Category.objects.create(name="Boissons végétales"))
+    output = io.StringIO()
+    call_command("compute_substitutes", method="idf", stdout=output)
+    assert f"{ProductSubstitute.objects.count()} substitutes ranked" in (
+        output.getvalue()
+    )
+    searched = Product.objects.get(name="searched")
+    assert [product.name for product in searched.ranked_substitutes()] == [
+        "spread",
+        "drink",
+        "vegetal",
+        "plain",
+    ]
+    scores = list(searched.ranked.values_list("score", flat=True))
+    assert scores == sorted(scores, reverse=True)
+    assert scores[-1] == 0
+
+
+@pytest.mark.django_db
+def test_import_keeps_the_ranking_chosen(tmp_path, off_product, settings, monkeypatch):
+    """Valid if import_off ranks the substitutes with the ranking
+    of the settings, as compute_substitutes does, and not with the overlap
+
+    Args:
+        tmp_path (fixture): temporary directory of the dump
+        off_product (fixture): builds the products of Open Food Facts
+        settings (fixture): settings of the test
+        monkeypatch (fixture): records the rankings
+    """
+    calls = []
+    monkeypatch.setattr(idf, "rebuild", lambda **options: calls.append(options) or 0)
+    monkeypatch.setattr(substitutes, "rebuild", lambda **options: 1 / 0)
+    settings.SUBSTITUTE_RANKING = "idf"
+    dump = tmp_path / "products.jsonl"
+    dump.write_text(json.dumps(off_product("p", categories="a,b,c,d")))
+    call_command("import_off", from_dump=str(dump), stdout=io.StringIO())
+    call_command("compute_substitutes", stdout=io.StringIO())
+    assert calls == [
+        {"limit": substitutes.SUBSTITUTES_PER_PRODUCT},
+        {"limit": substitutes.SUBSTITUTES_PER_PRODUCT, "memory": 256, "max_df": 0.05},
+    ]
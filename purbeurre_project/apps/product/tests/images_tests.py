@@ -0,0 +1,137 @@
+"""Tests of the local mirror of the product images
+"""
+import io
+import os
+
+import pytest
+from django.core.management import call_command
+from PIL import Image
+from product.importer.images import CARD_SIZE, make_thumbnails
+from product.importer.loaders import BulkLoader
+from product.models import Product
+
+
+def jpeg(width=800, height=600):
+    """Encode an image as Open Food Facts serves them
+
+    Args:
+        width (int, optional): width of the image. Defaults to 800.
+        height (int, optional): height of the image. Defaults to 600.
+
+    Returns:
+        bytes: content of a JPEG image
+    """
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    """Thumbnails written into a temporary MEDIA_ROOT
+
+    Args:
+        settings (fixture): settings of the tests
+        tmp_path (fixture): temporary directory
+
+    Returns:
+        Path: the temporary MEDIA_ROOT
+    """
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+
+def test_make_thumbnails_fits_the_card(media_root):
+    """Valid if an image is resized into fixed-size JPEG and WebP thumbnails
+
+    Args:
+        media_root (fixture): temporary MEDIA_ROOT
+    """
+    jpeg_path, webp_path = make_thumbnails(jpeg(), 257)
+    assert jpeg_path == os.path.join("thumbnails", "01", "257.jpg")
+    for path, image_format in ((jpeg_path, "JPEG"), (webp_path, "WEBP")):
+        with Image.open(media_root / path) as thumbnail:
+            assert thumbnail.format == image_format
+            assert thumbnail.size == CARD_SIZE
+    assert not [
+        name
+        for name in os.listdir(media_root / "thumbnails" / "01")
+        if name.endswith(".tmp")
+    ]
+
+
+@pytest.mark.django_db
+def test_mirror_images_skips_unchanged_images(stand_in, media_root):
+    """Valid if images are mirrored once, then skipped while they do not change
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        media_root (fixture): temporary MEDIA_ROOT
+    """
+    stand_in.etag = '"v1"'
+    stand_in.routes["/images/p1.jpg"] = [(200, jpeg())]
+    stand_in.routes["/images/missing.jpg"] = [(404, b"")]
+    for name in ("p1", "missing"):
+        Product.objects.create(
+            name=name,
+            nutrition_grade="a",
+            energy_100g=1,
+            energy_unit="kJ",
+            carbohydrates_100g=1,
+            sugars_100g=1,
+            fat_100g=1,
+            saturated_fat_100g=1,
+            salt_100g=1,
+            sodium_100g=1,
+            fiber_100g=1,
+            proteins_100g=1,
+            url=f"http://{name}.fr",
+            image_url=f"{stand_in.url}/images/{name}.jpg",
+        )
+    output = io.StringIO()
+    call_command("mirror_images", stdout=output)
+    assert "1 images mirrored, 0 unchanged, 1 failed" in output.getvalue()
+    product = Product.objects.get(name="p1")
+    assert product.card_image == f"/media/{product.thumbnail}"
+    assert product.card_image_webp.endswith(".webp")
+    assert (media_root / product.thumbnail).exists()
+    assert Product.objects.get(name="missing").card_image.endswith("missing.jpg")
+
+    output = io.StringIO()
+    call_command("mirror_images", stdout=output)
+    assert "0 images mirrored, 1 unchanged, 1 failed" in output.getvalue()
+
+
+@pytest.mark.django_db
+def test_import_keeps_mirrored_thumbnails():
+    """Valid if updating a product by import_off leaves its thumbnails"""
+    data = {
+        "product_name": "p1",
+        "nutrition_grade_fr": "a",
+        "url": "http://p1.fr",
+        "image_front_url": "http://p1.fr/product.jpg",
+        "categories": "foo",
+        "nutriments": {
+            "energy_value": "1",
+            "energy_unit": "gr",
+            "carbohydrates_100g": "2",
+            "sugars_100g": "2",
+            "fat_100g": "2",
+            "saturated-fat_100g": "2",
+            "salt_100g": "2",
+            "sodium_100g": "2",
+            "fiber_100g": "2",
+            "proteins_100g": "2",
+        },
+    }
+    loader = BulkLoader()
+    loader.add(data)
+    loader.flush()
+    assert Product.objects.get(name="p1").thumbnail == ""
+    Product.objects.filter(name="p1").update(thumbnail="thumbnails/01/1.jpg")
+    data["nutrition_grade_fr"] = "b"
+    loader.add(data)
+    loader.flush()
+    product = Product.objects.get(name="p1")
+    assert product.nutrition_grade == "b"
+    assert product.thumbnail == "thumbnails/01/1.jpg"
@@ -0,0 +1,98 @@
+"""Tests of the checkpoint journal used to resume an interrupted import
+"""
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+from django.core.management import call_command
+from product.importer import journal
+from product.importer.journal import Checkpoint
+from product.management.commands.import_off import Command as command_import
+from product.models import ImportCheckpoint, Product
+
+
+def requested(stand_in):
+    """Categories and pages requested to the stand-in
+
+    Args:
+        stand_in (ThreadingHTTPServer): local Open Food Facts server
+
+    Returns:
+        list: tuples of category name and page
+    """
+    calls = []
+    for call in stand_in.calls:
+        query = parse_qs(urlsplit(call).query)
+        if "tag_0" in query:
+            calls.append((query["tag_0"][0], query.get("page", ["1"])[0]))
+    return calls
+
+
+@pytest.mark.django_db
+def test_journal_keeps_units_only_when_resuming():
+    """Valid if the journal is emptied by a new import and kept by a resume"""
+    journal.record(Checkpoint("foo", 1, True))
+    journal.record(Checkpoint("bar", 3, False))
+    assert journal.start(resume=True) == ({"foo"}, {"bar": 3})
+    assert journal.start(resume=False) == (set(), {})
+    assert not ImportCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+def test_interrupted_import_is_resumed(stand_in, monkeypatch, off_product):
+    """Valid if a resumed import skips the categories committed before a crash
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        monkeypatch (fixture): patch the command to simulate a timeout
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.routes["/categories.json"] = [
+        (
+            200,
+            {
+                "tags": [
+                    {"name": "foo", "products": 5000},
+                    {"name": "bar", "products": 5000},
+                ]
+            },
+        )
+    ]
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": [off_product("test")]})]
+    get_products = command_import.get_products_for_category
+
+    def timeout_on_bar(self, category_name):
+        if category_name == "bar":
+            raise requests.Timeout("Open Food Facts timeout")
+        return get_products(self, category_name)
+
+    monkeypatch.setattr(command_import, "get_products_for_category", timeout_on_bar)
+    with pytest.raises(requests.Timeout):
+        call_command("import_off", base_url=stand_in.url, workers=1)
+    assert ImportCheckpoint.objects.get(category="foo").done
+    assert not ImportCheckpoint.objects.filter(category="bar").exists()
+    assert Product.objects.filter(name="test").exists()
+
+    monkeypatch.undo()
+    stand_in.calls.clear()
+    call_command("import_off", base_url=stand_in.url, resume=True)
+    assert requested(stand_in) == [("bar", "1")]
+    assert not ImportCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+def test_streamed_import_resumes_after_last_page(stand_in, off_product):
+    """Valid if a streamed import restarts after the last page committed
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.routes["/categories.json"] = [
+        (200, {"tags": [{"name": "foo", "products": 5000}]})
+    ]
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": [off_product("test")]})]
+    ImportCheckpoint.objects.create(category="foo", page=2)
+    call_command("import_off", base_url=stand_in.url, stream=True, resume=True)
+    assert requested(stand_in) == [("foo", "3")]
+    assert Product.objects.filter(name="test").exists()
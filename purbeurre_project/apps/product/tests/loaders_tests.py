@@ -0,0 +1,324 @@
+"""Tests of the loaders writing Open Food Facts products in database
+"""
+import json
+import threading
+
+import pytest
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from psycopg2.errorcodes import DEADLOCK_DETECTED
+from product.importer.loaders import BulkLoader, CopyLoader, copy_buffer, product_values
+from product.management.commands.import_off import Command as command_import
+from product.models import Category, Product
+
+
+def test_product_values_converts_columns(off_product):
+    """Valid if Open Food Facts values are prepared for the columns
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    values = product_values(off_product("test", categories="foo,bar"))
+    assert values["energy_100g"] == 1
+    assert values["salt_100g"] == 2.0
+    assert values["image_url"] == "http://test.fr/product.jpg"
+
+
+def test_product_values_rejects_missing_column(off_product):
+    """Valid if a product without a required value is rejected
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    data = off_product("test", categories="foo,bar")
+    del data["nutriments"]["energy_unit"]
+    with pytest.raises(ValueError):
+        product_values(data)
+
+
+@pytest.mark.django_db
+def test_bulk_loader_writes_a_chunk_in_few_queries(
+    django_assert_max_num_queries, off_product
+):
+    """Valid if a chunk of products is written with a constant number of queries
+
+    Args:
+        django_assert_max_num_queries (fixture): count the queries of a block
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    loader = BulkLoader(batch_size=50)
+    with django_assert_max_num_queries(8):
+        for index in range(50):
+            loader.add(off_product(f"product{index}", categories="foo,bar"))
+    assert loader.created == 50
+    assert Product.objects.count() == 50
+    assert Category.objects.count() == 2
+    product = Product.objects.get(name="product7")
+    assert {categ.name for categ in product.categories.all()} == {"foo", "bar"}
+
+
+@pytest.mark.django_db
+def test_bulk_loader_updates_existing_product(off_product):
+    """Valid if a product with an existing name is updated
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    loader = BulkLoader()
+    loader.add(off_product("test", grade="a", categories="foo"))
+    loader.flush()
+    loader.add(off_product("test", grade="b", categories="foo,bar"))
+    loader.flush()
+    product = Product.objects.get(name="test")
+    assert loader.created == 1
+    assert loader.updated == 1
+    assert product.nutrition_grade == "b"
+    assert product.categories.count() == 2
+
+
+@pytest.mark.django_db
+def test_bulk_loader_skips_unchanged_product(off_product):
+    """Valid if a product whose content did not change is not written again
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    loader = BulkLoader()
+    loader.add(off_product("test", categories="foo,bar"))
+    loader.flush()
+    Product.objects.filter(name="test").update(energy_unit="kcal")
+    loader.add(off_product("test", categories="foo,bar"))
+    loader.flush()
+    assert loader.unchanged == 1
+    assert loader.updated == 0
+    assert Product.objects.get(name="test").energy_unit == "kcal"
+
+
+@pytest.mark.django_db
+def test_update_product_skips_unchanged_product(off_product):
+    """Valid if the row loader does not rewrite a product which did not change
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    command = command_import()
+    command.populate_products([off_product("test", categories="foo,bar")])
+    Product.objects.filter(name="test").update(energy_unit="kcal")
+    command.populate_products([off_product("test", categories="foo,bar")])
+    assert Product.objects.get(name="test").energy_unit == "kcal"
+    command.populate_products([off_product("test", grade="c", categories="foo,bar")])
+    product = Product.objects.get(name="test")
+    assert product.nutrition_grade == "c"
+    assert product.energy_unit == "gr"
+
+
+@pytest.mark.django_db
+def test_bulk_loader_skips_only_conflicting_product(off_product):
+    """Valid if a product breaking the url constraint does not stop its chunk
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    Product.objects.create(
+        **product_values(
+            off_product("first", url="http://same.fr", categories="foo,bar")
+        )
+    )
+    loader = BulkLoader()
+    loader.add(off_product("second", url="http://same.fr", categories="foo,bar"))
+    loader.add(off_product("third", categories="foo,bar"))
+    loader.flush()
+    assert loader.failed == 1
+    assert loader.created == 1
+    assert Product.objects.filter(name="third").exists()
+    assert not Product.objects.filter(name="second").exists()
+
+
+def test_copy_buffer_keeps_nulls_apart_from_empty_strings():
+    """Valid if COPY can tell a NULL from an empty or quoted string"""
+    buffer = copy_buffer([(None, "", 'say "hi"', 1.5)])
+    assert buffer.getvalue() == ',"","say ""hi""",1.5\n'
+
+
+def load_snapshot(loader_class, off_product):
+    """Load the same rounds of products with a loader and read them back
+
+    Args:
+        loader_class (class): loader writing the products
+        off_product (function): builds the products of Open Food Facts
+
+    Returns:
+        tuple: counters of the loader and content of the product tables
+    """
+    without_url = off_product("nourl", categories="foo,bar")
+    del without_url["url"]
+    rounds = [
+        [
+            off_product("first", categories="foo,bar"),
+            off_product("second", categories="foo"),
+            without_url,
+        ],
+        [
+            off_product("first", grade="c", categories="bar,baz"),
+            off_product("second", categories="foo"),
+            off_product("third", categories=""),
+        ],
+    ]
+    loader = loader_class(batch_size=2)
+    for products in rounds:
+        for data in products:
+            loader.add(data)
+        loader.flush()
+    products = {
+        product.name: (
+            product.url,
+            product.nutrition_grade,
+            product.salt_100g,
+            product.content_hash,
+            sorted(categ.name for categ in product.categories.all()),
+        )
+        for product in Product.objects.all()
+    }
+    return (loader.created, loader.updated, loader.unchanged, loader.failed), products
+
+
+@pytest.mark.django_db
+def test_copy_loader_matches_bulk_loader(off_product):
+    """Valid if the staging loader writes exactly what the bulk loader writes
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    bulk = load_snapshot(BulkLoader, off_product)
+    Product.objects.all().delete()
+    Category.objects.all().delete()
+    copy = load_snapshot(CopyLoader, off_product)
+    assert copy == bulk
+    assert bulk[0] == (4, 1, 1, 0)
+    assert bulk[1]["nourl"][0] is None
+
+
+@pytest.mark.django_db
+def test_copy_loader_skips_only_conflicting_product(off_product):
+    """Valid if a product breaking the url constraint does not stop its chunk
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    Product.objects.create(
+        **product_values(
+            off_product("first", url="http://same.fr", categories="foo,bar")
+        )
+    )
+    loader = CopyLoader()
+    loader.add(off_product("second", url="http://same.fr", categories="foo,bar"))
+    loader.add(off_product("third", categories="foo,bar"))
+    loader.flush()
+    assert loader.failed == 1
+    assert loader.created == 1
+    assert Product.objects.filter(name="third").exists()
+
+
+@pytest.mark.django_db
+def test_import_off_from_dump_with_copy_loader(tmp_path, off_product):
+    """Valid if import_off writes a dump through the staging loader
+
+    Args:
+        tmp_path (fixture): temporary directory of the dump
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    dump = tmp_path / "products.jsonl"
+    dump.write_text(
+        "\n".join(
+            json.dumps(off_product(f"p{i}", categories="foo,bar")) for i in range(3)
+        )
+    )
+    call_command("import_off", from_dump=str(dump), loader="copy")
+    assert Product.objects.count() == 3
+    assert Category.objects.count() == 2
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("loader_class", [BulkLoader, CopyLoader])
+def test_shards_write_overlapping_chunks(loader_class, off_product):
+    """Valid if two shards writing the same products and categories,
+    received in opposite orders, lock them in the same order
+
+    Args:
+        loader_class (class): loader of the shards
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    products = [
+        off_product(f"p{index}", categories=f"c{index % 7},c{(index + 1) % 7},all")
+        for index in range(200)
+    ]
+    barrier = threading.Barrier(2)
+    failures = []
+
+    def shard(received):
+        loader = loader_class(batch_size=len(received) + 1)
+        try:
+            for data in received:
+                loader.add(data)
+            barrier.wait(5)
+            loader.flush()
+        except Exception as exx:  # pylint: disable=broad-except
+            failures.append(exx)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=shard, args=(received,))
+        for received in (products, products[::-1])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert failures == []
+    assert Product.objects.count() == 200
+    assert Category.objects.count() == 8
+    assert Product.categories.through.objects.count() == 600
+
+
+class Deadlock(Exception):
+    """Error of the driver for a transaction aborted by a deadlock"""
+
+    pgcode = DEADLOCK_DETECTED
+
+
+@pytest.mark.django_db
+def test_bulk_loader_retries_an_aborted_chunk(off_product, monkeypatch):
+    """Valid if a chunk aborted by a deadlock is written again, and another
+    operational error is raised
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+        monkeypatch (fixture): aborts the first attempts
+    """
+    write = BulkLoader.write
+    attempts = []
+
+    def aborted(loader, rows):
+        attempts.append(len(rows))
+        if len(attempts) == 1:
+            raise OperationalError("deadlock detected") from Deadlock()
+        return write(loader, rows)
+
+    monkeypatch.setattr(BulkLoader, "write", aborted)
+    loader = BulkLoader(backoff=0)
+    loader.add(off_product("first", categories="foo,bar"))
+    loader.add(off_product("second", categories="foo,bar"))
+    loader.flush()
+    assert attempts == [2, 2]
+    assert loader.created == 2
+
+    def broken(loader, rows):
+        attempts.append(len(rows))
+        raise OperationalError("server closed the connection")
+
+    monkeypatch.setattr(BulkLoader, "write", broken)
+    loader.add(off_product("third", categories="foo"))
+    with pytest.raises(OperationalError):
+        loader.flush()
+    assert attempts == [2, 2, 1]
@@ -0,0 +1,106 @@
+"""Tests of the approximate substitute search through LSH buckets
+"""
+import io
+import json
+
+import numpy as np
+import pytest
+from django.core.management import call_command
+from product.importer.idf import CategoryMatrix
+from product.importer.lsh import buckets, signatures
+from product.models import Product
+
+
+def test_buckets_follow_the_category_sets():
+    """Valid if equal category sets share every bucket, disjoint sets none,
+    and a product without categories has no signature"""
+    matrix = CategoryMatrix(
+        np.array([1, 2, 3, 4, 5]),
+        np.array([97] * 5),
+        np.array([0] * 5),
+        np.array(
+            [(1, 10), (1, 11), (1, 12), (2, 12), (2, 11), (2, 10), (3, 20), (3, 21)]
+            + [(5, 10), (5, 11), (5, 12), (5, 13)]
+        ),
+    )
+    values = buckets(signatures(matrix, 16, 0, 5), 8, 2)
+    assert values.shape == (5, 8)
+    assert (values[0] == values[1]).all()
+    assert not (values[0] == values[2]).any()
+    assert len(set(values[0])) == 8
+    assert (signatures(matrix, 16, 3, 4) == 2**31 - 1).all()
+    assert (signatures(matrix, 16, 1, 3) == signatures(matrix, 16, 0, 5)[1:3]).all()
+
+
+@pytest.fixture
+def catalogue(random_catalogue):
+    """Products drawn from a few families of overlapping categories,
+    with distinct energies so that no substitutes tie
+
+    Args:
+        random_catalogue (fixture): creates the products
+
+    Returns:
+        list: the products
+    """
+
+    def draw(generator, categories):
+        first = generator.randrange(5) * 6
+        chosen = generator.sample(categories[first:][:6], generator.randint(4, 6))
+        return set(chosen + generator.sample(categories, 1))
+
+    return random_catalogue(
+        17, 120, 30, lambda generator, size: generator.sample(range(1000), size), draw
+    )
+
+
+@pytest.mark.django_db
+def test_similar_substitutes_approach_the_substitutes(catalogue):
+    """Valid if the LSH search finds only true substitutes, and most of them
+
+    Args:
+        catalogue (fixture): products in families of categories
+    """
+    output = io.StringIO()
+    call_command("build_lsh", stdout=output)
+    assert f"{len(catalogue)} products indexed" in output.getvalue()
+    found = expected = 0
+    for product in Product.objects.all():
+        assert len(product.lsh_buckets) == 32
+        exact = set(product.substitutes().values_list("id", flat=True))
+        similar = set(product.similar_substitutes().values_list("id", flat=True))
+        fewer = set(product.similar_substitutes(bands=2).values_list("id", flat=True))
+        assert fewer <= similar
+        assert similar <= exact
+        found += len(similar)
+        expected += len(exact)
+    assert expected and found / expected > 0.9
+
+
+@pytest.mark.django_db
+def test_product_without_buckets_falls_back_on_the_query(catalogue):
+    """Valid if a product imported since the last build finds its substitutes
+
+    Args:
+        catalogue (fixture): products in families of categories
+    """
+    product = Product.objects.get(pk=catalogue[0].pk)
+    assert product.lsh_buckets == []
+    assert list(product.similar_substitutes()) == list(product.substitutes())
+
+
+@pytest.mark.django_db
+def test_benchmark_lsh_reports_the_recall(catalogue):
+    """Valid if the benchmark measures the recall of each number of bands
+
+    Args:
+        catalogue (fixture): products in families of categories
+    """
+    call_command("build_lsh", stdout=io.StringIO())
+    output = io.StringIO()
+    call_command("benchmark_lsh", samples=20, bands=[1, 32], stdout=output)
+    result = json.loads(output.getvalue())
+    assert result["exact"]["count"] == 20
+    assert result["lsh"]["1"]["recall"] <= result["lsh"]["32"]["recall"]
+    assert result["lsh"]["32"]["recall"] > 0.9
+    assert result["lsh"]["32"]["latency"]["count"] == 20
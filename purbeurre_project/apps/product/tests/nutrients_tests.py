@@ -0,0 +1,164 @@
+"""Tests of the nearest substitutes by nutriments
+"""
+import threading
+
+import pytest
+from django.urls import reverse
+from product import bitsets, nutrients
+from product.bitsets import SubstituteIndex
+from product.models import Category, Product
+from product.nutrients import NutrientIndex
+
+
+def nutriments(sugars=10, fat=10, salt=1):
+    """Nutriments for 100g of a spread
+
+    Args:
+        sugars (int, optional): sugars per 100g. Defaults to 10.
+        fat (int, optional): fat per 100g. Defaults to 10.
+        salt (int, optional): salt per 100g. Defaults to 1.
+
+    Returns:
+        dictionnary: values for 100g, by field of the product
+    """
+    return {
+        "carbohydrates_100g": sugars,
+        "sugars_100g": sugars,
+        "fat_100g": fat,
+        "saturated_fat_100g": fat / 2,
+        "salt_100g": salt,
+        "sodium_100g": salt / 2.5,
+        "proteins_100g": 5,
+    }
+
+
+@pytest.fixture
+def catalogue(make_product):
+    """Spreads, and products of other categories
+
+    Args:
+        make_product (fixture): creates the products
+
+    Returns:
+        Product: the spread whose substitutes are searched
+    """
+    spreads = [Category.objects.create(name=f"spread{index}") for index in range(4)]
+    searched = make_product("searched", "e", 1000, spreads, **nutriments(55, 30))
+    make_product("close", "d", 1000, spreads, **nutriments(50, 28))
+    make_product("lighter", "a", 1000, spreads, **nutriments(5, 2, 0))
+    make_product("twin", "c", 1000, spreads, **nutriments(55, 30))
+    make_product(
+        "unrelated", "a", 1000, [Category.objects.create(name="drinks")], **nutriments()
+    )
+    return searched
+
+
+@pytest.mark.django_db
+def test_nearest_substitutes_follow_the_nutriments(catalogue):
+    """Valid if the substitutes sharing categories come the nearest first
+
+    Args:
+        catalogue (fixture): spread whose substitutes are searched
+    """
+    index = NutrientIndex.load(SubstituteIndex.load())
+    names = dict(Product.objects.values_list("id", "name"))
+    nearest = index.nearest(catalogue.pk)
+    assert [names[product_id] for product_id in nearest] == [
+        "twin",
+        "close",
+        "lighter",
+    ]
+    assert [names[product_id] for product_id in index.nearest(catalogue.pk, 1)] == [
+        "twin"
+    ]
+    lighter = Product.objects.get(name="lighter")
+    assert index.nearest(lighter.pk) == []
+
+
+@pytest.mark.django_db
+def test_substitute_view_serves_the_nearest(catalogue, client, monkeypatch):
+    """Valid if the substitute page ranks by nutriments on demand
+
+    Args:
+        catalogue (fixture): spread whose substitutes are searched
+        client (fixture): client of the tests
+        monkeypatch (fixture): restores the indexes of the worker
+    """
+    loaded = NutrientIndex.load(SubstituteIndex.load())
+    monkeypatch.setattr(bitsets, "_index", loaded.index)
+    monkeypatch.setattr(nutrients, "_nutrient_index", loaded)
+    url = reverse("substitute", args=[catalogue.pk])
+    response = client.get(url, {"mode": "nutrients"})
+    assert response.status_code == 200
+    assert [item.name for item in response.context["object_list"]] == [
+        "twin",
+        "close",
+        "lighter",
+    ]
+    assert b"Classer par Nutri-score" in response.content
+    response = client.get(url)
+    assert [item.name for item in response.context["object_list"]] == [
+        "lighter",
+        "twin",
+        "close",
+    ]
+
+
+@pytest.mark.django_db
+def test_stale_nutriments_are_served_while_refreshed(catalogue, monkeypatch):
+    """Valid if the nutriments of a replaced category index are served with
+    their own category index, while a single thread loads the new ones
+
+    Args:
+        catalogue (fixture): spread whose substitutes are searched
+        monkeypatch (fixture): restores the indexes of the worker
+    """
+    index = SubstituteIndex.load()
+    stale = NutrientIndex.load(index)
+    fresh = NutrientIndex.load(SubstituteIndex.load())
+    monkeypatch.setattr(bitsets, "_index", fresh.index)
+    monkeypatch.setattr(nutrients, "_nutrient_index", stale)
+    released = threading.Event()
+    loads = []
+
+    def load(index):
+        loads.append(threading.current_thread())
+        released.wait(5)
+        return fresh if index is fresh.index else None
+
+    monkeypatch.setattr(NutrientIndex, "load", load)
+    assert nutrients.get_nutrient_index() is stale
+    assert nutrients.get_nutrient_index() is stale
+    released.set()
+    loads[0].join(5)
+    assert nutrients.get_nutrient_index() is fresh
+    assert len(loads) == 1
+
+
+@pytest.mark.django_db
+def test_first_nutriments_are_loaded_aside(catalogue, monkeypatch):
+    """Valid if the first requests find the substitutes by the query, while
+    a single thread loads the nutriments
+
+    Args:
+        catalogue (fixture): spread whose substitutes are searched
+        monkeypatch (fixture): restores the indexes of the worker
+    """
+    loaded = NutrientIndex.load(SubstituteIndex.load())
+    monkeypatch.setattr(bitsets, "_index", loaded.index)
+    monkeypatch.setattr(nutrients, "_nutrient_index", None)
+    released = threading.Event()
+    loads = []
+
+    def load(index):
+        loads.append(threading.current_thread())
+        released.wait(5)
+        return loaded if index is loaded.index else None
+
+    monkeypatch.setattr(NutrientIndex, "load", load)
+    assert nutrients.get_nutrient_index() is None
+    assert list(nutrients.find_nearest(catalogue)) == list(catalogue.substitutes())
+    released.set()
+    loads[0].join(5)
+    assert nutrients.get_nutrient_index() is loaded
+    assert len(loads) == 1 and loads[0] is not threading.current_thread()
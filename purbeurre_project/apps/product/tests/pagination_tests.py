@@ -0,0 +1,119 @@
+"""Tests of the keyset pagination of the substitutes
+"""
+from urllib.parse import quote
+
+import pytest
+from django.urls import reverse
+from product import bitsets, nutrients
+from product.importer.substitutes import rebuild
+from product.models import Category, Product
+from product.pagination import KeysetPaginator
+
+
+@pytest.fixture
+def catalogue(make_product):
+    """A product and twenty substitutes over the grades, two of them
+    with the grade and the energy of another
+
+    Args:
+        make_product (fixture): creates the products
+
+    Returns:
+        Product: the product whose substitutes are searched
+
+    """
+    categories = [Category.objects.create(name=f"c{index}") for index in range(4)]
+    searched = make_product("searched", "e", 5000, categories)
+    for index in range(18):
+        make_product(f"s{index}", "abcde"[index % 5], 100 * index, categories)
+    make_product("twin of s0", "a", 0, categories)
+    make_product("twin of s5", "a", 500, categories)
+    return Product.objects.get(pk=searched.pk)
+
+
+def walk(paginator):
+    """Pages of a paginator, forward to the last one then backward
+
+    Args:
+        paginator (KeysetPaginator): paginator walked
+
+    Returns:
+        tuple: ids of the pages forward, then backward
+    """
+    forward, page = [], paginator.page()
+    forward.append([item.pk for item in page])
+    while page.has_next():
+        page = paginator.page(page.next_cursor)
+        forward.append([item.pk for item in page])
+    backward = [[item.pk for item in page]]
+    while page.has_previous():
+        page = paginator.page(page.previous_cursor)
+        backward.append([item.pk for item in page])
+    return forward, backward
+
+
+@pytest.mark.django_db
+def test_pages_follow_the_substitutes(catalogue):
+    """Valid if the pages of the query and of the ranked substitutes hold
+    each substitute once, in order, forward and backward
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+    """
+    expected = [item.pk for item in catalogue.substitutes()]
+    assert len(expected) == 18
+    forward, backward = walk(KeysetPaginator(catalogue.substitutes(), 4))
+    assert [len(ids) for ids in forward] == [4, 4, 4, 4, 2]
+    assert sum(forward, []) == expected
+    assert backward == forward[::-1]
+    rebuild()
+    product = Product.objects.get(pk=catalogue.pk)
+    forward, backward = walk(KeysetPaginator(product.ranked_substitutes(), 4))
+    assert sum(forward, []) == expected
+    assert backward == forward[::-1]
+    forward, backward = walk(KeysetPaginator(bitsets.SubstituteList(expected), 5))
+    assert sum(forward, []) == expected
+    assert backward == forward[::-1]
+
+
+@pytest.mark.django_db
+def test_substitute_view_pages_by_cursor(catalogue, client):
+    """Valid if the substitute page links the next page by its cursor,
+    and refuses an altered cursor
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+        client (fixture): client of the tests
+    """
+    url = reverse("substitute", args=[catalogue.pk])
+    response = client.get(url)
+    page = response.context["page_obj"]
+    assert response.context["is_paginated"]
+    assert not page.has_previous()
+    assert quote(page.next_cursor) in response.content.decode()
+    following = client.get(url, {"cursor": page.next_cursor})
+    names = [item.name for item in following.context["object_list"]]
+    assert names and not set(names) & {item.name for item in page}
+    assert following.context["page_obj"].has_previous()
+    assert client.get(url, {"cursor": page.next_cursor + "x"}).status_code == 404
+
+
+@pytest.mark.django_db
+def test_nearest_substitutes_page_by_offset(catalogue, client, monkeypatch):
+    """Valid if the nearest substitutes, held in memory, are paged too
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+        client (fixture): client of the tests
+        monkeypatch (fixture): restores the indexes of the worker
+    """
+    monkeypatch.setattr(bitsets, "_index", None)
+    monkeypatch.setattr(nutrients, "_nutrient_index", None)
+    url = reverse("substitute", args=[catalogue.pk])
+    response = client.get(url, {"mode": "nutrients"})
+    page = response.context["page_obj"]
+    assert f"mode=nutrients&cursor={quote(page.next_cursor)}" in (
+        response.content.decode()
+    )
+    following = client.get(url, {"mode": "nutrients", "cursor": page.next_cursor})
+    assert len(following.context["object_list"]) == 6
@@ -0,0 +1,93 @@
+"""Tests of the staged import pipeline
+"""
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from product.importer.pipeline import decode_page
+from product.models import CategoryListing, ImportCheckpoint, Product
+
+
+def test_decode_page_validates_and_normalizes(off_product):
+    """Valid if a page is split into rows, skipped products and errors
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    broken = off_product("broken")
+    broken["nutriments"]["energy_value"] = "lots"
+    body = json.dumps(
+        {"products": [off_product("good"), off_product("empty", fiber=0), broken]}
+    ).encode()
+    rows, skipped, errors, seconds = decode_page(body)
+    assert [values["name"] for values, _ in rows] == ["good"]
+    assert rows[0][1] == ["foo"]
+    assert skipped == 1
+    assert len(errors) == 1
+    assert seconds >= 0
+
+
+@pytest.mark.django_db
+def test_import_off_pipeline_walks_every_page(stand_in, off_product):
+    """Valid if the pipeline imports each page announced by the count
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.routes["/categories.json"] = [
+        (200, {"tags": [{"name": "foo", "products": 5000}]})
+    ]
+    stand_in.routes["/cgi/search.pl"] = [
+        (200, {"count": 600, "products": [off_product("p1"), off_product("p2")]}),
+        (200, {"count": 600, "products": [off_product("p3")]}),
+    ]
+    call_command("import_off", base_url=stand_in.url, pipeline=True, processes=2)
+    pages = [parse_qs(urlsplit(call).query)["page"] for call in stand_in.calls[1:]]
+    assert pages == [["1"], ["2"]]
+    assert set(Product.objects.values_list("name", flat=True)) == {"p1", "p2", "p3"}
+    assert not ImportCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+def test_import_off_pipeline_walks_past_an_unchanged_page(stand_in, off_product):
+    """Valid if a delta import goes on after a page answered by a 304,
+    importing the following pages that changed, up to the last one
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.etag = '"v1"'
+    stand_in.routes["/categories.json"] = [
+        (200, {"tags": [{"name": "foo", "products": 5000}]})
+    ]
+    stand_in.routes["/cgi/search.pl"] = [
+        (200, {"count": 600, "products": [off_product("p1"), off_product("p2")]}),
+        (200, {"count": 600, "products": [off_product("p3")]}),
+    ]
+    call_command("import_off", base_url=stand_in.url, pipeline=True, delta=True)
+    assert Product.objects.count() == 3
+    # the second page changed since it was answered
+    CategoryListing.objects.filter(url__contains="page=2").update(etag='"v0"')
+    stand_in.routes["/cgi/search.pl"] = [
+        (200, {"count": 600, "products": [off_product("p3"), off_product("p4")]}),
+    ]
+    stand_in.calls.clear()
+    call_command("import_off", base_url=stand_in.url, pipeline=True, delta=True)
+    pages = [
+        parse_qs(urlsplit(call).query)["page"]
+        for call in stand_in.calls
+        if call.startswith("/cgi/search.pl")
+    ]
+    assert pages == [["1"], ["2"]]
+    assert Product.objects.filter(name="p4").exists()
+    assert not ImportCheckpoint.objects.exists()
+
+
+def test_import_off_pipeline_needs_bulk_loader():
+    """Valid if the pipeline refuses the row loader"""
+    with pytest.raises(CommandError):
+        call_command("import_off", pipeline=True, loader="row")
@@ -0,0 +1,141 @@
+"""Tests of the plans of the substitute, search and favorites queries
+on a large catalogue
+"""
+import io
+import json
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from product import plans
+from product.importer.substitutes import refresh_categories
+from product.models import Product
+from product.search import refresh_vectors
+from product.views import SearchResultsView
+
+PRODUCTS = 50000
+CATEGORIES = 3000
+CUSTOMERS = 2000
+
+
+@pytest.fixture
+def large_catalogue():
+    """Products in families of categories, plus a few generic categories
+    shared by most of them, and the favorites of many customers
+
+    Returns:
+        tuple: a product with generic categories, the customer with
+        the most favorites
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT setseed(0.17)")
+        cursor.execute(
+            "INSERT INTO product_category (id, name) "
+            "SELECT g, 'c' || g FROM generate_series(1, %s) g",
+            [CATEGORIES],
+        )
+        cursor.execute(
+            "INSERT INTO product_product (id, name, nutrition_grade, energy_100g, "
+            "energy_unit, carbohydrates_100g, sugars_100g, fat_100g, "
+            "saturated_fat_100g, salt_100g, sodium_100g, fiber_100g, "
+            "proteins_100g, url, image_url, content_hash) "
+            "SELECT g, 'p' || g, chr(97 + (random() * 4)::int), "
+            "(random() * 3000)::int, 'kJ', 1, 1, 1, 1, 1, 1, 1, 1, "
+            "'http://p' || g || '.fr', 'http://p' || g || '.fr/product.jpg', '' "
+            "FROM generate_series(1, %s) g",
+            [PRODUCTS],
+        )
+        # ten categories per family, the first twenty are generic
+        cursor.execute(
+            "INSERT INTO product_product_categories (product_id, category_id) "
+            "SELECT DISTINCT product_id, category_id FROM ("
+            "SELECT g AS product_id, 21 + (g * 7919 %% 298) * 10 + k AS category_id "
+            "FROM generate_series(1, %s) g, generate_series(0, 9) k "
+            "WHERE random() < 0.5 "
+            "UNION ALL SELECT g, 1 + floor(power(random(), 3) * 20)::int "
+            "FROM generate_series(1, %s) g, generate_series(1, 2)"
+            ") links",
+            [PRODUCTS, PRODUCTS],
+        )
+        cursor.execute(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "SELECT g, '', false, 'u' || g, '', '', '', false, true, now() "
+            "FROM generate_series(1, %s) g",
+            [CUSTOMERS],
+        )
+        cursor.execute(
+            "INSERT INTO product_customerproduct (customer_id, product_id, substitute_id) "
+            "SELECT DISTINCT 1 + g %% %s, 1 + (g * 31 %% %s), 1 + (g * 97 %% %s) "
+            "FROM generate_series(1, %s) g",
+            [CUSTOMERS, PRODUCTS, PRODUCTS, CUSTOMERS * 10],
+        )
+        for table in ("product_category", "product_product", "auth_user"):
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT max(id) FROM {table}))"
+            )
+    refresh_categories()
+    refresh_vectors()
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    product = Product.objects.filter(category_ids__overlap=[1, 2]).first()
+    return product, User.objects.get(pk=1)
+
+
+@pytest.mark.django_db
+def test_plans_keep_to_the_indexes(large_catalogue):
+    """Valid if no query of the product pages scans a large table
+    sequentially or costs more than its budget, each budget being below
+    the cost of a sequential scan, checked by the command too
+
+    Args:
+        large_catalogue (fixture): product and customer of the queries
+    """
+    product, user = large_catalogue
+    scan = plans.explain(Product.objects.filter(sugars_100g__gt=0))["Plan"]
+    for name, budget in plans.PLAN_BUDGETS.items():
+        assert budget < scan["Total Cost"], name
+    report = plans.check(product, user, "p4242")
+    assert set(report) == {"substitutes", "search", "fulltext", "favorites"}
+    for name, result in report.items():
+        assert result["regressions"] == [], name
+        assert result["shared_hit_blocks"] + result["shared_read_blocks"] > 0
+    output = io.StringIO()
+    call_command("check_plans", term="p4242", stdout=output)
+    assert json.loads(output.getvalue())["search"]["regressions"] == []
+
+
+@pytest.mark.django_db
+def test_regressions_find_sequential_scans():
+    """Valid if a plan scanning the products sequentially regresses"""
+    plan = plans.explain(Product.objects.filter(sugars_100g__gt=0))["Plan"]
+    assert plans.regressions(plan, -1) == [
+        "Seq Scan on product_product",
+        f"cost {plan['Total Cost']} over -1",
+    ]
+    assert plans.regressions(plan, plan["Total Cost"]) == [
+        "Seq Scan on product_product"
+    ]
+
+
+@pytest.mark.django_db
+def test_substring_search_reads_the_trigram_index(large_catalogue):
+    """Valid if the search of a rare substring reads the trigram index
+    of the names, on a Postgres with pg_trgm
+
+    Args:
+        large_catalogue (fixture): products searched
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'product_product_name_trgm'"
+        )
+        if cursor.fetchone() is None:
+            pytest.skip("pg_trgm is not available on this Postgres")
+    queryset = plans.view_queryset(SearchResultsView, q="4242")
+    plan = plans.explain(queryset)["Plan"]
+    assert "product_product_name_trgm" in [
+        node.get("Index Name") for node in plans.nodes(plan)
+    ]
@@ -0,0 +1,97 @@
+"""Tests of the profiling report of import_off
+"""
+import json
+
+import pytest
+from django.core.management import call_command
+from product.importer.fetch import OffClient
+from product.importer.report import ImportReport, StageCounter, percentiles
+
+
+def test_stage_counter_rate():
+    """Valid if a stage reports its throughput"""
+    counter = StageCounter("decode")
+    counter.add(items=10, size=100, seconds=2)
+    counter.add(items=10, seconds=2)
+    assert counter.rate() == 5
+    assert str(counter) == "decode: 20 in 4.0s (5.0/s, 100 bytes)"
+
+
+def test_percentiles_use_nearest_rank():
+    """Valid if latencies are summarized by nearest-rank percentiles"""
+    summary = percentiles([index / 100 for index in range(100, 0, -1)])
+    assert summary == {"count": 100, "p50": 0.5, "p90": 0.9, "p99": 0.99, "max": 1.0}
+    assert percentiles([]) == {"count": 0}
+
+
+def test_report_observes_client_responses(stand_in, off_product):
+    """Valid if the latency and the size of the responses are recorded
+    by category, streamed or not
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    stand_in.routes["/categories.json"] = [(200, {"tags": []})]
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": [off_product("p1")]})]
+    report = ImportReport()
+    client = OffClient(base_url=stand_in.url)
+    client.observer = report.observe
+    client.get("/categories.json")
+    list(client.iter_items("/cgi/search.pl?", {"tag_0": "foo"}, "products.item"))
+    http = report.as_dict()["http"]
+    assert set(http["categories"]) == {"/categories.json", "foo"}
+    assert http["categories"]["foo"]["latency"]["count"] == 1
+    assert http["categories"]["foo"]["wire_bytes"] > 0
+    assert report.stages["fetch"].items == 2
+
+
+def test_report_counts_wire_bytes(stand_in, off_product):
+    """Valid if a response read whole and a streamed response are counted
+    by the same unit, the compressed bytes received
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    products = [off_product(f"p{index}") for index in range(20)]
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": products})]
+    report = ImportReport()
+    client = OffClient(base_url=stand_in.url)
+    client.observer = report.observe
+    body = client.get("/cgi/search.pl?", {"tag_0": "whole"}).content
+    list(client.iter_items("/cgi/search.pl?", {"tag_0": "streamed"}, "products.item"))
+    http = report.as_dict()["http"]
+    whole = http["categories"]["whole"]["wire_bytes"]
+    assert whole == http["categories"]["streamed"]["wire_bytes"]
+    assert 0 < whole < len(body)
+    assert http["wire_bytes"] == 2 * whole
+
+
+@pytest.mark.django_db
+def test_import_off_writes_report(tmp_path, off_product):
+    """Valid if import_off --report writes a JSON report of the import
+
+    Args:
+        tmp_path (fixture): temporary directory of the dump and the report
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    dump = tmp_path / "products.jsonl"
+    products = [off_product(f"p{index}") for index in range(3)]
+    products[0]["nutriments"]["fiber_100g"] = 0
+    dump.write_text("\n".join(json.dumps(product) for product in products))
+    path = tmp_path / "report.json"
+    call_command("import_off", from_dump=str(dump), report=str(path))
+    report = json.loads(path.read_text())
+    assert report["products"] == {
+        "processed": 3,
+        "skipped": 1,
+        "created": 2,
+        "updated": 0,
+        "unchanged": 0,
+        "failed": 0,
+    }
+    assert report["stages"]["validate"]["items"] == 3
+    assert report["stages"]["write"]["items"] == 2
+    assert report["queries"]["count"] > 0
+    assert report["options"]["from_dump"] == str(dump)
@@ -0,0 +1,109 @@
+"""Tests of the full-text search of the product names
+"""
+import pytest
+from django.urls import reverse
+from product.models import Product
+from product.search import refresh_vectors, search_products
+
+
+@pytest.fixture
+def desserts(make_product):
+    """Desserts with and without accents in their names
+
+    Args:
+        make_product (fixture): creates the products
+
+    Returns:
+        list: names of the desserts
+
+    """
+    names = [
+        "Crème brûlée à la vanille",
+        "Crèmes dessert chocolat",
+        "Creme glacee vanille",
+        "Mousse au chocolat",
+        "Chocolat noir au chocolat",
+        "Œufs au lait",
+    ]
+    for name in names:
+        make_product(name)
+    return names
+
+
+def names(products):
+    """Names of products
+
+    Args:
+        products (QuerySet): products found
+
+    Returns:
+        list: names of the products, in order
+    """
+    return [product.name for product in products]
+
+
+@pytest.mark.django_db
+def test_search_folds_accents_and_ranks(desserts):
+    """Valid if a search finds the names whatever their accents and plurals,
+    the names holding the most terms first
+
+    Args:
+        desserts (fixture): names of the desserts
+    """
+    assert set(names(search_products("crème"))) == {
+        "Crème brûlée à la vanille",
+        "Crèmes dessert chocolat",
+        "Creme glacee vanille",
+    }
+    assert set(names(search_products("creme vanille"))) == {
+        "Creme glacee vanille",
+        "Crème brûlée à la vanille",
+    }
+    assert names(search_products("chocolat"))[0] == "Chocolat noir au chocolat"
+    assert names(search_products("CREMES -vanille")) == ["Crèmes dessert chocolat"]
+    assert names(search_products("oeuf")) == ["Œufs au lait"]
+    assert names(search_products("la")) == []
+    assert names(search_products(None)) == []
+
+
+@pytest.mark.django_db
+def test_vectors_follow_the_names(desserts):
+    """Valid if a product renamed through the ORM, or written without
+    its vector by the loaders, is found by its name
+
+    Args:
+        desserts (fixture): names of the desserts
+    """
+    product = Product.objects.get(name="Mousse au chocolat")
+    product.name = "Mousse au café"
+    product.save()
+    assert names(search_products("cafe")) == ["Mousse au café"]
+    product.energy_100g = 200
+    product.save(update_fields=["energy_100g"])
+    Product.objects.update(search_vector=None)
+    assert names(search_products("mousse")) == []
+    assert refresh_vectors() == len(desserts)
+    assert refresh_vectors() == 0
+    assert names(search_products("mousse")) == ["Mousse au café"]
+
+
+@pytest.mark.django_db
+def test_search_view_ranks_by_relevance(desserts, client, make_product):
+    """Valid if the search results are found by full text with mode=text,
+    and the pages keep the mode
+
+    Args:
+        desserts (fixture): names of the desserts
+        client (fixture): client of the tests
+        make_product (fixture): creates the products
+    """
+    for index in range(6):
+        make_product(f"Crème de marrons {index}")
+    url = reverse("search")
+    response = client.get(url, {"q": "creme", "mode": "text"})
+    assert response.context["mode"] == "text"
+    assert len(response.context["object_list"]) == 6
+    assert "mode=text&page=2" in response.content.decode()
+    following = client.get(url, {"q": "creme", "mode": "text", "page": 2})
+    assert len(following.context["object_list"]) == 3
+    assert client.get(url, {"q": "creme"}).context["object_list"].count() == 1
@@ -0,0 +1,156 @@
+"""Tests of the shadow catalogue swapped with the live tables
+"""
+import json
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from product.importer import shadow
+from product.importer.loaders import BulkLoader, product_values
+from product.models import Category, CustomerProduct, Product
+
+
+def catalogue_layout():
+    """Indexes, foreign keys and sequences of the live catalogue
+
+    Returns:
+        tuple: sorted index names, foreign keys referencing the products
+        with whether they are validated, and sequences owned by the tables
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() "
+            "AND tablename = ANY(%s) ORDER BY indexname",
+            [shadow.catalogue_tables()],
+        )
+        index_names = [name for name, in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname, convalidated FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = %s::regclass ORDER BY conname",
+            [Product._meta.db_table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            "SELECT pg_get_serial_sequence(name, 'id') FROM unnest(%s::text[]) name",
+            [shadow.catalogue_tables()],
+        )
+        return index_names, foreign_keys, cursor.fetchall()
+
+
+@pytest.fixture
+def favorite(off_product):
+    """A customer keeping a product and its substitute as favorite
+
+    Args:
+        off_product (fixture): builds the products of Open Food Facts
+
+    Returns:
+        CustomerProduct: favorite of the customer
+
+    """
+    product = Product.objects.create(
+        **product_values(off_product("wanted", "e", categories="foo,bar"))
+    )
+    substitute = Product.objects.create(
+        **product_values(off_product("healthy", categories="foo,bar"))
+    )
+    customer = User.objects.create_user(username="customer", password="secret")
+    return CustomerProduct.objects.create(
+        customer=customer, product=product, substitute=substitute
+    )
+
+
+@pytest.mark.django_db
+def test_shadow_catalogue_is_hidden_until_swapped(favorite, off_product, monkeypatch):
+    """Valid if readers keep the live catalogue while the shadow is built,
+    then see the whole new catalogue with the favorites still valid, their
+    foreign keys validated after the swap
+
+    Args:
+        favorite (fixture): favorite of a customer
+        off_product (fixture): builds the products of Open Food Facts
+        monkeypatch (fixture): follows the validation of the foreign keys
+    """
+    layout = catalogue_layout()
+    validate = shadow.validate
+    shadow.prepare()
+    with shadow.redirect():
+        loader = BulkLoader()
+        loader.add(off_product("wanted", grade="d", categories="foo,bar"))
+        loader.add(off_product("new", categories="baz"))
+        loader.flush()
+        assert Product.objects.count() == 3
+    assert Product.objects.count() == 2
+    assert Product.objects.get(name="wanted").nutrition_grade == "e"
+    shadow.analyze()
+    validated = []
+    monkeypatch.setattr(
+        shadow, "validate", lambda keys: validated.append(keys) or validate(keys)
+    )
+    shadow.swap()
+    assert {name for _, name in validated[0]} == {
+        name for table, name, _ in layout[1] if table not in shadow.catalogue_tables()
+    }
+    assert not shadow.exists()
+    assert Product.objects.get(pk=favorite.product_id).nutrition_grade == "d"
+    assert Product.objects.get(name="new").categories.get().name == "baz"
+    assert Category.objects.count() == 3
+    assert CustomerProduct.objects.get().substitute.name == "healthy"
+    assert catalogue_layout() == layout
+
+
+@pytest.mark.django_db
+def test_resumed_shadow_import_keeps_shadow_tables():
+    """Valid if a resumed import goes on with the shadow tables in progress"""
+    shadow.prepare()
+    with shadow.redirect():
+        Category.objects.create(name="foo")
+    shadow.prepare(resume=True)
+    with shadow.redirect():
+        assert Category.objects.filter(name="foo").exists()
+    shadow.prepare()
+    with shadow.redirect():
+        assert not Category.objects.exists()
+
+
+@pytest.mark.django_db
+def test_import_off_shadow_swaps_the_catalogue(
+    tmp_path, favorite, off_product, monkeypatch
+):
+    """Valid if import_off --shadow imports a dump through the shadow tables,
+    swapped in with the category arrays and the search vectors of the new
+    products stored already
+
+    Args:
+        tmp_path (fixture): temporary directory of the dump
+        favorite (fixture): favorite of a customer
+        off_product (fixture): builds the products of Open Food Facts
+        monkeypatch (fixture): checks the shadow tables before the swap
+    """
+    swap = shadow.swap
+    unrefreshed = []
+
+    def checked_swap():
+        with shadow.redirect():
+            unrefreshed.extend(
+                Product.objects.filter(name__in=["p0", "p1", "p2"])
+                .filter(Q(category_ids=[]) | Q(search_vector__isnull=True))
+                .values_list("name", flat=True)
+            )
+        swap()
+
+    monkeypatch.setattr(shadow, "swap", checked_swap)
+    dump = tmp_path / "products.jsonl"
+    dump.write_text(
+        "\n".join(
+            json.dumps(off_product(f"p{i}", categories="foo,bar")) for i in range(3)
+        )
+    )
+    call_command("import_off", from_dump=str(dump), loader="copy", shadow=True)
+    assert Product.objects.count() == 5
+    assert CustomerProduct.objects.filter(pk=favorite.pk).exists()
+    assert not shadow.exists()
+    assert unrefreshed == []
+    assert Product.objects.get(name="p0").category_ids
@@ -0,0 +1,82 @@
+"""Tests of the sharded imports and their advisory locks
+"""
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from product.importer.shards import in_shard, lock_key
+from product.models import ImportCheckpoint, Product
+
+
+def test_each_name_belongs_to_one_shard():
+    """Valid if the shards split the names without overlap"""
+    names = [f"category{index}" for index in range(100)]
+    owners = [
+        [index for index in range(3) if in_shard(name, 3, index)] for name in names
+    ]
+    assert all(len(owner) == 1 for owner in owners)
+    assert {owner[0] for owner in owners} == {0, 1, 2}
+
+
+@pytest.mark.django_db
+def test_import_off_refuses_to_overlap(other_node):
+    """Valid if an import does not start while another one runs
+
+    Args:
+        other_node (fixture): session of another node
+    """
+    other_node.execute("SELECT pg_advisory_lock(%s)", [lock_key("import_off")])
+    with pytest.raises(CommandError):
+        call_command("import_off", from_dump="unused.jsonl")
+    with pytest.raises(CommandError):
+        call_command("import_off", from_dump="unused.jsonl", shards=2)
+
+
+@pytest.mark.django_db
+def test_shards_run_together_but_not_twice(other_node, tmp_path):
+    """Valid if the shards of an import share the global lock,
+    while a shard cannot run twice
+
+    Args:
+        other_node (fixture): session of another node running the shard 1
+        tmp_path (fixture): temporary directory of the dump
+    """
+    other_node.execute("SELECT pg_advisory_lock_shared(%s)", [lock_key("import_off")])
+    other_node.execute("SELECT pg_advisory_lock(%s)", [lock_key("import_off", 2, 1)])
+    dump = tmp_path / "products.jsonl"
+    dump.write_text("")
+    call_command("import_off", from_dump=str(dump), shards=2, shard_index=0)
+    with pytest.raises(CommandError):
+        call_command("import_off", from_dump=str(dump), shards=2, shard_index=1)
+
+
+@pytest.mark.django_db
+def test_shard_imports_its_categories_only(stand_in, off_product):
+    """Valid if a shard requests its categories and leaves the journal
+    of the other shard
+
+    Args:
+        stand_in (fixture): local Open Food Facts server
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    names = [f"category{index}" for index in range(6)]
+    mine = [name for name in names if in_shard(name, 2, 0)]
+    others = [name for name in names if not in_shard(name, 2, 0)]
+    stand_in.routes["/categories.json"] = [
+        (200, {"tags": [{"name": name, "products": 5000} for name in names]})
+    ]
+    stand_in.routes["/cgi/search.pl"] = [(200, {"products": [off_product("p1")]})]
+    ImportCheckpoint.objects.create(category=others[0], page=1)
+    call_command("import_off", base_url=stand_in.url, shards=2, shard_index=0)
+    requested = [call for call in stand_in.calls if "tag_0" in call]
+    assert len(requested) == len(mine)
+    assert all(any(f"tag_0={name}&" in call for name in mine) for call in requested)
+    assert list(ImportCheckpoint.objects.values_list("category", flat=True)) == [
+        others[0]
+    ]
+    assert Product.objects.filter(name="p1").exists()
+
+
+def test_import_off_checks_shard_index():
+    """Valid if a shard index out of the shards is refused"""
+    with pytest.raises(CommandError):
+        call_command("import_off", shards=2, shard_index=2)
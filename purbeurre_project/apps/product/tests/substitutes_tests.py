@@ -0,0 +1,190 @@
+"""Tests of the ranked substitutes rebuilt after the imports
+"""
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from product.importer.shards import lock_key
+from product.importer.substitutes import rebuild
+from product.models import Category, Product, ProductSubstitute
+
+
+@pytest.fixture
+def catalogue(make_product):
+    """Products sharing four categories, or fewer, with a spread
+    of nutrition grades and energies
+
+    Args:
+        make_product (fixture): creates the products
+
+    Returns:
+        Product: the product whose substitutes are searched
+
+    """
+    categories = [Category.objects.create(name=f"c{index}") for index in range(5)]
+    searched = make_product("searched", "c", 900, categories[:4])
+    make_product("better", "a", 300, categories)
+    make_product("same grade", "c", 100, categories[:4])
+    make_product("fewer categories", "a", 200, categories[:3])
+    make_product("worse", "d", 100, categories[:4])
+    make_product("better and lighter", "b", 50, categories[:4])
+    make_product("duplicate energy", "a", 300, categories)
+    return Product.objects.get(pk=searched.pk)
+
+
+@pytest.mark.django_db
+def test_ranked_substitutes_match_the_query(catalogue):
+    """Valid if the ranked substitutes are those the query finds, in its order
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+    """
+    expected = [
+        (product.nutrition_grade, product.energy_100g)
+        for product in catalogue.substitutes()
+    ]
+    rebuild()
+    product = Product.objects.get(pk=catalogue.pk)
+    assert product.substitutes_computed
+    ranked = list(product.ranked_substitutes())
+    assert [(item.nutrition_grade, item.energy_100g) for item in ranked] == expected
+    assert [item.name for item in ranked][1:] == ["better and lighter", "same grade"]
+
+
+@pytest.mark.django_db
+def test_lowest_id_wins_among_equal_grade_and_energy(catalogue):
+    """Valid if the substitutes of a grade and an energy keep the product
+    with the lowest id, by the query and by the LSH buckets
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+    """
+    twins = Product.objects.filter(nutrition_grade="a", energy_100g=300)
+    lowest = min(twins.values_list("id", flat=True))
+    assert twins.count() == 2
+    call_command("build_lsh", stdout=io.StringIO())
+    product = Product.objects.get(pk=catalogue.pk)
+    for substitutes in (product.substitutes(), product.similar_substitutes()):
+        assert [item.pk for item in substitutes if item.energy_100g == 300] == [lowest]
+
+
+@pytest.mark.django_db
+def test_products_of_a_signature_keep_their_own_substitutes(catalogue):
+    """Valid if the products computed once per signature and grade find
+    the substitutes of the query, each without itself
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+    """
+    rebuild()
+    sibling = Product.objects.get(name="same grade")
+    assert sibling.category_signature == catalogue.category_signature
+    for product in Product.objects.all():
+        expected = list(product.substitutes().values_list("id", flat=True))
+        ranked = list(product.ranked_substitutes().values_list("id", flat=True))
+        assert ranked == expected
+        assert product.pk not in ranked
+
+
+@pytest.mark.django_db
+def test_category_signature_follows_the_categories(catalogue):
+    """Valid if the signature changes with the categories, on either side
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+    """
+    sibling = Product.objects.get(name="same grade")
+    worse = Product.objects.get(name="worse")
+    assert catalogue.category_signature
+    assert worse.category_signature == catalogue.category_signature
+    extra = Category.objects.create(name="extra")
+    worse.categories.add(extra)
+    worse.refresh_from_db()
+    assert worse.category_signature != catalogue.category_signature
+    extra.product_set.clear()
+    worse.refresh_from_db()
+    assert worse.category_signature == catalogue.category_signature
+    sibling.categories.clear()
+    sibling.refresh_from_db()
+    assert sibling.category_signature == ""
+
+
+@pytest.mark.django_db
+def test_row_import_refreshes_its_products_at_once(tmp_path, off_product):
+    """Valid if the products written one by one by import_off are not
+    refreshed by the signals, but by the import once it is done
+
+    Args:
+        tmp_path (fixture): temporary directory of the dump
+        off_product (fixture): builds the products of Open Food Facts
+    """
+    dump = tmp_path / "products.jsonl"
+    dump.write_text(json.dumps(off_product("p", categories="a,b,c,d,e")))
+    with CaptureQueriesContext(connection) as queries:
+        call_command("import_off", from_dump=str(dump), loader="row")
+    updates = [
+        query["sql"]
+        for query in queries.captured_queries
+        if query["sql"].lstrip().startswith("UPDATE")
+    ]
+    refreshes = [sql for sql in updates if "category_signature =" in sql]
+    refreshes += [sql for sql in updates if '"search_vector" =' in sql]
+    # the arrays twice, by the import then by the rebuild, and the vectors
+    assert len(refreshes) == 3
+    assert not [sql for sql in refreshes if "ANY" in sql]
+    product = Product.objects.get(name="p")
+    assert len(product.category_ids) == 5 and product.category_signature
+    assert product.search_vector
+
+
+@pytest.mark.django_db
+def test_ranked_substitutes_keep_the_limit(catalogue):
+    """Valid if the ranking keeps the best substitutes only
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+    """
+    assert rebuild(limit=1) == ProductSubstitute.objects.count()
+    assert list(catalogue.ranked.values_list("rank", flat=True)) == [1]
+    assert catalogue.ranked.get().substitute.energy_100g == 300
+
+
+@pytest.mark.django_db
+def test_product_imported_since_falls_back_on_the_query(catalogue, make_product):
+    """Valid if a product not ranked yet finds its substitutes live
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+        make_product (fixture): creates the products
+    """
+    rebuild()
+    newcomer = make_product("newcomer", "e", 10, catalogue.categories.all())
+    assert not newcomer.substitutes_computed
+    assert not newcomer.ranked.exists()
+    assert len(newcomer.ranked_substitutes()) == len(newcomer.substitutes()) == 5
+
+
+@pytest.mark.django_db
+def test_compute_substitutes_waits_for_the_import(catalogue, other_node):
+    """Valid if the substitutes are not ranked while an import runs
+
+    Args:
+        catalogue (fixture): product whose substitutes are searched
+        other_node (fixture): session of another node running an import
+    """
+    other_node.execute("SELECT pg_advisory_lock(%s)", [lock_key("import_off")])
+    with pytest.raises(CommandError):
+        call_command("compute_substitutes")
+    other_node.execute("SELECT pg_advisory_unlock(%s)", [lock_key("import_off")])
+    output = io.StringIO()
+    call_command("compute_substitutes", stdout=output)
+    assert f"{ProductSubstitute.objects.count()} substitutes ranked" in (
+        output.getvalue()
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory'")
+        assert cursor.fetchone()[0] == 0
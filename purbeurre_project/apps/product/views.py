@@ -1,13 +1,29 @@
 """Filter the results from Product database model
 """
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.paginator import InvalidPage
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.views.decorators.http import require_GET
 from django.views.generic import DeleteView, DetailView, ListView
 
+from product.baskets import (
+    BASKET_SUBSTITUTES,
+    MAX_BASKET,
+    MAX_PRODUCT_ID,
+    barcode,
+    basket_substitutes,
+)
+from product.bitsets import find_substitutes
+from product.importer.substitutes import SUBSTITUTES_PER_PRODUCT
 from product.models import CustomerProduct, Product
+from product.nutrients import find_nearest
+from product.pagination import EstimatedPaginator, KeysetPaginator
+from product.search import search_products
 
 
 class SearchResultsView(ListView):
@@ -23,17 +39,26 @@ class SearchResultsView(ListView):
     model = Product
     template_name = "product/search_results.html"
     paginate_by = 6
+    paginator_class = EstimatedPaginator
 
     def get_queryset(self):
-        """Retrieving specific objects with iconatains filter
+        """Retrieving specific objects with iconatains filter,
+        or by the full-text search of the names with mode=text
 
         Returns:
-            list: objects by products name
+            list: objects by products name, or by relevance
         """
         query = self.request.GET.get("q")
+        if self.request.GET.get("mode") == "text":
+            return search_products(query)
         object_list = Product.objects.filter(name__icontains=query).order_by("name")
         return object_list
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["mode"] = self.request.GET.get("mode", "")
+        return context
+
 
 class SubstituteResultsView(ListView):
     """Limit the substitute results page to filter the results
@@ -51,21 +76,49 @@ class SubstituteResultsView(ListView):
     paginate_by = 6
 
     def get_queryset(self):
-        """Retrieving specific objects with category name and lte filters
-        without the product id itself order by nutriscore and energy
+        """Retrieving the substitutes ranked after the last import,
+        or found by category name and lte filters for a product imported since,
+        or the nearest by nutriments with mode=nutrients
 
         Returns:
             list: objects by complex query
         """
         self.id = self.kwargs["product_id"]
         self.product = Product.objects.get(pk=self.id)
-        return self.product.substitutes()
+        if self.request.GET.get("mode") == "nutrients":
+            return find_nearest(self.product)
+        if settings.SUBSTITUTE_INDEX:
+            return find_substitutes(self.product)
+        return self.product.ranked_substitutes()
+
+    def paginate_queryset(self, queryset, page_size):
+        """Read the page of the cursor of the request, after the substitutes
+        of the previous pages rather than counting and skipping them
+
+        Args:
+            queryset (object): substitutes of the product
+            page_size (int): substitutes per page
+
+        Raises:
+            Http404: the cursor was altered
+
+        Returns:
+            tuple: paginator, page, substitutes of the page, and whether
+            the substitutes hold several pages
+        """
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get("cursor"))
+        except InvalidPage as error:
+            raise Http404(str(error)) from error
+        return paginator, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["search"] = self.product.name
         context["image"] = self.product.image_url
         context["product"] = self.product
+        context["mode"] = self.request.GET.get("mode", "")
         return context
 
 
@@ -115,6 +168,79 @@ def save_view(request):
     return redirect("favorites")
 
 
+def card(product):
+    """Card of a product in the JSON views
+
+    Args:
+        product (Product): product of the card
+
+    Returns:
+        dictionnary: fields of the card
+    """
+    return {
+        "id": product.pk,
+        "code": barcode(product.url),
+        "name": product.name,
+        "nutrition_grade": product.nutrition_grade,
+        "energy_100g": product.energy_100g,
+        "image": product.card_image,
+        "details": reverse("details", args=[product.pk]),
+    }
+
+
+@require_GET
+def basket_view(request):
+    """JSON view of the best substitutes of the products of a basket,
+    found in one query
+
+    Args:
+        request (object): an HttpRequest object, with the ids and the barcodes
+        of the products separated by commas, and the substitutes per product
+
+    Returns:
+        JsonResponse: substitutes of each product found, and the ids and the
+        barcodes not found
+    """
+    try:
+        ids = [int(value) for value in request.GET.get("ids", "").split(",") if value]
+        codes = [value for value in request.GET.get("codes", "").split(",") if value]
+        limit = int(request.GET.get("limit", BASKET_SUBSTITUTES))
+    except ValueError:
+        return JsonResponse({"error": "ids and limit must be integers"}, status=400)
+    # an id out of the integers of Postgres would fail the query
+    if not all(0 < value <= MAX_PRODUCT_ID for value in ids):
+        return JsonResponse(
+            {"error": f"ids must be from 1 to {MAX_PRODUCT_ID}"}, status=400
+        )
+    if not 0 < len(ids) + len(codes) <= MAX_BASKET:
+        return JsonResponse(
+            {"error": f"send from 1 to {MAX_BASKET} ids or codes"}, status=400
+        )
+    if not 0 < limit <= SUBSTITUTES_PER_PRODUCT:
+        return JsonResponse(
+            {"error": f"limit must be from 1 to {SUBSTITUTES_PER_PRODUCT}"},
+            status=400,
+        )
+    basket = basket_substitutes(ids, codes, limit)
+    products = [
+        dict(
+            card(item["product"]),
+            substitutes=[card(sub) for sub in item["substitutes"]],
+        )
+        for item in basket.values()
+    ]
+    found_codes = {product["code"] for product in products}
+    return JsonResponse(
+        {
+            "products": products,
+            "missing": {
+                "ids": [value for value in ids if value not in basket],
+                "codes": [value for value in codes if value not in found_codes],
+            },
+        }
+    )
+
+
 class FavoritesView(ListView, LoginRequiredMixin):
     """FavoritesView is designed to display favorite list data
     with a user authenticated
@@ -126,6 +252,7 @@ class FavoritesView(ListView, LoginRequiredMixin):
 
     template_name = "product/favorites.html"
     paginate_by = 6
+    paginator_class = EstimatedPaginator
 
     def get_queryset(self):
         return CustomerProduct.objects.filter(customer=self.request.user.id).order_by(
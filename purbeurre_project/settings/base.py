@@ -119,4 +119,21 @@ CRISPY_TEMPLATE_PACK = "bootstrap4"
 LOGIN_REDIRECT_URL = "home"
 LOGIN_URL = "login"
 
-INTERNAL_IPS = ["127.0.0.1"]
\ No newline at end of file
+INTERNAL_IPS = ["127.0.0.1"]
+
+# find the substitutes with the in-process category bitsets of product.bitsets,
+# reloaded in the background by each worker once older than SUBSTITUTE_INDEX_TTL
+# seconds, the stale bitsets being served meanwhile
+SUBSTITUTE_INDEX = os.environ.get("PURBEURRE_SUBSTITUTE_INDEX", "") == "1"
+SUBSTITUTE_INDEX_TTL = 300
+
+# ranking of the substitutes after each import and by compute_substitutes:
+# "overlap" for the products sharing 4 categories by grade and energy, "idf"
+# for the categories shared weighted by their rarity
+SUBSTITUTE_RANKING = os.environ.get("PURBEURRE_SUBSTITUTE_RANKING", "overlap")
+
+# count the product lists paged by number with the estimate of the planner
+# from PAGINATOR_ESTIMATE_THRESHOLD rows, smaller counts are cached for
+# PAGINATOR_COUNT_TTL seconds or until the version of the catalogue changes
+PAGINATOR_ESTIMATE_THRESHOLD = 1000
+PAGINATOR_COUNT_TTL = 300
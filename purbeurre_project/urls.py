@@ -37,6 +37,7 @@ urlpatterns = [
         "details/<int:pk>", product_views.ProductDetailsView.as_view(), name="details"
     ),
     path("save/", product_views.save_view, name="save"),
+    path("api/basket/", product_views.basket_view, name="basket"),
     path("favorites/", product_views.FavoritesView.as_view(), name="favorites"),
     path("delete/<int:pk>", product_views.DeleteView.as_view(), name="delete"),
     path("tos/", pages_views.tos, name="tos"),
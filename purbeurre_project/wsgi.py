@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'purbeurre_project.settings')
 
 application = get_wsgi_application()
+
+# the workers load the substitute index before their first request
+if settings.SUBSTITUTE_INDEX:
+    from product.bitsets import get_index
+
+    get_index()